@@ -19,17 +19,25 @@ def getDefaultCacheDir() -> str:
     return os.path.join(topdir, 'cygwin')
 
 
-def ProcessPackageFiles(builder: PMbuilder, pkgfiles: list) -> None:
-    """Execute downloading and cleaning actions for a set of package-list files"""
+def ProcessPackageFiles(builder: PMbuilder, pkgfiles: list,
+                        archs: list=None) -> None:
+    """Execute downloading and cleaning actions for a set of package-list files,
+    optionally for several system architectures concurrently"""
 
     pkgset = PackageSet(pkgfiles)
 
-    builder.BuildMirror(pkgset)
+    if archs and len(archs) > 1:
+        builder.BuildMultiArch(pkgset, archs)
+    else:
+        builder.BuildMirror(pkgset)
     garbage = builder.GetGarbage()
-    confirmer = \
-        GarbageConfirmer(garbage, default=builder.GetOption('RemoveOutdated'))
-    confirmer.ActionResponse()
+    with builder.GetRunMetrics().Phase('gc'):
+        confirmer = GarbageConfirmer(garbage,
+                                     default=builder.GetOption('RemoveOutdated'))
+        confirmer.ActionResponse()
 
     isofile = builder.GetOption('ISOfilename')
     if isofile:
         builder.BuildISO(isofile)
+
+    builder.WriteRunReport()
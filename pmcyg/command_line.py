@@ -8,10 +8,11 @@ from .core import HOST_IS_CYGWIN, PMbuilder
 from .version import PMCYG_VERSION
 
 
-def ProcessPackageFiles(builder: PMbuilder, pkgfiles: list) -> None:
+def ProcessPackageFiles(builder: PMbuilder, pkgfiles: list,
+                        archs: list=None) -> None:
     """Subsidiary program entry-point if used as command-line application"""
     try:
-        apptools.ProcessPackageFiles(builder, pkgfiles)
+        apptools.ProcessPackageFiles(builder, pkgfiles, archs)
     except Exception as ex:
         print('Fatal error during mirroring [{0}]'.format(str(ex)),
               file=sys.stderr)
@@ -28,6 +29,25 @@ def TemplateMain(builder: PMbuilder, outfile: str,
     builder.TemplateFromLists(outfile, pkgfiles, cygwinReplica)
 
 
+def CostReportMain(builder: PMbuilder, outfile: str, pkgfiles: list) -> None:
+    """Subsidiary program entry-point for reporting package download costs"""
+    builder.CostReportFromLists(outfile, pkgfiles)
+
+
+def ProbeMain(builder: PMbuilder) -> None:
+    """Subsidiary program entry-point for ranking Cygwin mirror sites"""
+    ranked = builder.ProbeMirrors()
+    history = builder.GetMirrorHistory()
+    print('# latency(ms)  throughput(kB/s)  reliability  URL')
+    for URL in ranked:
+        entry = history.Get(URL)
+        nok = entry.get('ok', 0)
+        print('{0:10.0f}  {1:16.0f}  {2:10.0%}  {3}'.format(
+                1e3 * entry.get('latency', 0),
+                entry.get('throughput', 0) / 1024,
+                nok / max(1, nok + entry.get('fail', 0)), URL))
+
+
 def GUImain(builder: PMbuilder, pkgfiles: list) -> None:
     """Subsidiary program entry-point if used as GUI application"""
 
@@ -56,9 +76,11 @@ def main() -> None:
     bscopts.add_argument('-z', '--dry-run', action='store_true', dest='dummy',
             help='Do not actually download packages')
     bscopts.add_argument('-m', '--mirror', type=str,
-            default=builder.mirror_url,
-            help='URL of Cygwin archive or mirror site'
-                 ' (default=%(default)s)')
+            action='append', default=None,
+            help='URL of Cygwin archive or mirror site, which may be'
+                ' repeated or comma-separated to download from several'
+                ' mirrors in parallel, or "auto" to choose the fastest'
+                ' mirror (default={0})'.format(builder.mirror_url))
     bscopts.add_argument('-c', '--nogui', action='store_true',
             help='Do not startup graphical user interface')
     bscopts.add_argument('-g', '--generate-template', type=str,
@@ -67,13 +89,21 @@ def main() -> None:
     bscopts.add_argument('-R', '--generate-replica', type=str,
             dest='cyg_list', default=None,
             help='Generate copy of existing Cygwin installation')
+    bscopts.add_argument('--cost-report', type=str, default=None,
+            help='Generate report of download size of each package,'
+                ' and its dependencies')
+    bscopts.add_argument('--probe-mirrors', action='store_true',
+            help='Measure the speed of all known mirror sites,'
+                ' and list them in order of preference')
     bscopts.add_argument('package_files', nargs='*',
             help='Files containins list of Cygwin packages')
 
     advopts = parser.add_argument_group('Advanced options')
     advopts.add_argument('-A', '--cygwin-arch', type=str,
-            default=builder.GetArch(),
-            help='Target system architecture (default=%(default)s)')
+            action='append', default=None,
+            help='Target system architecture, which may be repeated'
+                ' or comma-separated to build several architectures'
+                ' concurrently (default={0})'.format(builder.GetArch()))
     advopts.add_argument('-e', '--epochs', type=str,
             default=','.join(builder.GetEpochs()),
             help='Comma-separated list of epochs, e.g. "curr,prev"'
@@ -93,38 +123,120 @@ def main() -> None:
             action='store_true', default=False,
             help='Include source-code for of each package'
                  ' (default=%(default)s)')
+    advopts.add_argument('--cache-dir', type=str,
+            default=builder.GetOption('CacheDirectory'),
+            help='Where to cache parsed package databases'
+                ' (default=%(default)s)')
+    advopts.add_argument('--no-cache', action='store_true',
+            help='Do not cache parsed package databases between sessions')
+    advopts.add_argument('--store', type=str, default=None,
+            help='Directory of content-addressed package store'
+                ' which can be shared between several local mirrors'
+                ' (default=%(default)s)')
+    advopts.add_argument('--force-verify', action='store_true',
+            help='Re-check the checksums of all previously downloaded'
+                ' packages (default=%(default)s)')
+    advopts.add_argument('-j', '--jobs', type=int,
+            default=builder.GetOption('DownloadThreads'),
+            help='Number of packages to download concurrently'
+                ' (default=%(default)s)')
+    advopts.add_argument('--engine', type=str,
+            choices=('threads', 'asyncio'),
+            default=builder.GetOption('DownloadEngine'),
+            help='Mechanism for running concurrent downloads, with "asyncio"'
+                ' supporting many more transfers, adjusted according to the'
+                ' speed of each mirror (default=%(default)s)')
+    advopts.add_argument('--timeout', type=float,
+            default=builder.GetOption('ReadTimeout'),
+            help='Time (in seconds) to wait for a mirror to respond'
+                ' before abandoning a download (default=%(default)s)')
+    advopts.add_argument('--min-speed', type=float,
+            default=builder.GetOption('MinThroughput'),
+            help='Throughput (in kB/s) below which a download is'
+                ' abandoned and retried, once it has persisted for'
+                ' {0:.0f} seconds (default=%(default)s)'.format(
+                    builder.GetOption('SlowTransferTime')))
+    advopts.add_argument('--retries', type=int,
+            default=builder.GetOption('RetryAttempts') - 1,
+            help='Number of times to retry each failed download'
+                ' (default=%(default)s)')
+    advopts.add_argument('--retry-delay', type=float,
+            default=builder.GetOption('RetryDelay'),
+            help='Initial delay (in seconds) before retrying a download,'
+                ' which doubles after each failure (default=%(default)s)')
+    advopts.add_argument('--schedule', type=str,
+            choices=sorted(core.SCHEDULING_POLICIES.keys()),
+            default=builder.GetOption('SchedulingPolicy'),
+            help='Order in which to download packages (default=%(default)s)')
     advopts.add_argument('-o', '--remove-outdated', type=str,
             choices=('no', 'yes', 'ask'), default='no',
             help='Remove old versions of packages (default=%(default)s)')
     advopts.add_argument('-I', '--iso-filename', type=str, default=None,
             help='Filename for generating ISO image for burning to CD/DVD'
                 ' (default=%(default)s)')
+    advopts.add_argument('--report', type=str, default=None,
+            help='Location (without suffix) of JSON and Prometheus'
+                ' textfile reports of timings and download statistics'
+                ' (default=%(default)s)')
 
     args = parser.parse_args()
 
-    builder.SetArch(args.cygwin_arch)
+    archs = [ arch for spec in (args.cygwin_arch or [ builder.GetArch() ])
+                    for arch in spec.split(',') if arch ]
+    if len(set(archs)) > 1:
+        for (opt, val) in [ ('--generate-template', args.pkg_file),
+                            ('--generate-replica', args.cyg_list),
+                            ('--cost-report', args.cost_report) ]:
+            if val:
+                parser.error('{0} cannot be used with more than one'
+                             ' architecture'.format(opt))
+    builder.SetArch(archs[0])
     builder.SetTargetDir(args.directory)
-    builder.mirror_url = args.mirror
     builder.setup_ini_url = args.iniurl
     builder.setup_exe_url = args.exeurl
     builder.SetEpochs(args.epochs.split(','))
     builder.SetOption('DummyDownload', args.dummy)
+    builder.SetOption('DownloadThreads', args.jobs)
+    builder.SetOption('DownloadEngine', args.engine)
+    builder.SetOption('SchedulingPolicy', args.schedule)
+    builder.SetOption('RetryAttempts', 1 + max(0, args.retries))
+    builder.SetOption('ReadTimeout', args.timeout)
+    builder.SetOption('ConnectTimeout', min(args.timeout,
+                                    builder.GetOption('ConnectTimeout')))
+    builder.SetOption('MinThroughput', args.min_speed)
+    builder.SetOption('RetryDelay', args.retry_delay)
+    builder.SetOption('ForceVerify', args.force_verify)
+    builder.SetOption('PackageStore', args.store)
+    builder.SetOption('CacheDirectory',
+                      None if args.no_cache else args.cache_dir)
     builder.SetOption('AllPackages', args.all)
     builder.SetOption('IncludeBase', not args.nobase)
     builder.SetOption('MakeAutorun', args.with_autorun)
     builder.SetOption('IncludeSources', args.with_sources)
     builder.SetOption('RemoveOutdated', args.remove_outdated)
     builder.SetOption('ISOfilename', args.iso_filename)
-
-    if args.pkg_file:
+    builder.SetOption('RunReport', args.report)
+
+    mirrors = [ URL for spec in (args.mirror or [ builder.mirror_url ])
+                    for URL in spec.split(',') if URL ]
+    if 'auto' in mirrors and not args.probe_mirrors:
+        mirrors = builder.AutoSelectMirrors(mirrors)
+    builder.mirror_urls = [ URL for URL in mirrors if URL != 'auto' ] \
+                            or [ builder.mirror_url ]
+
+    if args.probe_mirrors:
+        ProbeMain(builder)
+    elif args.pkg_file:
         TemplateMain(builder, args.pkg_file, args.package_files)
     elif args.cyg_list:
         TemplateMain(builder, args.cyg_list,
                      args.package_files, cygwinReplica=True)
+    elif args.cost_report:
+        CostReportMain(builder, args.cost_report, args.package_files)
     elif gui.HASGUI and not args.nogui:
         GUImain(builder, args.package_files)
     else:
-        ProcessPackageFiles(builder, args.package_files)
+        ProcessPackageFiles(builder, args.package_files, archs)
 
 
 if __name__ == "__main__":
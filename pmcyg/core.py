@@ -18,10 +18,20 @@ Core downloading and package-list management tools for pmcyg
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import  bz2, codecs, hashlib, io, lzma, os, os.path, re, \
-        string, subprocess, sys, threading, time, \
-        urllib.request, urllib.parse, urllib.error, urllib.parse
+import  array, asyncio, bz2, codecs, collections, concurrent.futures, \
+        contextlib, copy, hashlib, heapq, http.client, io, json, lzma, os, \
+        os.path, pickle, random, re, shutil, socket, ssl, string, subprocess, \
+        sys, threading, time, urllib.request, urllib.parse, urllib.error, \
+        urllib.parse
 from .version import PMCYG_VERSION
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 
 DEFAULT_CYGWIN_ARCH = 'x86_64'
@@ -38,6 +48,28 @@ SI_TEXT_ENCODING = 'utf-8'
 HOST_IS_CYGWIN = (sys.platform == 'cygwin')
 
 
+def getUserCacheDir() -> str:
+    """Find a per-user directory suitable for caching downloaded metadata"""
+    if sys.platform.startswith('win') and os.environ.get('LOCALAPPDATA'):
+        topdir = os.path.join(os.environ['LOCALAPPDATA'], 'pmcyg')
+        return os.path.join(topdir, 'cache')
+    topdir = os.environ.get('XDG_CACHE_HOME') \
+                or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(topdir, 'pmcyg')
+
+
+def prettyFileSize(size: int) -> str:
+    """Pretty-print file size, autoscaling units"""
+    divisors = [ ( 1<<30, 'GB' ), ( 1<<20, 'MB' ), ( 1<<10, 'kB' ), ( 1, 'B' ) ]
+
+    for div, unit in divisors:
+        qsize = float(size) / div
+        if qsize > 0.8:
+            return '{0:.3g}{1}'.format(qsize, unit)
+
+    return '{0:d}B'.format(int(size))
+
+
 def ConcatShortDescription(desc: str) -> str:
     """Concatenate multi-line short package description into single line"""
     if desc:
@@ -102,6 +134,11 @@ class BuildViewer:
         self._emit('\n', (self._operation[1] & self.VRB_mask))
         self._operation = None
 
+    def showProgress(self, stats) -> None:
+        """Display the progress of downloads described by a FetchStats
+        object, or remove any such display if stats is None"""
+        pass
+
     def _emit(self, text: str, ctrl: int) -> None:
         if (ctrl & self.VRB_mask) > self._verbThresh:
             return
@@ -118,11 +155,29 @@ class SilentBuildViewer(BuildViewer):
 
 
 class ConsoleBuildViewer(BuildViewer):
-    """Status-message observer using stdout/stderr."""
+    """Status-message observer using stdout/stderr,
+    with download progress shown on a single line of an interactive terminal."""
     def __init__(self):
         BuildViewer.__init__(self)
+        self._progressWidth = 0
+
+    def showProgress(self, stats):
+        if not (sys.stderr.isatty() or self._progressWidth):
+            return
+        lead = ''
+        if self._operation and sys.stdout.isatty():
+            # Redraw the announcement of the current operation:
+            lead = '{0}...'.format(self._operation[0])
+        text = '  [{0}]'.format(stats.Describe()) if stats else ''
+        sys.stderr.write('\r{0}{1:<{2}s}\r{0}{3}'.format(lead, '',
+                                                self._progressWidth, text))
+        sys.stderr.flush()
+        self._progressWidth = len(text)
 
     def _output(self, text, severity):
+        if self._progressWidth:
+            self.showProgress(None)
+
         stream = sys.stdout
         if severity > self.SEV_NORMAL:
             stream = sys.stderr
@@ -131,6 +186,44 @@ class ConsoleBuildViewer(BuildViewer):
         stream.flush()
 
 
+class PrefixedBuildViewer(BuildViewer):
+    """Status-message observer for one of several concurrent activities,
+    which forwards whole lines, labelled with a prefix, to a shared viewer.
+
+    Operations are only reported once complete, so that
+    lines from different activities cannot be interleaved."""
+    def __init__(self, Viewer: BuildViewer, prefix: str,
+                 lock: threading.Lock=None) -> None:
+        BuildViewer.__init__(self)
+        self._target = Viewer
+        self._prefix = prefix
+        self._lock = lock or threading.Lock()
+
+    def message(self, text: str, ctrl: int=BuildViewer.SEV_NORMAL
+                                            | BuildViewer.VRB_MEDIUM) -> None:
+        with self._lock:
+            self._target.message('[{0}] {1}'.format(self._prefix, text), ctrl)
+
+    def startOperation(self, text: str,
+                       ctrl: int=BuildViewer.VRB_MEDIUM) -> None:
+        self._operation = (text, ((ctrl & self.VRB_mask) | self.SEV_NORMAL))
+
+    def endOperation(self, text: str, ctrl: int=BuildViewer.SEV_NORMAL) -> None:
+        if not self._operation:
+            return
+        (optext, opctrl) = self._operation
+        self._operation = None
+        self.message('{0}... {1}'.format(optext, text),
+                     ((ctrl & self.SEV_mask) | (opctrl & self.VRB_mask)))
+
+    def flushOperation(self) -> None:
+        if not self._operation:
+            return
+        (optext, opctrl) = self._operation
+        self._operation = None
+        self.message('{0}...'.format(optext), opctrl)
+
+
 
 class BuildReporter:
     """Mixin class for hosting a BuildViewer object."""
@@ -146,35 +239,771 @@ class BuildReporter:
         self._statview = Viewer
 
 
+##
+## Network transport
+##
+
+class ConnectionPool:
+    """Cache of persistent HTTP(S) connections to mirror sites,
+    allowing many small files to be fetched from the same host
+    without repeating the TCP/TLS handshake for each of them.
+
+    URLs using other schemes (e.g. file: or ftp:), or which must be
+    reached via a proxy, are delegated to urllib.request.urlopen().
+    The pool may be shared between threads."""
+
+    MaxRedirects = 5
+    MaxErrorBody = 1 << 16
+    Redirections = { 301, 302, 303, 307, 308 }
+
+    def __init__(self, maxIdle: int=8) -> None:
+        self._lock = threading.Lock()
+        self._idle: dict = {}
+        self._maxIdle = maxIdle
+        self._headers = { 'User-Agent': 'pmcyg/' + PMCYG_VERSION }
+        self._connectTimeout = None
+        self._readTimeout = None
+
+    def SetTimeouts(self, connect: float=None, read: float=None) -> None:
+        """Limit the time (in seconds) spent waiting for a connection
+        to be established, and for each subsequent read from it,
+        with None indicating no limit"""
+        self._connectTimeout = connect or None
+        self._readTimeout = read or None
+
+    def Open(self, URL: str, headers: dict=None):
+        """Issue a GET request for the given URL, returning a file-like
+        response object, which should be closed after use to allow
+        its connection to be reused."""
+        reqheaders = dict(self._headers)
+        if headers:
+            reqheaders.update(headers)
+
+        for redirect in range(self.MaxRedirects + 1):
+            parts = urllib.parse.urlsplit(URL)
+            if not self._isPoolable(parts):
+                req = urllib.request.Request(URL, headers=reqheaders)
+                timeout = self._readTimeout or self._connectTimeout
+                if timeout:
+                    return urllib.request.urlopen(req, timeout=timeout)
+                return urllib.request.urlopen(req)
+
+            key = (parts.scheme, parts.hostname, parts.port)
+            selector = urllib.parse.urlunsplit(('', '', parts.path or '/',
+                                                parts.query, ''))
+            (conn, resp) = self._request(key, selector, reqheaders)
+
+            if resp.status in self.Redirections:
+                location = resp.getheader('Location')
+                self._discard(key, conn, resp)
+                if not location:
+                    break
+                URL = urllib.parse.urljoin(URL, location)
+                continue
+
+            if resp.status >= 400:
+                self._discard(key, conn, resp)
+                raise urllib.error.HTTPError(URL, resp.status, resp.reason,
+                                             resp.headers, None)
+
+            return PooledResponse(self, key, conn, resp, URL)
+
+        raise urllib.error.URLError('Too many redirections from ' + URL)
+
+    def Close(self) -> None:
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request(self, key, selector, headers):
+        """Send request via a (possibly reused) connection,
+        retrying once on a fresh connection if an idle connection
+        has been dropped by the server."""
+        (conn, reused) = self._checkout(key)
+        while True:
+            try:
+                conn.timeout = self._connectTimeout
+                conn.request('GET', selector, headers=headers)
+                if conn.sock:
+                    conn.sock.settimeout(self._readTimeout)
+                return (conn, conn.getresponse())
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if not reused:
+                    raise
+            except socket.timeout:
+                conn.close()
+                raise
+            (conn, reused) = (self._connect(key), False)
+
+    def _checkout(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                return (conns.pop(), True)
+        return (self._connect(key), False)
+
+    def _checkin(self, key, conn) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self._maxIdle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key):
+        (scheme, host, port) = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port)
+        else:
+            return http.client.HTTPConnection(host, port)
+
+    def _discard(self, key, conn, resp) -> None:
+        """Dispose of an unwanted response, reusing its connection
+        if the response body is small enough to drain cheaply."""
+        if resp.length is not None and resp.length <= self.MaxErrorBody:
+            resp.read()
+        PooledResponse(self, key, conn, resp).close()
+
+    @staticmethod
+    def _isPoolable(parts) -> bool:
+        if not parts.scheme in ('http', 'https'):
+            return False
+        proxies = urllib.request.getproxies()
+        if parts.scheme in proxies \
+                and not urllib.request.proxy_bypass(parts.hostname or ''):
+            return False
+        return True
+
+
+class PooledResponse:
+    """File-like wrapper around an HTTP response from a ConnectionPool,
+    which returns its connection to the pool when closed."""
+
+    def __init__(self, pool: ConnectionPool, key, conn, resp,
+                 URL: str=None) -> None:
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = URL
+        self.status = resp.status
+        self.headers = resp.headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __iter__(self):
+        return iter(self._resp)
+
+    def geturl(self) -> str:
+        return self.url
+
+    def getheader(self, name: str, default=None):
+        return self._resp.getheader(name, default)
+
+    def read(self, amt: int=None) -> bytes:
+        return self._resp.read(amt)
+
+    def read1(self, amt: int=-1) -> bytes:
+        data = self._resp.read1(amt)
+        if not data:
+            # Ensure that response is marked as complete:
+            self._resp.read()
+        return data
+
+    def readline(self, limit: int=-1) -> bytes:
+        return self._resp.readline(limit)
+
+    def close(self) -> None:
+        if not self._conn:
+            return
+        (conn, self._conn) = (self._conn, None)
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._pool._checkin(self._key, conn)
+        else:
+            self._resp.close()
+            conn.close()
+
+
+class HostThrottle:
+    """Limit on the number of concurrent asyncio transfers from
+    a single mirror host, adjusted by additive-increase and
+    multiplicative-decrease according to the host's behaviour.
+
+    The limit is halved (at most once per measurement window) whenever
+    the host signals overload, e.g. via HTTP status 429/503 or by
+    resetting connections, and is raised by one whenever all slots
+    are busy and the aggregate throughput over the latest window
+    improves upon that of the preceding window."""
+
+    Window = 2.0
+    Improvement = 1.05
+
+    def __init__(self, initial: int=4, minimum: int=1,
+                 maximum: int=64) -> None:
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self._active = 0
+        self._waiters = collections.deque()
+        self._windowStart = time.monotonic()
+        self._windowBytes = 0
+        self._lastRate = 0.0
+        self._lastBackoff = None
+
+    async def Acquire(self) -> None:
+        """Wait until a transfer slot is available, and claim it"""
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.Release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def Release(self) -> None:
+        """Return a transfer slot claimed via Acquire()"""
+        self._active -= 1
+        self._wake()
+
+    def RecordTransfer(self, nbytes: int) -> None:
+        """Note the arrival of data from the host,
+        raising the limit if throughput is still improving"""
+        self._windowBytes += nbytes
+        now = time.monotonic()
+        elapsed = now - self._windowStart
+        if elapsed < self.Window:
+            return
+        rate = self._windowBytes / elapsed
+        if rate > self.Improvement * self._lastRate \
+                and self._active >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+            self._wake()
+        self._lastRate = rate
+        (self._windowStart, self._windowBytes) = (now, 0)
+
+    def Backoff(self) -> None:
+        """Reduce the limit following a sign of overload from the host"""
+        now = time.monotonic()
+        if self._lastBackoff is not None \
+                and now - self._lastBackoff < self.Window:
+            return
+        self.limit = max(self.minimum, self.limit // 2)
+        self._lastBackoff = now
+        self._lastRate = 0.0
+        (self._windowStart, self._windowBytes) = (now, 0)
+
+    def _wake(self) -> None:
+        while self._waiters and self._active < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+
+class AsyncHTTPClient:
+    """Minimal HTTP/1.1 client built on asyncio streams, which keeps
+    idle connections open for reuse by later requests to the same host,
+    and maintains a HostThrottle for each host that it contacts.
+
+    Only direct HTTP(S) connections are supported, with other URLs
+    (e.g. file:, ftp:, or those reached via a proxy) expected to be
+    fetched via a ConnectionPool within a worker thread."""
+
+    MaxRedirects = 5
+    MaxErrorBody = 1 << 16
+    Redirections = { 301, 302, 303, 307, 308 }
+    OverloadCodes = { 429, 503 }
+
+    def __init__(self, maxIdle: int=8, initialTransfers: int=4,
+                 maxTransfers: int=64) -> None:
+        self._idle: dict = {}
+        self._maxIdle = maxIdle
+        self._throttles: dict = {}
+        self._initialTransfers = initialTransfers
+        self._maxTransfers = maxTransfers
+        self._headers = { 'User-Agent': 'pmcyg/' + PMCYG_VERSION }
+        self._connectTimeout = None
+        self._readTimeout = None
+        self._sslContext = None
+
+    def SetTimeouts(self, connect: float=None, read: float=None) -> None:
+        """Limit the time (in seconds) spent waiting for a connection
+        to be established, and for each subsequent read from it"""
+        self._connectTimeout = connect or None
+        self._readTimeout = read or None
+
+    @staticmethod
+    def Handles(URL: str) -> bool:
+        """Check whether a URL can be fetched directly by this client"""
+        return ConnectionPool._isPoolable(urllib.parse.urlsplit(URL))
+
+    def Throttle(self, URL: str) -> HostThrottle:
+        """Find the concurrency limit applying to the host of a URL"""
+        parts = urllib.parse.urlsplit(URL)
+        key = (parts.scheme, parts.hostname, parts.port)
+        throttle = self._throttles.get(key)
+        if throttle is None:
+            throttle = HostThrottle(self._initialTransfers,
+                                    maximum=self._maxTransfers)
+            self._throttles[key] = throttle
+        return throttle
+
+    @classmethod
+    def IsOverload(cls, ex: Exception) -> bool:
+        """Check whether a failed request suggests that the host is
+        overloaded, and that fewer concurrent requests should be made"""
+        if isinstance(ex, urllib.error.HTTPError):
+            return ex.code in cls.OverloadCodes
+        return isinstance(ex, (ConnectionError, TimeoutError,
+                               asyncio.TimeoutError,
+                               asyncio.IncompleteReadError,
+                               http.client.HTTPException))
+
+    async def Open(self, URL: str, headers: dict=None):
+        """Issue a GET request for the given URL, returning an
+        AsyncResponse, which should be closed after use"""
+        reqheaders = dict(self._headers)
+        if headers:
+            reqheaders.update(headers)
+
+        for redirect in range(self.MaxRedirects + 1):
+            parts = urllib.parse.urlsplit(URL)
+            if parts.scheme not in ('http', 'https'):
+                break
+            key = (parts.scheme, parts.hostname,
+                   parts.port or (443 if parts.scheme == 'https' else 80))
+            selector = urllib.parse.urlunsplit(('', '', parts.path or '/',
+                                                parts.query, ''))
+            reqheaders['Host'] = parts.netloc
+            resp = await self._request(key, selector, reqheaders, URL)
+
+            if resp.status in self.Redirections:
+                location = resp.headers.get('Location')
+                await resp.Discard()
+                if not location:
+                    break
+                URL = urllib.parse.urljoin(URL, location)
+                continue
+
+            if resp.status >= 400:
+                await resp.Discard()
+                raise urllib.error.HTTPError(URL, resp.status, resp.reason,
+                                             resp.headers, None)
+
+            return resp
+
+        raise urllib.error.URLError('Unable to fetch ' + URL)
+
+    async def Close(self) -> None:
+        """Close all idle connections"""
+        (idle, self._idle) = (self._idle, {})
+        for conns in idle.values():
+            for (reader, writer) in conns:
+                writer.close()
+
+    async def _request(self, key, selector, headers, URL):
+        """Send request via a (possibly reused) connection,
+        retrying once on a fresh connection if an idle connection
+        has been dropped by the server."""
+        conns = self._idle.get(key)
+        (conn, reused) = (conns.pop(), True) if conns else \
+                            (await self._connect(key), False)
+        request = 'GET {0} HTTP/1.1\r\n'.format(selector) \
+                    + ''.join('{0}: {1}\r\n'.format(field, value)
+                              for field, value in headers.items()) + '\r\n'
+        while True:
+            try:
+                conn[1].write(request.encode('latin-1'))
+                await conn[1].drain()
+                return await self._readHead(key, conn, URL)
+            except (ConnectionError, asyncio.IncompleteReadError,
+                    http.client.HTTPException):
+                conn[1].close()
+                if not reused:
+                    raise
+            except:
+                conn[1].close()
+                raise
+            (conn, reused) = (await self._connect(key), False)
+
+    async def _connect(self, key):
+        (scheme, host, port) = key
+        context = None
+        if scheme == 'https':
+            if self._sslContext is None:
+                self._sslContext = ssl.create_default_context()
+            context = self._sslContext
+        return await asyncio.wait_for(
+                        asyncio.open_connection(host, port, ssl=context),
+                        self._connectTimeout)
+
+    async def _readHead(self, key, conn, URL):
+        """Read the status-line and headers of an HTTP response"""
+        statusline = await self._readline(conn[0])
+        if not statusline:
+            raise http.client.RemoteDisconnected('Remote end closed'
+                                                 ' connection without response')
+        try:
+            (version, status, reason) = (statusline.decode('latin-1')
+                                            .rstrip('\r\n').split(None, 2)
+                                            + [ '' ])[:3]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(statusline)
+
+        lines = []
+        while True:
+            line = await self._readline(conn[0])
+            lines.append(line)
+            if line in (b'\r\n', b'\n', b''):
+                break
+        headers = http.client.parse_headers(io.BytesIO(b''.join(lines)))
+        return AsyncResponse(self, key, conn, version, status, reason,
+                             headers, URL)
+
+    async def _readline(self, reader) -> bytes:
+        return await asyncio.wait_for(reader.readline(), self._readTimeout)
+
+    async def _read(self, reader, amt: int) -> bytes:
+        return await asyncio.wait_for(reader.read(amt), self._readTimeout)
+
+    def _checkin(self, key, conn) -> None:
+        conns = self._idle.setdefault(key, [])
+        if len(conns) < self._maxIdle:
+            conns.append(conn)
+        else:
+            conn[1].close()
+
+
+class AsyncResponse:
+    """Body of an HTTP response received via an AsyncHTTPClient,
+    supporting both fixed-length and chunked transfer-encodings,
+    which returns its connection to the client once fully read."""
+
+    def __init__(self, client: AsyncHTTPClient, key, conn, version: str,
+                 status: int, reason: str, headers, URL: str=None) -> None:
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self.url = URL
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+        connection = (headers.get('Connection') or '').lower()
+        self._keepalive = (version == 'HTTP/1.1' and connection != 'close') \
+                            or connection == 'keep-alive'
+        self._chunked = 'chunked' in (headers.get('Transfer-Encoding')
+                                        or '').lower()
+        self._remaining = None
+        self._chunkLeft = 0
+        if not self._chunked and headers.get('Content-Length'):
+            self._remaining = int(headers.get('Content-Length'))
+        if status in (204, 304) or (status < 200):
+            self._remaining = 0
+        if self._remaining is None and not self._chunked:
+            self._keepalive = False
+        if self._remaining == 0:
+            self._finish()
+
+    def geturl(self) -> str:
+        return self.url
+
+    async def read(self, amt: int=1<<16) -> bytes:
+        """Read up to the given number of bytes from the response body,
+        returning an empty string once the body is exhausted"""
+        if not self._conn:
+            return b''
+        reader = self._conn[0]
+
+        if self._chunked:
+            if not self._chunkLeft:
+                line = await self._client._readline(reader)
+                try:
+                    self._chunkLeft = int(line.split(b';')[0], 16)
+                except ValueError:
+                    raise http.client.IncompleteRead(b'')
+                if not self._chunkLeft:
+                    while (await self._client._readline(reader)) \
+                                not in (b'\r\n', b'\n', b''):
+                        pass
+                    self._finish()
+                    return b''
+            data = await self._client._read(reader,
+                                            min(amt, self._chunkLeft))
+            if not data:
+                raise http.client.IncompleteRead(b'', self._chunkLeft)
+            self._chunkLeft -= len(data)
+            if not self._chunkLeft:
+                await self._client._readline(reader)
+            return data
+
+        if self._remaining is not None:
+            amt = min(amt, self._remaining)
+        data = await self._client._read(reader, amt)
+        if self._remaining is not None:
+            if not data:
+                raise http.client.IncompleteRead(b'', self._remaining)
+            self._remaining -= len(data)
+            if not self._remaining:
+                self._finish()
+        elif not data:
+            self._finish()
+        return data
+
+    async def Discard(self) -> None:
+        """Dispose of an unwanted response, reusing its connection
+        if the response body is small enough to drain cheaply."""
+        if self._remaining is not None \
+                and self._remaining <= AsyncHTTPClient.MaxErrorBody:
+            try:
+                while await self.read():
+                    pass
+            except Exception:
+                pass
+        self.close()
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn[1].close()
+            self._conn = None
+
+    def _finish(self) -> None:
+        (conn, self._conn) = (self._conn, None)
+        if conn and self._keepalive:
+            self._client._checkin(self._key, conn)
+        elif conn:
+            conn[1].close()
+
+
+def GetValidators(stream) -> dict:
+    """Extract HTTP cache-validation headers from a response"""
+    validators = {}
+    headers = getattr(stream, 'headers', None)
+    if headers:
+        for field in ('ETag', 'Last-Modified', 'Content-Length'):
+            value = headers.get(field)
+            if value:
+                validators[field] = value
+    return validators
+
+
+def ConditionalHeaders(validators: dict) -> dict:
+    """Construct HTTP request headers for a conditional GET,
+    given the validators of a previously downloaded resource"""
+    headers = {}
+    if validators:
+        if validators.get('ETag'):
+            headers['If-None-Match'] = validators['ETag']
+        if validators.get('Last-Modified'):
+            headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+
+def IsUnmodified(stream, validators: dict) -> bool:
+    """Check whether a response indicates that a resource is unchanged
+    since the given validators were recorded, either explicitly via
+    HTTP status 304, or by supplying identical validators."""
+    if getattr(stream, 'status', None) == 304:
+        return True
+    if not validators or not ('ETag' in validators
+                              or 'Last-Modified' in validators):
+        return False
+    return (GetValidators(stream) == validators)
+
+
+
+class ValidatedCopy:
+    """Local copy of a remote file, accompanied by a hidden sidecar
+    recording the HTTP validators (ETag, Last-Modified) of the version
+    from which it was downloaded, so that it can be refreshed cheaply
+    via conditional GET requests."""
+
+    SidecarPrefix = '.pmcyg-'
+
+    def __init__(self, URL: str, path: str, pool=None) -> None:
+        self._url = URL
+        self._path = path
+        self._pool = pool if pool else ConnectionPool()
+        self._validators: dict = {}
+
+    def GetPath(self) -> str:
+        return self._path
+
+    def GetValidators(self) -> dict:
+        return self._validators
+
+    def Refresh(self, blksize=1<<16) -> bool:
+        """Ensure the local copy is up to date, returning True
+        if the existing local file could be reused unchanged"""
+        meta = self._loadSidecar()
+        validators = meta.get('validators') if meta else None
+
+        try:
+            stream = self._pool.Open(self._url, ConditionalHeaders(validators))
+        except urllib.error.HTTPError as ex:
+            if ex.code != 304 or not validators:
+                raise
+            self._validators = validators
+            self._saveSidecar()
+            return True
+
+        with stream:
+            if validators and IsUnmodified(stream, validators):
+                self._validators = validators
+                self._saveSidecar()
+                return True
+
+            tgtdir = os.path.dirname(self._path)
+            if tgtdir:
+                os.makedirs(tgtdir, exist_ok=True)
+            tmppath = '{0}.{1:d}.tmp'.format(self._path, os.getpid())
+            with open(tmppath, 'wb') as fp:
+                while True:
+                    chunk = stream.read(blksize)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+            os.replace(tmppath, self._path)
+            self._validators = GetValidators(stream)
+
+        self._saveSidecar()
+        return False
+
+    def IsFresh(self, maxAge: float) -> bool:
+        """Check whether the local copy was refreshed within
+        the given number of seconds"""
+        meta = self._loadSidecar()
+        if not meta:
+            return False
+        return (0 <= time.time() - meta.get('checked', 0) < maxAge)
+
+    def _sidecarPath(self) -> str:
+        (dirname, basename) = os.path.split(self._path)
+        return os.path.join(dirname,
+                            '{0}{1}.json'.format(self.SidecarPrefix, basename))
+
+    def _loadSidecar(self):
+        """Read the recorded validators, provided that the local file
+        has not been modified since they were recorded"""
+        try:
+            with open(self._sidecarPath(), 'rt', encoding='utf-8') as fp:
+                meta = json.load(fp)
+            st = os.stat(self._path)
+            if meta['url'] == self._url and meta['size'] == st.st_size \
+                    and meta['mtime'] == st.st_mtime_ns:
+                return meta
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _saveSidecar(self) -> None:
+        st = os.stat(self._path)
+        meta = { 'url':         self._url,
+                 'size':        st.st_size,
+                 'mtime':       st.st_mtime_ns,
+                 'checked':     time.time(),
+                 'validators':  self._validators }
+        try:
+            with open(self._sidecarPath(), 'wt', encoding='utf-8') as fp:
+                json.dump(meta, fp)
+        except OSError:
+            pass
+
+
 
 class SetupIniFetcher:
-    """Facade for fetching setup.ini from URL, with optional decompression"""
-    MaxIniFileLength = 1 << 26
+    """Facade for fetching setup.ini from URL, with optional decompression
 
-    Decompressors = { 'bz2':    bz2.decompress,
-                      'xz':     lzma.decompress }
+    If a ValidatedCopy is supplied, this is refreshed and then read
+    in place of fetching the URL directly, with 'unchanged' indicating
+    whether the local copy was reused. The content is decompressed
+    and decoded incrementally, one block at a time, as lines are read."""
 
-    def __init__(self, URL):
-        self._buffer = None
+    Decompressors = { 'bz2':    bz2.BZ2Decompressor,
+                      'xz':     lzma.LZMADecompressor }
+
+    def __init__(self, URL, pool=None, localCopy=None, blksize=1<<16):
+        self._stream = None
+        self.unchanged = False
         suffix = URL.rsplit('.', 1)[-1]
-        expander = self.Decompressors.get(suffix, (lambda x: x))
-        with urllib.request.urlopen(URL) as stream:
-            rawfile = expander(stream.read(self.MaxIniFileLength))
+        self._decompressor = self.Decompressors.get(suffix)
+
+        if localCopy:
+            self.unchanged = localCopy.Refresh()
+            self.validators = localCopy.GetValidators()
+            self._stream = open(localCopy.GetPath(), 'rb')
+        else:
+            if not pool:
+                pool = ConnectionPool()
+            self._stream = pool.Open(URL)
+            self.validators = GetValidators(self._stream)
 
-        self._buffer = io.StringIO(rawfile.decode(SI_TEXT_ENCODING, 'ignore'))
+        self._lines = self._iterLines(blksize)
 
     def __del__(self):
-        if self._buffer:
-            self._buffer.close()
+        self.close()
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return next(self._buffer)
+        return next(self._lines)
 
     def close(self):
-        self._buffer.close()
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+    def _iterLines(self, blksize):
+        """Split decoded text into lines, each retaining its newline"""
+        decoder = codecs.getincrementaldecoder(SI_TEXT_ENCODING)('ignore')
+        pending = ''
+        for chunk in self._iterBlocks(blksize):
+            lines = (pending + decoder.decode(chunk)).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
+    def _iterBlocks(self, blksize):
+        """Read and decompress the raw stream, one block at a time"""
+        expander = self._decompressor() if self._decompressor else None
+        while self._stream:
+            data = self._stream.read(blksize)
+            if not data:
+                break
+            if not expander:
+                yield data
+                continue
+            while data:
+                # Bound the output from each step, so that highly compressible
+                # input does not inflate into one large buffer:
+                yield expander.decompress(data, blksize)
+                while not (expander.eof or expander.needs_input):
+                    yield expander.decompress(b'', blksize)
+                data = b''
+                if expander.eof:
+                    # Any further compressed streams are decoded in turn:
+                    data = expander.unused_data
+                    expander = self._decompressor()
+        self.close()
 
 
 
@@ -188,7 +1017,7 @@ class HashChecker:
     len2alg: dict = {}
 
     def __call__(self, path, tgthash, blksize=1<<14):
-        hasher = self._guessHashAlg(tgthash)
+        hasher = self.Hasher(tgthash)
 
         try:
             with open(path, 'rb') as fp:
@@ -200,9 +1029,17 @@ class HashChecker:
         except:
             return False
 
-        filehash = hasher.hexdigest().lower()
+        return self.Matches(hasher, tgthash)
 
-        return (filehash == tgthash.lower())
+    def Hasher(self, tgthash):
+        """Construct a digest object suitable for checking the given hash,
+        which can be fed incrementally with data as it is downloaded."""
+        return self._guessHashAlg(tgthash)
+
+    @staticmethod
+    def Matches(hasher, tgthash) -> bool:
+        """Check whether a digest object matches the target hash-code"""
+        return (hasher.hexdigest().lower() == tgthash.lower())
 
     @classmethod
     def _guessHashAlg(cls, tgthash):
@@ -227,6 +1064,767 @@ class HashChecker:
 
 
 
+class VerifiedIndex:
+    """Persistent record of package files whose checksums have already
+    been verified, stored within the top-level directory of a local mirror.
+
+    Each entry is keyed by the path of a file relative to that directory,
+    and remembers the size, modification time, inode and hash-code
+    of the file when it was verified. A file whose metadata is unchanged
+    need not be re-read in order to be trusted on a subsequent run."""
+
+    Filename = ValidatedCopy.SidecarPrefix + 'verified.json'
+    FormatVersion = 1
+
+    def __init__(self, topdir: str) -> None:
+        self._topdir = topdir
+        self._lock = threading.Lock()
+        self._entries: dict = {}
+        self._dirty = False
+
+    def GetPath(self) -> str:
+        return os.path.join(self._topdir, self.Filename)
+
+    def Load(self) -> None:
+        """Read index from disk, silently ignoring absent or corrupt files"""
+        entries = {}
+        try:
+            with open(self.GetPath(), 'rt', encoding='utf-8') as fp:
+                content = json.load(fp)
+            if content.get('version') == self.FormatVersion:
+                entries = content['entries']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        with self._lock:
+            self._entries = entries
+            self._dirty = False
+
+    def Save(self) -> None:
+        """Atomically write index to disk, if it has been modified"""
+        with self._lock:
+            if not self._dirty:
+                return
+            content = { 'version': self.FormatVersion,
+                        'entries': self._entries }
+            path = self.GetPath()
+            tmppath = path + '.tmp'
+            with open(tmppath, 'wt', encoding='utf-8') as fp:
+                json.dump(content, fp, separators=(',', ':'))
+            os.replace(tmppath, path)
+            self._dirty = False
+
+    def IsVerified(self, path: str, tgthash: str) -> bool:
+        """Check whether a file has previously been verified
+        against the given hash-code, and has not since been modified."""
+        key = self._relPath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if not entry:
+            return False
+        try:
+            return (entry == self._describe(path, tgthash))
+        except OSError:
+            return False
+
+    def Record(self, path: str, tgthash: str) -> None:
+        """Mark a file as having been verified against a hash-code"""
+        key = self._relPath(path)
+        try:
+            entry = self._describe(path, tgthash)
+        except OSError:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._dirty = True
+
+    def Discard(self, path: str) -> None:
+        """Forget any previous verification of a file"""
+        key = self._relPath(path)
+        with self._lock:
+            if self._entries.pop(key, None):
+                self._dirty = True
+
+    def Clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._dirty = True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _relPath(self, path: str) -> str:
+        relpath = os.path.relpath(path, self._topdir)
+        return relpath.replace(os.sep, '/')
+
+    @staticmethod
+    def _describe(path: str, tgthash: str) -> list:
+        st = os.stat(path)
+        return [ st.st_size, st.st_mtime_ns, st.st_ino, tgthash.lower() ]
+
+
+class FetchRegistry:
+    """Record of package files claimed for downloading by a group of
+    PMbuilders sharing a single local mirror, such that files referenced
+    by several architectures (e.g. beneath 'noarch/') are fetched only once.
+
+    The first builder to claim a file becomes responsible for fetching it,
+    while any others wait for its outcome. Failed downloads are forgotten,
+    so that they can be claimed again on a subsequent attempt."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._claims: dict = {}
+
+    def Claim(self, tgtpath: str):
+        """Register interest in a file, returning a Future that will hold
+        the outcome of its download, and whether the caller owns that Future"""
+        with self._lock:
+            claim = self._claims.get(tgtpath)
+            if claim is not None:
+                return (claim, False)
+            claim = concurrent.futures.Future()
+            self._claims[tgtpath] = claim
+            return (claim, True)
+
+    def Release(self, tgtpath: str, claim, outcome, succeeded: bool) -> None:
+        """Publish the outcome of downloading a previously claimed file"""
+        if not succeeded:
+            with self._lock:
+                if self._claims.get(tgtpath) is claim:
+                    del self._claims[tgtpath]
+        claim.set_result(outcome)
+
+
+class PackageStore:
+    """Content-addressed repository of package files, keyed by their
+    hash-codes, which can be shared between several local mirrors
+    (and concurrent pmcyg processes) to avoid repeated downloading
+    of identical packages.
+
+    Files are materialised within each local mirror via a hard link
+    where possible, or otherwise via a copy-on-write clone or plain copy.
+    Entries are considered to be in use while hard-linked elsewhere,
+    and entries which have ever been cloned or copied are always
+    retained, as their other users cannot be traced."""
+
+    # Linux ioctl for copy-on-write cloning of files:
+    FICLONE = 0x40049409
+
+    # Marker of entries which have been shared other than by hard links:
+    CopiedSuffix = '.copied'
+
+    # Names of entries (md5 or sha512 hash-codes) and their associated files:
+    EntryPattern = re.compile(r'^([0-9a-f]{32}|[0-9a-f]{128})'
+                              r'(\.lock|\.copied|\.[0-9]+-[0-9]+\.tmp)?$')
+
+    # Age (in seconds) beyond which temporary files are assumed abandoned:
+    StaleTime = 86400
+
+    def __init__(self, topdir: str) -> None:
+        self._topdir = topdir
+
+    def GetTopDir(self) -> str:
+        return self._topdir
+
+    def GetPath(self, pkghash: str) -> str:
+        """Find the location of the entry for a given hash-code"""
+        pkghash = pkghash.lower()
+        algo = HashChecker().Hasher(pkghash).name
+        return os.path.join(self._topdir, algo, pkghash[:2], pkghash)
+
+    def Contains(self, pkghash: str, pkgsize: int=None) -> bool:
+        try:
+            size = os.path.getsize(self.GetPath(pkghash))
+        except OSError:
+            return False
+        return (pkgsize is None or size == pkgsize)
+
+    @contextlib.contextmanager
+    def Locked(self, pkghash: str):
+        """Obtain exclusive access to the entry for a given hash-code,
+        excluding other threads and processes sharing the store"""
+        lockpath = self.GetPath(pkghash) + '.lock'
+        os.makedirs(os.path.dirname(lockpath), exist_ok=True)
+        while True:
+            fp = open(lockpath, 'a+b')
+            self._lockFile(fp, True)
+            # Retry if the lock-file was removed by Prune() while waiting:
+            try:
+                if os.path.samestat(os.fstat(fp.fileno()),
+                                    os.stat(lockpath)):
+                    break
+            except OSError:
+                pass
+            self._lockFile(fp, False)
+            fp.close()
+        with fp:
+            try:
+                yield
+            finally:
+                self._lockFile(fp, False)
+
+    def Insert(self, srcpath: str, pkghash: str) -> bool:
+        """Add a (previously validated) file to the store,
+        returning False if the store could not be updated"""
+        path = self.GetPath(pkghash)
+        if os.path.isfile(path):
+            return True
+        tmppath = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmppath = self._tmpPath(path)
+            linked = self._clone(srcpath, tmppath)
+            os.replace(tmppath, path)
+            if not linked:
+                self._markCopied(path)
+        except OSError:
+            if tmppath and os.path.isfile(tmppath):
+                os.remove(tmppath)
+            return False
+        return True
+
+    def Materialise(self, pkghash: str, tgtpath: str,
+                    pkgsize: int=None) -> bool:
+        """Create a copy of a stored file at the given location,
+        returning False if no such file is available"""
+        if not self.Contains(pkghash, pkgsize):
+            return False
+        path = self.GetPath(pkghash)
+        tmppath = self._tmpPath(tgtpath)
+        try:
+            linked = self._clone(path, tmppath)
+            os.replace(tmppath, tgtpath)
+            if not linked:
+                self._markCopied(path)
+        except OSError:
+            if os.path.isfile(tmppath):
+                os.remove(tmppath)
+            return False
+        return True
+
+    def Evict(self, pkghash: str) -> None:
+        """Remove the entry for a given hash-code,
+        e.g. if its contents are found to be corrupt"""
+        path = self.GetPath(pkghash)
+        for fname in (path, path + self.CopiedSuffix):
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+    def Prune(self) -> int:
+        """Remove entries no longer hard-linked into any local mirror,
+        together with their lock-files and any abandoned temporary files,
+        returning the number of entries removed
+
+        Files not following the layout of the store are left untouched."""
+        npruned = 0
+        stale = time.time() - self.StaleTime
+        for dirpath, dirnames, filenames in os.walk(self._topdir):
+            pkghashes = set()
+            for fname in filenames:
+                match = self.EntryPattern.match(fname)
+                if not match:
+                    continue
+                pkghash = match.group(1)
+                if os.path.normpath(os.path.join(dirpath, pkghash)) \
+                        != os.path.normpath(self.GetPath(pkghash)):
+                    continue
+                if fname.endswith('.tmp'):
+                    try:
+                        if os.path.getmtime(os.path.join(dirpath,
+                                                         fname)) < stale:
+                            os.remove(os.path.join(dirpath, fname))
+                    except OSError:
+                        pass
+                    continue
+                pkghashes.add(pkghash)
+            for pkghash in sorted(pkghashes):
+                path = os.path.join(dirpath, pkghash)
+                with self.Locked(pkghash):
+                    try:
+                        if os.path.isfile(path + self.CopiedSuffix) \
+                                or (os.path.isfile(path)
+                                    and os.stat(path).st_nlink > 1):
+                            continue
+                        if os.path.isfile(path):
+                            os.remove(path)
+                            npruned += 1
+                        os.remove(path + '.lock')
+                    except OSError:
+                        pass
+        return npruned
+
+    @classmethod
+    def _clone(cls, srcpath: str, tgtpath: str) -> bool:
+        """Duplicate a file via a hard link, reflink or copy,
+        returning True if a hard link was used"""
+        try:
+            os.link(srcpath, tgtpath)
+            return True
+        except OSError:
+            pass
+        with open(srcpath, 'rb') as fsrc, open(tgtpath, 'wb') as ftgt:
+            if fcntl is not None and sys.platform.startswith('linux'):
+                try:
+                    fcntl.ioctl(ftgt.fileno(), cls.FICLONE, fsrc.fileno())
+                    return False
+                except OSError:
+                    pass
+            shutil.copyfileobj(fsrc, ftgt, 1 << 20)
+        return False
+
+    @classmethod
+    def _markCopied(cls, path: str) -> None:
+        with open(path + cls.CopiedSuffix, 'ab'):
+            pass
+
+    @staticmethod
+    def _tmpPath(path: str) -> str:
+        tmppath = '{0}.{1:d}-{2:d}.tmp'.format(path, os.getpid(),
+                                               threading.get_ident())
+        if os.path.lexists(tmppath):
+            os.remove(tmppath)
+        return tmppath
+
+    @staticmethod
+    def _lockFile(fp, lock: bool) -> None:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), (fcntl.LOCK_EX if lock else fcntl.LOCK_UN))
+        elif msvcrt is not None:
+            fp.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fp.fileno(),
+                                   (msvcrt.LK_LOCK if lock
+                                        else msvcrt.LK_UNLCK), 1)
+                    return
+                except OSError:
+                    if not lock:
+                        return
+
+
+
+class MirrorSet(BuildReporter):
+    """Ordered collection of mirror sites from which packages can be
+    downloaded, with successive files being spread across all mirrors
+    that are as up to date as the primary (first) mirror.
+
+    Mirrors whose setup.ini is older than that of the primary mirror
+    are only used as a fall-back, for files that they are known to hold."""
+
+    def __init__(self, URLs: list, Viewer: BuildViewer=None,
+                 Pool: ConnectionPool=None) -> None:
+        BuildReporter.__init__(self, Viewer)
+        self._urls = list(URLs)
+        self._pool = Pool if Pool else ConnectionPool()
+        self._lock = threading.Lock()
+        self._next = 0
+
+        # Mirrors eligible for all files, and (URL, filenames) of stale mirrors:
+        self._current = list(self._urls)
+        self._stale: list = []
+
+        # Numbers of successful & failed downloads, bytes and seconds:
+        self._outcomes: dict = {}
+
+    def GetURLs(self) -> list:
+        return self._urls
+
+    def RecordOutcome(self, URL: str, succeeded: bool,
+                      nbytes: int, seconds: float) -> None:
+        """Accumulate statistics of an attempted download from a mirror"""
+        with self._lock:
+            outcome = self._outcomes.setdefault(URL, [ 0, 0, 0, 0.0 ])
+            outcome[0 if succeeded else 1] += 1
+            outcome[2] += nbytes
+            outcome[3] += seconds
+
+    def GetOutcomes(self) -> dict:
+        """Find the numbers of successful and failed downloads
+        from each mirror, together with the bytes and time taken"""
+        with self._lock:
+            return { URL: tuple(outcome)
+                        for URL, outcome in self._outcomes.items() }
+
+    def GetCurrent(self) -> list:
+        return self._current
+
+    def GetStale(self) -> list:
+        return [ URL for (URL, available) in self._stale ]
+
+    def Survey(self, relpath: str, header: dict, cacheDir: str=None) -> None:
+        """Compare the setup.ini (at the given path relative to each mirror)
+        of each secondary mirror with the header of the primary mirror's"""
+        secondaries = self._urls[1:]
+        if not secondaries:
+            return
+        timestamp = self._timestamp(header)
+
+        def survey(URL):
+            return self._surveyMirror(URL, relpath, timestamp, cacheDir)
+        nthreads = min(8, len(secondaries))
+        with concurrent.futures.ThreadPoolExecutor(nthreads) as pool:
+            results = list(pool.map(survey, secondaries))
+
+        self._current = self._urls[:1]
+        self._stale = []
+        for URL, (current, available) in zip(secondaries, results):
+            if current:
+                self._current.append(URL)
+            elif available is not None:
+                self._stale.append((URL, available))
+
+    def Candidates(self, pkgref: str) -> list:
+        """Choose the sequence of mirrors from which to attempt
+        to download a file, rotating through all current mirrors"""
+        with self._lock:
+            start = self._next
+            self._next += 1
+        ncurrent = len(self._current)
+        mirrors = [ self._current[(start + i) % ncurrent]
+                        for i in range(ncurrent) ]
+        mirrors.extend(URL for (URL, available) in self._stale
+                            if pkgref in available)
+        return mirrors
+
+    def _surveyMirror(self, URL, relpath, timestamp, cacheDir):
+        """Check whether a mirror is up to date, returning a flag
+        together with the set of files listed by a stale mirror"""
+        iniURL = urllib.parse.urljoin(URL, relpath)
+        try:
+            fetcher = SetupIniFetcher(iniURL, self._pool)
+            try:
+                header = self._readHeader(fetcher)
+            finally:
+                fetcher.close()
+            if self._timestamp(header) >= timestamp:
+                return (True, None)
+
+            pkglist = MasterPackageList(iniURL, Viewer=self._statview,
+                                        Pool=self._pool)
+            pkglist.SetCacheDir(cacheDir)
+            available = set()
+            for pkginfo in pkglist.GetPackageDict().values():
+                for variant in ('install', 'source'):
+                    for value in pkginfo.GetAll(variant):
+                        available.add(value.split()[0])
+            self._statview('Mirror {0} is out of date, and will only be used'
+                           ' for {1:d} file(s)'.format(URL, len(available)),
+                           BuildViewer.SEV_WARNING)
+            return (False, available)
+        except Exception as ex:
+            self._statview('Ignoring mirror {0} - {1}'.format(URL, str(ex)),
+                           BuildViewer.SEV_WARNING)
+            return (False, None)
+
+    @staticmethod
+    def _readHeader(lines) -> dict:
+        """Read the release information at the start of a setup.ini file"""
+        header = {}
+        for line in lines:
+            if line[:1] == '@':
+                break
+            (name, sep, value) = line.partition(':')
+            if sep and not line[:1] == '#':
+                header[name.strip()] = value.strip()
+        return header
+
+    @staticmethod
+    def _timestamp(header) -> int:
+        try:
+            return int(header.get('setup-timestamp', 0))
+        except ValueError:
+            return 0
+
+
+class MirrorProber:
+    """Measurement of the connection latency and download throughput
+    of mirror sites, via a small ranged download from each site"""
+
+    ProbeSize = 1 << 17
+
+    def __init__(self, timeout: float=10.0) -> None:
+        self._timeout = timeout
+
+    def Probe(self, URL: str, relpath: str):
+        """Measure the time taken to connect to a mirror, and the rate
+        at which part of the given file could be downloaded"""
+        parts = urllib.parse.urlsplit(URL)
+        t0 = time.perf_counter()
+        if parts.hostname:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            sock = socket.create_connection((parts.hostname, port),
+                                            self._timeout)
+            sock.close()
+        latency = time.perf_counter() - t0
+
+        headers = { 'Range': 'bytes=0-{0:d}'.format(self.ProbeSize - 1),
+                    'User-Agent': 'pmcyg/' + PMCYG_VERSION }
+        req = urllib.request.Request(urllib.parse.urljoin(URL, relpath),
+                                     headers=headers)
+        t0 = time.perf_counter()
+        nbytes = 0
+        with urllib.request.urlopen(req, timeout=self._timeout) as stream:
+            while nbytes < self.ProbeSize:
+                chunk = stream.read(self.ProbeSize - nbytes)
+                if not chunk:
+                    break
+                nbytes += len(chunk)
+        elapsed = time.perf_counter() - t0
+        if not nbytes:
+            raise PMCygException('Empty response from ' + URL)
+        return (latency, nbytes / max(elapsed, 1e-6))
+
+    def ProbeAll(self, URLs: list, relpath: str, nthreads: int=16) -> dict:
+        """Probe several mirrors concurrently, returning a dictionary
+        of (latency, throughput) pairs, or None for unreachable mirrors"""
+        def probe(URL):
+            try:
+                return self.Probe(URL, relpath)
+            except Exception:
+                return None
+
+        if not URLs:
+            return {}
+        with concurrent.futures.ThreadPoolExecutor(min(nthreads,
+                                                       len(URLs))) as pool:
+            return dict(zip(URLs, pool.map(probe, URLs)))
+
+
+class MirrorHistory:
+    """Persistent record of the measured performance of mirror sites,
+    from explicit probes and from the downloads of previous builds,
+    from which mirrors can be ranked in order of preference.
+
+    Latencies and throughputs are smoothed over successive measurements,
+    while the numbers of successful and failed downloads accumulate.
+    Mirrors which have not been used for a long time are forgotten."""
+
+    FormatVersion = 1
+
+    # Limits on the number of mirrors recorded, and on their disuse:
+    MaxEntries = 256
+    MaxAge = 365 * 86400
+
+    # Weighting of newest measurement of latency & throughput:
+    Smoothing = 0.5
+
+    # Size of file on which ranking is based, balancing latency & throughput:
+    ReferenceSize = 1 << 20
+
+    def __init__(self, path: str=None) -> None:
+        self._path = path
+        self._entries: dict = {}
+
+    def GetPath(self) -> str:
+        return self._path
+
+    def Load(self) -> None:
+        """Read history from disk, silently ignoring absent or corrupt files"""
+        entries = {}
+        try:
+            with open(self._path, 'rt', encoding='utf-8') as fp:
+                content = json.load(fp)
+            if content.get('version') == self.FormatVersion:
+                entries = content['entries']
+                now = time.time()
+                for entry in entries.values():
+                    entry.setdefault('seen', now)
+        except (OSError, TypeError, ValueError, KeyError, AttributeError):
+            pass
+        self._entries = entries
+
+    def Save(self) -> None:
+        """Atomically write history to disk"""
+        if not self._path:
+            return
+        self.Prune()
+        content = { 'version': self.FormatVersion,
+                    'entries': self._entries }
+        tmppath = '{0}.{1:d}.tmp'.format(self._path, os.getpid())
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        with open(tmppath, 'wt', encoding='utf-8') as fp:
+            json.dump(content, fp, indent=1, sort_keys=True)
+        os.replace(tmppath, self._path)
+
+    def Get(self, URL: str) -> dict:
+        return self._entries.get(URL, {})
+
+    def RecordProbe(self, URL: str, latency: float,
+                    throughput: float) -> None:
+        """Record the outcome of probing a mirror, with latency
+        and throughput being None if the mirror was unreachable"""
+        entry = self._entries.setdefault(URL, {})
+        entry['probed'] = entry['seen'] = time.time()
+        if latency is None:
+            entry['fail'] = entry.get('fail', 0) + 1
+            return
+        entry['ok'] = entry.get('ok', 0) + 1
+        self._smooth(entry, 'latency', latency)
+        self._smooth(entry, 'throughput', throughput)
+
+    def RecordBuild(self, URL: str, nsucceeded: int, nfailed: int,
+                    nbytes: int, seconds: float) -> None:
+        """Record the outcomes of downloading packages from a mirror"""
+        entry = self._entries.setdefault(URL, {})
+        entry['seen'] = time.time()
+        entry['ok'] = entry.get('ok', 0) + nsucceeded
+        entry['fail'] = entry.get('fail', 0) + nfailed
+        if nbytes and seconds > 0:
+            self._smooth(entry, 'throughput', nbytes / seconds)
+
+    def Prune(self) -> None:
+        """Forget mirrors not probed or used within MaxAge seconds,
+        and all but the MaxEntries most recently seen mirrors"""
+        cutoff = time.time() - self.MaxAge
+        recent = sorted(((entry.get('seen', 0), URL)
+                            for (URL, entry) in self._entries.items()
+                            if entry.get('seen', 0) >= cutoff),
+                        reverse=True)
+        self._entries = { URL: self._entries[URL]
+                            for (seen, URL) in recent[:self.MaxEntries] }
+
+    def IsRecent(self, URL: str, maxAge: float) -> bool:
+        """Check whether a mirror has been probed within
+        the given number of seconds"""
+        probed = self.Get(URL).get('probed', 0)
+        return (0 <= time.time() - probed < maxAge)
+
+    def Score(self, URL: str):
+        """Estimate the time taken to download a typical file from a mirror,
+        inflated by the fraction of failed downloads,
+        or None if the mirror has never been successfully measured"""
+        entry = self.Get(URL)
+        throughput = entry.get('throughput')
+        if not throughput:
+            return None
+        seconds = entry.get('latency', 0.0) + self.ReferenceSize / throughput
+        nok = entry.get('ok', 0)
+        reliability = (nok + 1) / (nok + entry.get('fail', 0) + 1)
+        return seconds / reliability
+
+    def Rank(self, URLs: list) -> list:
+        """Sort measured mirrors in order of increasing score"""
+        scores = [ (self.Score(URL), URL) for URL in URLs ]
+        return [ URL for (score, URL) in sorted(sc for sc in scores
+                                                    if sc[0] is not None) ]
+
+    def _smooth(self, entry: dict, field: str, value: float) -> None:
+        previous = entry.get(field)
+        if previous is None:
+            entry[field] = value
+        else:
+            entry[field] = self.Smoothing * value \
+                            + (1 - self.Smoothing) * previous
+
+
+class RetryPolicy:
+    """Schedule of repeated attempts to download a file, with exponentially
+    increasing delays between attempts, each randomly shortened by up to
+    half so that failures from a mirror do not cause synchronized retries."""
+
+    def __init__(self, attempts: int=4, delay: float=2.0,
+                 maxDelay: float=60.0, rng=None) -> None:
+        self.attempts = max(1, int(attempts))
+        self.delay = max(0.0, float(delay))
+        self.maxDelay = max(self.delay, float(maxDelay))
+        self._rng = rng if rng else random.Random()
+
+    def Allows(self, attempt: int) -> bool:
+        """Check whether the given (1-based) attempt is permitted"""
+        return (attempt <= self.attempts)
+
+    def Delay(self, attempt: int) -> float:
+        """Choose how long to wait after the given (1-based) attempt has failed"""
+        delay = min(self.maxDelay, self.delay * (2 ** (attempt - 1)))
+        return delay * (0.5 + 0.5 * self._rng.random())
+
+
+class TransferWatchdog:
+    """Monitor of the throughput of a single download, which raises
+    an exception if the transfer rate stays below a given number of bytes
+    per second for longer than a given period"""
+
+    def __init__(self, minRate: float=0, window: float=0) -> None:
+        self.minRate = minRate or 0
+        self.window = window or 0
+        self._windowStart = time.monotonic()
+        self._windowBytes = 0
+
+    def Update(self, nbytes: int) -> None:
+        """Note the arrival of a block of data"""
+        if not (self.minRate and self.window):
+            return
+        self._windowBytes += nbytes
+        elapsed = time.monotonic() - self._windowStart
+        if elapsed >= self.window:
+            if self._windowBytes < self.minRate * elapsed:
+                raise PMCygException('transfer slower than'
+                                     ' {0}/s for {1:.0f}s'.format(
+                                        prettyFileSize(int(self.minRate)),
+                                        elapsed))
+            (self._windowStart, self._windowBytes) = (time.monotonic(), 0)
+
+
+class DownloadScheduler:
+    """Policy for choosing the order in which package files are downloaded,
+    which by default follows the order of the list of packages.
+
+    (The installer and package lists are always assembled
+    before any package files are downloaded.)"""
+
+    Name = 'fifo'
+
+    # Whether the set of essential packages is used in ordering downloads:
+    UsesEssential = False
+
+    def Order(self, downloads: list, origins: dict, essential: set) -> list:
+        """Sort a list of (pkgref, size, hash) download descriptors,
+        given the (package name, variant) from which each was derived,
+        and the names of packages needed for a minimal Cygwin installation"""
+        def priority(download):
+            (pkg, variant) = origins.get(download[0], (None, None))
+            return self._priority(download, pkg, variant, essential)
+        return sorted(downloads, key=priority)
+
+    def _priority(self, download, pkg, variant, essential):
+        return 0
+
+
+class BaseFirstScheduler(DownloadScheduler):
+    """Download the binaries of Base packages, and their dependencies,
+    before all other files, so that a usable minimal mirror appears early"""
+
+    Name = 'base-first'
+    UsesEssential = True
+
+    def _priority(self, download, pkg, variant, essential):
+        return 0 if (pkg in essential and variant != 'source') else 1
+
+
+class BinariesFirstScheduler(DownloadScheduler):
+    """Download all binary packages before any source packages"""
+
+    Name = 'binaries-first'
+
+    def _priority(self, download, pkg, variant, essential):
+        return 1 if variant == 'source' else 0
+
+
+class LargestFirstScheduler(DownloadScheduler):
+    """Download the largest files first, so that concurrent downloads
+    are less likely to leave a single large file until the end"""
+
+    Name = 'largest-first'
+
+    def _priority(self, download, pkg, variant, essential):
+        return -download[1]
+
+
+SCHEDULING_POLICIES = { cls.Name: cls for cls in
+                            (DownloadScheduler, BaseFirstScheduler,
+                             BinariesFirstScheduler, LargestFirstScheduler) }
+
+
 class PMbuilder(BuildReporter):
     """Utility class for constructing partial mirror
     of Cygwin(TM) distribution"""
@@ -235,6 +1833,25 @@ class PMbuilder(BuildReporter):
     DL_SizeError =      3
     DL_HashError =      4
     DL_Failure =        5
+    DL_NotFound =       6
+
+    # Outcomes of attempting to fetch a package from any available mirror:
+    FT_Present =        1
+    FT_Retry =          2
+    FT_Failed =         3
+    FT_Cancelled =      4
+
+    # Number of checksum failures after which a package is deemed corrupt:
+    MaxHashErrors = 2
+
+    # Interval (in seconds) between reports of download progress:
+    ProgressInterval = 1.0
+
+    # Suffix of incomplete downloads, retained for resumption:
+    PartialSuffix = '.part'
+
+    # Serialization of updates to record of mirror performance:
+    _historyLock = threading.Lock()
 
     def __init__(self, BuildDirectory: str='.',
                 MirrorSite: str=DEFAULT_CYGWIN_MIRROR,
@@ -250,8 +1867,11 @@ class PMbuilder(BuildReporter):
         # URL of source of Cygwin installation program 'setup.exe':
         self._exeurl = CygwinInstaller
 
-        # URL of Cygwin mirror site, hosting available packages:
+        # URL of Cygwin mirror site, hosting available packages,
+        # together with any secondary mirrors:
         self.mirror_url = MirrorSite
+        self._extraMirrors: list = []
+        self._mirrorSet = None
 
         # URL of Cygwin package database file (derived from _mirror if 'None'):
         self._iniurl = None
@@ -262,23 +1882,53 @@ class PMbuilder(BuildReporter):
         # Set of package age descriptors:
         self._epochs = ['curr']
 
-        self._masterList = MasterPackageList(Viewer=Viewer)
+        # Persistent connections to mirror sites:
+        self._pool = ConnectionPool()
+
+        self._masterList = MasterPackageList(Viewer=Viewer, Pool=self._pool)
         self._pkgProc = PkgSetProcessor(self._masterList)
         self._garbage = GarbageCollector(Viewer=Viewer)
         self._cancelling = False
         self._mirrordict = None
+        self._mirrorListURL = CYGWIN_MIRROR_LIST_URL
+        self._reportLock = threading.Lock()
         self._optiondict = {
             'AllPackages':      False,
+            'CacheDirectory':   getUserCacheDir(),
+            'ConnectTimeout':   30.0,
+            'DownloadEngine':   'threads',
+            'DownloadThreads':  1,
             'DummyDownload':    False,
+            'ForceVerify':      False,
             'IncludeBase':      True,
             'MakeAutorun':      False,
+            'MaxHostTransfers': 64,
+            'MinThroughput':    1.0,
+            'MirrorListTTL':    86400,
             'IncludeSources':   False,
+            'PackageStore':     None,
+            'ReadTimeout':      60.0,
             'RemoveOutdated':   'no',
+            'RetryAttempts':    4,
+            'RetryDelay':       2.0,
+            'RetryMaxDelay':    60.0,
+            'RunReport':        None,
+            'SchedulingPolicy': 'fifo',
+            'SlowTransferTime': 60.0,
             'ISOfilename':      None
         }
 
         self._fetchStats = FetchStats()
+        self._metrics = RunMetrics()
+        self._verified = VerifiedIndex(self._tgtdir)
+        self._fetchRegistry = None
+        self._hashErrors = collections.Counter()
+        self._progressDue = 0.0
+        self._store = None
+        self._archBuilders: list = []
         self._cygcheck_list: list = []
+        self._masterList.SetCacheDir(self._optiondict['CacheDirectory'])
+        self._applyTimeouts()
         for (opt, val) in kwargs.items():
             self.SetOption(opt, val)
 
@@ -321,6 +1971,18 @@ class PMbuilder(BuildReporter):
             URL += '/'
         self._mirror = URL
 
+    @property
+    def mirror_urls(self) -> list:
+        """The ordered list of mirror sites from which packages
+        will be downloaded, starting with the primary mirror"""
+        return [ self._mirror ] + self._extraMirrors
+
+    @mirror_urls.setter
+    def mirror_urls(self, URLs: list) -> None:
+        self.mirror_url = URLs[0]
+        self._extraMirrors = [ (URL if URL.endswith('/') else URL + '/')
+                                for URL in URLs[1:] ]
+
     @property
     def setup_ini_url(self) -> str:
         """The (architecture-dependent) URL for the setup.ini package-list."""
@@ -363,6 +2025,10 @@ class PMbuilder(BuildReporter):
         except:
             raise PMCygException('Invalid configuration option "{0}"' \
                                     ' for PMbuilder'.format(optname))
+        if optname == 'CacheDirectory':
+            self._masterList.SetCacheDir(value)
+        elif optname in ('ConnectTimeout', 'ReadTimeout'):
+            self._applyTimeouts()
         return oldval
 
     def ReadMirrorList(self, reload=False):
@@ -374,10 +2040,10 @@ class PMbuilder(BuildReporter):
         self._mirrordict = {}
 
         try:
-            fp = urllib.request.urlopen(CYGWIN_MIRROR_LIST_URL)
+            fp = self._openMirrorList(reload)
         except:
             self._statview('Failed to read list of Cygwin mirrors' \
-                           ' from {0}'.format(CYGWIN_MIRROR_LIST_URL),
+                           ' from {0}'.format(self._mirrorListURL),
                            BuildViewer.SEV_WARNING)
             fp = self._makeFallbackMirrorList()
 
@@ -399,6 +2065,68 @@ class PMbuilder(BuildReporter):
         return self._mirrordict
 
 
+    def ListMirrorURLs(self) -> list:
+        """Find the URLs of all known Cygwin mirror sites"""
+        URLs = []
+        for region in self.ReadMirrorList().values():
+            for mirrors in region.values():
+                URLs.extend(url for (ident, url) in mirrors)
+        return sorted(set(URLs))
+
+    def ProbeMirrors(self, URLs: list=None, maxAge: float=0) -> list:
+        """Measure the latency and throughput of a set of mirror sites,
+        (by default all known mirrors), and return those successfully
+        measured, in order of preference. Mirrors already probed
+        within the last 'maxAge' seconds are not probed again."""
+        if URLs is None:
+            URLs = self.ListMirrorURLs()
+        relpath = '{0}/setup.xz'.format(self._cygarch) if self._cygarch \
+                    else 'setup.xz'
+
+        history = self.GetMirrorHistory()
+        stale = [ URL for URL in URLs if not history.IsRecent(URL, maxAge) ]
+        if stale:
+            self._statview.startOperation('Probing {0:d} mirror site(s)' \
+                                            .format(len(stale)))
+            results = MirrorProber().ProbeAll(stale, relpath)
+            nok = len([ res for res in results.values() if res ])
+            self._statview.endOperation('{0:d} responded'.format(nok))
+
+            def update(history):
+                for URL, result in results.items():
+                    history.RecordProbe(URL, *(result or (None, None)))
+            history = self._updateMirrorHistory(update)
+
+        return history.Rank(URLs)
+
+    def AutoSelectMirrors(self, URLs: list) -> list:
+        """Replace each 'auto' entry within a list of mirror URLs
+        by the best-ranked of the remaining known mirror sites"""
+        if not 'auto' in URLs:
+            return URLs
+        maxAge = self._optiondict['MirrorListTTL']
+        ranked = [ URL for URL in self.ProbeMirrors(maxAge=maxAge)
+                        if not URL in URLs ]
+        chosen = []
+        for URL in URLs:
+            if URL != 'auto':
+                chosen.append(URL)
+            elif ranked:
+                chosen.append(ranked.pop(0))
+        if not chosen:
+            self._statview('No mirror sites could be measured,'
+                           ' using {0}'.format(self._mirror),
+                           BuildViewer.SEV_WARNING)
+            chosen = [ self._mirror ]
+        return chosen
+
+    def GetMirrorHistory(self):
+        """Load the record of performance of previously used mirror sites"""
+        history = MirrorHistory(self._mirrorHistoryPath())
+        if history.GetPath():
+            history.Load()
+        return history
+
     def ListInstalled(self):
         """Generate list of all packages on existing Cygwin installation"""
 
@@ -445,33 +2173,147 @@ class PMbuilder(BuildReporter):
         together with installer artefacts."""
 
         self._cancelling = False
+        self._metrics = RunMetrics([ self._cygarch ])
         self._masterList.SetSourceURL(self.setup_ini_url)
 
         userpackages = []
         if pkgset:
             userpackages = pkgset.extract(arch=self._cygarch)
+        t0 = time.perf_counter()
         packages = self._resolveDependencies(userpackages)
-        downloads = self._buildFetchList(packages)
+        resolving = time.perf_counter() - t0
+        for phase, seconds in self._masterList.TakeLoadTimes().items():
+            self._metrics.AddDuration(phase, seconds)
+            resolving -= seconds
+        self._metrics.AddDuration('resolve', max(0.0, resolving))
+
+        with self._metrics.Phase('fetch-list'):
+            origins = {}
+            downloads = self._buildFetchList(packages, origins)
+            downloads = self._scheduleDownloads(downloads, origins)
 
         self._fetchStats = FetchStats(downloads)
         sizestr = self._prettyfsize(self._fetchStats.TotalSize())
-        self._statview('Download size: {0} from {1}'.format(sizestr,
-                                                            self._mirror))
+        mirrorstr = self._mirror
+        if self._extraMirrors:
+            mirrorstr += ' and {0:d} other mirror(s)' \
+                            .format(len(self._extraMirrors))
+        self._statview('Download size: {0} from {1} ({2})' \
+                        .format(sizestr, mirrorstr, self._cygarch))
+
+        if self._fetchRegistry is None:
+            # Not sharing the target directory with other architectures:
+            self._prepareTarget([ self._cygarch ])
+
+        with self._metrics.Phase('download'):
+            if self._optiondict['DummyDownload']:
+                self._doDummyDownloading(downloads)
+            else:
+                self._doDownloading(packages, downloads)
 
-        archdir = self._getArchDir()
-        noarchdir = os.path.join(archdir, '..', 'noarch')
-        self._garbage.IndexCurrentFiles([archdir, noarchdir], mindepth=1)
+    def BuildMultiArch(self, pkgset, archs: list) -> None:
+        """Download and configure packages for several architectures
+        into a single local directory
 
-        if self._optiondict['DummyDownload']:
-            self._doDummyDownloading(downloads)
-        else:
-            self._doDownloading(packages, downloads)
+        The package database of each architecture is read, resolved and
+        downloaded concurrently, with files common to more than one
+        architecture only being fetched once."""
+
+        archs = list(dict.fromkeys(archs))
+        if len(archs) < 2:
+            if archs:
+                self.SetArch(archs[0])
+            self.BuildMirror(pkgset)
+            return
+        if self._iniurl:
+            raise PMCygException('An explicit setup.ini URL cannot be used'
+                                 ' with multiple architectures')
+
+        self._cancelling = False
+        self._metrics = RunMetrics(archs)
+        self._prepareTarget(archs)
+
+        registry = FetchRegistry()
+        viewlock = threading.Lock()
+        self._archBuilders = [ self._cloneForArch(arch, registry, viewlock)
+                                for arch in archs ]
+        try:
+            with concurrent.futures.ThreadPoolExecutor(len(archs)) as pool:
+                builds = [ pool.submit(builder.BuildMirror, pkgset)
+                            for builder in self._archBuilders ]
+                while True:
+                    (done, pending) = concurrent.futures.wait(builds,
+                                        self.ProgressInterval,
+                                        concurrent.futures.FIRST_EXCEPTION)
+                    if not pending or any(build.exception()
+                                            for build in done):
+                        break
+                    # Show the combined progress of all architectures:
+                    stats = AggregateFetchStats(builder._fetchStats
+                                        for builder in self._archBuilders)
+                    if stats.TotalSize():
+                        with viewlock:
+                            self._statview.showProgress(stats)
+                for build in builds:
+                    build.result()
+        finally:
+            with viewlock:
+                self._statview.showProgress(None)
+            self._fetchStats = FetchStats()
+            for builder in self._archBuilders:
+                self._fetchStats.Merge(builder._fetchStats)
+                self._metrics.Merge(builder._metrics)
+            self._archBuilders = []
+
+    def _prepareTarget(self, archs: list) -> None:
+        """Index existing files beneath the architecture-specific
+        and shared areas of the local mirror, prior to downloading"""
+        archdirs = [ os.path.join(self._tgtdir, arch) for arch in archs ]
+        noarchdir = os.path.join(self._tgtdir, 'noarch')
+        self._garbage.IndexCurrentFiles(archdirs + [ noarchdir ], mindepth=1)
+
+        self._verified = VerifiedIndex(self._tgtdir)
+        self._verified.Load()
+        self._garbage.SetVerifiedIndex(self._verified)
+
+        self._store = None
+        storedir = self._optiondict['PackageStore']
+        if storedir:
+            try:
+                os.makedirs(storedir, exist_ok=True)
+            except OSError as ex:
+                raise PMCygException('Cannot create package store'
+                                     ' in {0} - {1}'.format(storedir, str(ex)))
+            self._store = PackageStore(storedir)
+        self._garbage.SetPackageStore(self._store)
+
+    def _cloneForArch(self, arch: str, registry: FetchRegistry,
+                      viewlock: threading.Lock=None):
+        """Create a PMbuilder targetting a different architecture,
+        but sharing this builder's local mirror, connections and options
+
+        Messages from the clone are labelled with its architecture,
+        and serialized with those of other clones sharing the same lock."""
+        clone = copy.copy(self)
+        clone._cygarch = arch
+        clone._optiondict = dict(self._optiondict)
+        clone._statview = PrefixedBuildViewer(self._statview, arch, viewlock)
+        clone._masterList = MasterPackageList(Viewer=clone._statview,
+                                              Pool=self._pool)
+        clone._masterList.SetCacheDir(self._optiondict['CacheDirectory'])
+        clone._pkgProc = PkgSetProcessor(clone._masterList)
+        clone._fetchStats = FetchStats()
+        clone._metrics = RunMetrics()
+        clone._fetchRegistry = registry
+        clone._archBuilders = []
+        return clone
 
     def BuildISO(self, isoname):
         """Convert local downloads into an ISO image for burning to CD"""
 
         argv = [ 'genisoimage', '-o', isoname, '-quiet',
                 '-V', 'Cygwin(pmcyg)-' + time.strftime('%d%b%y'),
+                '-m', ValidatedCopy.SidecarPrefix + '*',
                 '-r', '-J', self._tgtdir ]
 
         self._statview.startOperation('Generating ISO image in ' + isoname)
@@ -479,13 +2321,49 @@ class PMbuilder(BuildReporter):
             self._statview.endOperation(' (dummy)')
             return
 
-        retcode = subprocess.call(argv, shell=False)
+        with self._metrics.Phase('iso'):
+            retcode = subprocess.call(argv, shell=False)
         if not retcode:
             self._statview.endOperation('done')
         else:
             self._statview.endOperation('FAILED (errno={0:d})'.format(retcode),
                                         BuildViewer.SEV_ERROR)
 
+    def GetRunMetrics(self):
+        """Find the timings of the most recent build"""
+        return self._metrics
+
+    def WriteRunReport(self, stem: str=None) -> None:
+        """Write a summary of the most recent build, as JSON (stem.json)
+        and in the Prometheus textfile format (stem.prom),
+        using the location given by the 'RunReport' option by default"""
+        stem = stem or self._optiondict['RunReport']
+        if not stem:
+            return
+        (root, ext) = os.path.splitext(stem)
+        if ext in ('.json', '.prom'):
+            stem = root
+
+        report = self._metrics.MakeReport(self._fetchStats)
+        report['version'] = PMCYG_VERSION
+        report['directory'] = self._tgtdir
+        contents = [ (stem + '.json', json.dumps(report, indent=2) + '\n'),
+                     (stem + '.prom', RunMetrics.FormatPrometheus(report)) ]
+        try:
+            for (filename, text) in contents:
+                dirname = os.path.dirname(filename)
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                # Replace atomically, so that partial files are never read:
+                tmpname = filename + '.tmp'
+                with open(tmpname, 'w', encoding='utf-8') as fp:
+                    fp.write(text)
+                os.replace(tmpname, filename)
+        except OSError as ex:
+            self._statview('Failed to write run report {0} - {1}' \
+                            .format(filename, str(ex)),
+                           BuildViewer.SEV_WARNING)
+
     def GetGarbage(self):
         if self._optiondict['DummyDownload']:
             return None
@@ -495,6 +2373,8 @@ class PMbuilder(BuildReporter):
     def Cancel(self, flag=True):
         """Signal that downloading should be terminated"""
         self._cancelling = flag
+        for builder in self._archBuilders:
+            builder.Cancel(flag)
 
     def TemplateFromLists(self, outfile: str, pkgfiles: list,
                           cygwinReplica: bool=False) -> None:
@@ -504,11 +2384,83 @@ class PMbuilder(BuildReporter):
 
         pkgset = PackageSet(pkgfiles)
         if cygwinReplica:
-            pkgset.extend(self.ListInstalled())
+            installed = self.ListInstalled()
+            pkgset.extend(self._pkgProc.ContractDependencies(installed,
+                                                             self._epochs))
 
         with codecs.open(outfile, 'w', SI_TEXT_ENCODING) as fp:
             self._pkgProc.MakeTemplate(fp, pkgset, terse=cygwinReplica)
 
+    def CostReportFromLists(self, outfile: str, pkgfiles: list) -> None:
+        """Wrapper for PkgSetProcessor.MakeCostReport(),
+        taking collection of package files"""
+        self._masterList.SetSourceURL(self.setup_ini_url)
+
+        pkgset = PackageSet(pkgfiles)
+        selected = self._extendPkgSelection(pkgset.extract(arch=self._cygarch))
+
+        with codecs.open(outfile, 'w', SI_TEXT_ENCODING) as fp:
+            self._pkgProc.MakeCostReport(fp, sorted(selected), self._epochs,
+                                         self._optiondict['IncludeSources'])
+
+    def _applyTimeouts(self):
+        self._pool.SetTimeouts(self._optiondict['ConnectTimeout'],
+                               self._optiondict['ReadTimeout'])
+
+    def _openMirrorList(self, reload=False):
+        """Read list of mirror sites, via a local copy that is only
+        refreshed after 'MirrorListTTL' seconds"""
+        cachedir = self._optiondict['CacheDirectory']
+        if not cachedir:
+            return self._pool.Open(self._mirrorListURL)
+
+        localCopy = ValidatedCopy(self._mirrorListURL,
+                                  os.path.join(cachedir, 'mirrors.lst'),
+                                  self._pool)
+        if reload or not localCopy.IsFresh(self._optiondict['MirrorListTTL']):
+            try:
+                localCopy.Refresh()
+            except Exception:
+                if not os.path.isfile(localCopy.GetPath()):
+                    raise
+                self._statview('Using previously downloaded list'
+                               ' of Cygwin mirrors', BuildViewer.SEV_WARNING)
+        return open(localCopy.GetPath(), 'rb')
+
+    def _mirrorHistoryPath(self):
+        cachedir = self._optiondict['CacheDirectory']
+        if not cachedir:
+            return None
+        return os.path.join(cachedir, 'mirror-history.json')
+
+    def _updateMirrorHistory(self, update):
+        """Apply changes to the persistent record of mirror performance,
+        returning the updated record"""
+        with self._historyLock:
+            history = self.GetMirrorHistory()
+            update(history)
+            try:
+                history.Save()
+            except OSError as ex:
+                self._statview('Failed to save history of mirror sites'
+                               ' - {0}'.format(str(ex)),
+                               BuildViewer.SEV_WARNING)
+        return history
+
+    def _recordMirrorOutcomes(self):
+        """Add the performance of each mirror during downloading
+        to the persistent record of mirror performance"""
+        if not self._mirrorSet:
+            return
+        outcomes = self._mirrorSet.GetOutcomes()
+        if not outcomes:
+            return
+        self._metrics.AddMirrorOutcomes(outcomes)
+        def update(history):
+            for URL, outcome in outcomes.items():
+                history.RecordBuild(URL, *outcome)
+        self._updateMirrorHistory(update)
+
     @staticmethod
     def _makeFallbackMirrorList():
         """Supply a static list of official Cygwin mirror sites,
@@ -524,6 +2476,15 @@ https://mirrors.dotsrc.org/cygwin/;mirrors.dotsrc.org;Europe;Denmark
 https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice.org;Europe;UK
                 ''')
 
+    def MakeResolver(self, usrpkgs=None):
+        """Construct an IncrementalResolver holding the closure
+        of the user's package selection (including base packages),
+        which can then be adjusted one package at a time"""
+        self._masterList.SetSourceURL(self.setup_ini_url)
+        selected = self._extendPkgSelection(usrpkgs)
+        return self._pkgProc.MakeResolver(sorted(selected), self._epochs,
+                                    self._optiondict['IncludeSources'])
+
     def _resolveDependencies(self, usrpkgs=None):
         """Constuct list of packages, including all their dependencies"""
 
@@ -564,8 +2525,9 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
 
         return pkgset
 
-    def _buildFetchList(self, packages):
-        """Convert list of packages into set of files to fetch from Cygwin server"""
+    def _buildFetchList(self, packages, origins=None):
+        """Convert list of packages into set of files to fetch from Cygwin server,
+        optionally recording the package & variant from which each was derived"""
         pkgdict = self._masterList.GetPackageDict()
 
         # Construct list of compiled/source/current/previous variants:
@@ -591,6 +2553,8 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
                     pkgsize = int(flds[1])
                     pkghash = flds[2]
                     downloads.append((pkgref, pkgsize, pkghash))
+                    if origins is not None:
+                        origins.setdefault(pkgref, (pkg, ptype))
                 except:
                     self._statview('Cannot find package filename ' \
                                    'for {0} in variant \'{1}:{2}\'' \
@@ -600,6 +2564,26 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
         return downloads
 
 
+    def _scheduleDownloads(self, downloads, origins):
+        """Reorder downloads according to the chosen scheduling policy"""
+        policy = self._optiondict['SchedulingPolicy'] or 'fifo'
+        try:
+            scheduler = SCHEDULING_POLICIES[policy]()
+        except KeyError:
+            raise PMCygException('Unknown download scheduling policy'
+                                 ' "{0}"'.format(policy))
+
+        essential = set()
+        pkgdict = self._masterList.GetPackageDict()
+        if scheduler.UsesEssential and pkgdict:
+            base = [ pkg for pkg, pkginfo in pkgdict.items()
+                        if 'Base' in pkginfo.GetAny('category').split() ]
+            graph = self._masterList.GetDependencyGraph()
+            table = graph.GetTable(self._epochs)
+            essential.update(graph.GetNames(table.Closure(graph.GetIds(base))))
+
+        return scheduler.Order(downloads, origins, essential)
+
     def _buildSetupFiles(self, packages):
         """Create top-level configuration files in local mirror"""
 
@@ -654,8 +2638,11 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
         try:
             self._statview.startOperation('Retrieving {0} to {1}' \
                                                 .format(exeURL, tgtpath))
-            urllib.request.urlretrieve(exeURL, tgtpath)
-            self._statview.endOperation('done')
+            exeCopy = ValidatedCopy(exeURL, tgtpath, self._pool)
+            if exeCopy.Refresh():
+                self._statview.endOperation('unchanged')
+            else:
+                self._statview.endOperation('done')
         except Exception as ex:
             self._statview.flushOperation()
             raise PMCygException("Failed to retrieve {0}\n - {1}" \
@@ -694,48 +2681,21 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
         self._buildSetupFiles(packages)
 
         augdownloads = self._preparePaths(downloads)
+        self._mirrorSet = self._surveyMirrors()
+
+        self._hashErrors = collections.Counter()
+        engine = self._optiondict['DownloadEngine'] or 'threads'
+        if engine == 'asyncio':
+            self._fetchAsync(augdownloads)
+        elif engine == 'threads':
+            self._fetchQueued(augdownloads)
+        else:
+            raise PMCygException('Unknown download engine'
+                                 ' "{0}"'.format(engine))
 
-        retries = 3     # FIXME make this tunable
-        while augdownloads and retries > 0:
-            retrydownloads = []
-            retries -= 1
-
-            for DLsummary in augdownloads:
-                (pkgfile, pkgsize, pkghash, tgtpath) = DLsummary
-                if self._cancelling:
-                    self._statview('** Downloading cancelled **')
-                    break
-
-                mirpath = urllib.parse.urljoin(self._mirror, pkgfile)
-
-                self._statview.startOperation('  {0} ({1})'.format(
-                                                os.path.basename(pkgfile),
-                                                self._prettyfsize(pkgsize)))
-
-                (outcome, errmsg) = self._downloadSingle(mirpath, pkgsize,
-                                                        pkghash, tgtpath)
-
-                if outcome == self.DL_Success:
-                    self._statview.endOperation('done')
-                    self._fetchStats.AddNew(pkgfile, pkgsize)
-                elif outcome == self.DL_AlreadyPresent:
-                    self._statview.endOperation('already present')
-                    self._fetchStats.AddAlready(pkgfile, pkgsize)
-                else:
-                    self._statview.endOperation(' FAILED ({0})'.format(errmsg),
-                                                BuildViewer.SEV_WARNING)
-                    if os.path.isfile(tgtpath):
-                        os.remove(tgtpath)
-                    if retries > 0:
-                        retrydownloads.append(DLsummary)
-                    else:
-                        self._fetchStats.AddFail(pkgfile, pkgsize)
-
-            if retries > 0 and retrydownloads:
-                self._statview('\n** Retrying {0:d} download(s) **' \
-                                .format(len(retrydownloads)))
-                time.sleep(10)
-            augdownloads = retrydownloads
+        self._showProgress(final=True)
+        self._saveVerifiedIndex()
+        self._recordMirrorOutcomes()
 
         counts = self._fetchStats.Counts()
         if not counts['Fail']:
@@ -746,34 +2706,641 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
                             .format(counts['Fail'], counts['Total']),
                            BuildViewer.SEV_WARNING)
 
+    def _fetchQueued(self, augdownloads):
+        """Download a list of packages concurrently, with any package
+        that fails being retried after a delay, while others continue"""
+        nthreads = max(1, int(self._optiondict['DownloadThreads']))
+        policy = RetryPolicy(self._optiondict['RetryAttempts'],
+                             self._optiondict['RetryDelay'],
+                             self._optiondict['RetryMaxDelay'])
+        # Report each package on a single line, as it is downloaded,
+        # unless downloads are running concurrently:
+        serial = (nthreads == 1 and self._fetchRegistry is None)
+
+        queue = collections.deque((DLsummary, 1) for DLsummary in augdownloads)
+        delayed = []        # Heap of (time, sequence, DLsummary, attempt)
+        pending = {}
+        sequence = 0
+
+        with concurrent.futures.ThreadPoolExecutor(nthreads) as pool:
+            while queue or delayed or pending:
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now:
+                    (ready, seq, DLsummary, attempt) = heapq.heappop(delayed)
+                    queue.appendleft((DLsummary, attempt))
+
+                if self._cancelling:
+                    queue.clear()
+                    delayed = []
+                while queue and len(pending) < 2 * nthreads:
+                    (DLsummary, attempt) = queue.popleft()
+                    lastAttempt = not policy.Allows(attempt + 1)
+                    job = pool.submit(self._fetchPackage, DLsummary,
+                                      lastAttempt, serial)
+                    pending[job] = (DLsummary, attempt)
+
+                self._showProgress()
+                timeout = 1.0
+                if delayed:
+                    timeout = min(timeout, max(0.0, delayed[0][0] - now))
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+                (done, notdone) = concurrent.futures.wait(pending, timeout,
+                                    concurrent.futures.FIRST_COMPLETED)
+
+                for job in done:
+                    (DLsummary, attempt) = pending.pop(job)
+                    if job.result() == self.FT_Retry:
+                        sequence += 1
+                        ready = time.monotonic() + policy.Delay(attempt)
+                        heapq.heappush(delayed, (ready, sequence,
+                                                 DLsummary, attempt + 1))
+
+        if self._cancelling:
+            self._statview('** Downloading cancelled **')
+
+    def _fetchAsync(self, augdownloads):
+        """Download a list of packages via asyncio coroutines, allowing
+        very many concurrent transfers, with the number of transfers
+        from each mirror host adapted to its throughput and error rate"""
+        asyncio.run(self._fetchAllAsync(augdownloads))
+
+    async def _fetchAllAsync(self, augdownloads):
+        nthreads = max(1, int(self._optiondict['DownloadThreads']))
+        loop = asyncio.get_running_loop()
+        # Worker threads for disk-bound checks, and non-HTTP mirrors:
+        loop.set_default_executor(
+                    concurrent.futures.ThreadPoolExecutor(nthreads))
+
+        client = AsyncHTTPClient(initialTransfers=nthreads,
+                        maxTransfers=self._optiondict['MaxHostTransfers'])
+        client.SetTimeouts(self._optiondict['ConnectTimeout'],
+                           self._optiondict['ReadTimeout'])
+        policy = RetryPolicy(self._optiondict['RetryAttempts'],
+                             self._optiondict['RetryDelay'],
+                             self._optiondict['RetryMaxDelay'])
+
+        pending = { asyncio.ensure_future(
+                        self._fetchRetryingAsync(client, policy, DLsummary))
+                    for DLsummary in augdownloads }
+        try:
+            while pending:
+                self._showProgress()
+                (done, pending) = await asyncio.wait(pending, timeout=1.0)
+                for job in done:
+                    job.result()
+                if self._cancelling:
+                    for job in pending:
+                        job.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    break
+        finally:
+            await client.Close()
+
+    async def _fetchRetryingAsync(self, client, policy, DLsummary):
+        """Download a single package, retrying after a delay on failure"""
+        attempt = 1
+        while True:
+            lastAttempt = not policy.Allows(attempt + 1)
+            result = await self._fetchPackageAsync(client, DLsummary,
+                                                   lastAttempt)
+            if result != self.FT_Retry:
+                return result
+            await asyncio.sleep(policy.Delay(attempt))
+            attempt += 1
+
+    async def _fetchPackageAsync(self, client, DLsummary, lastAttempt=True):
+        """Coroutine equivalent of _fetchPackage()"""
+        (pkgfile, pkgsize, pkghash, tgtpath) = DLsummary
+        if self._cancelling:
+            return self.FT_Cancelled
+
+        mirrors = self._candidateMirrors(pkgfile)
+        missing = 0
+        for attempt, mirror in enumerate(mirrors, 1):
+            mirpath = urllib.parse.urljoin(mirror, pkgfile)
+            t0 = time.perf_counter()
+            (outcome, errmsg) = await self._downloadSharedAsync(client,
+                                        mirpath, pkgsize, pkghash, tgtpath)
+            missing += self._noteAttempt(DLsummary, mirror, outcome,
+                                         time.perf_counter() - t0)
+            if outcome in (self.DL_Success, self.DL_AlreadyPresent) \
+                    or self._cancelling or attempt == len(mirrors):
+                break
+            self._reportFailover(DLsummary, mirror, errmsg)
+
+        return self._reportFetch(DLsummary, outcome, errmsg,
+                                 (missing == len(mirrors)), lastAttempt)
+
+    async def _downloadSharedAsync(self, client, mirpath, pkgsize,
+                                   pkghash, tgtpath):
+        """Coroutine equivalent of _downloadShared()"""
+        registry = self._fetchRegistry
+        if registry is None:
+            return await self._downloadSingleAsync(client, mirpath, pkgsize,
+                                                   pkghash, tgtpath)
+
+        (claim, owner) = registry.Claim(tgtpath)
+        if not owner:
+            (outcome, errmsg) = await asyncio.wrap_future(claim)
+            if outcome == self.DL_Success:
+                outcome = self.DL_AlreadyPresent
+            return (outcome, errmsg)
+
+        result = (self.DL_Failure, 'download abandoned')
+        try:
+            result = await self._downloadSingleAsync(client, mirpath, pkgsize,
+                                                     pkghash, tgtpath)
+        finally:
+            registry.Release(tgtpath, claim, result,
+                             result[0] in (self.DL_Success,
+                                           self.DL_AlreadyPresent))
+        return result
+
+    async def _downloadSingleAsync(self, client, mirpath, pkgsize,
+                                   pkghash, tgtpath):
+        """Coroutine equivalent of _downloadSingle()"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._checkExisting,
+                                            pkgsize, pkghash, tgtpath)
+        if result:
+            return result
+
+        if self._store is not None \
+                and await loop.run_in_executor(None, self._withStoreLock,
+                                        pkghash, self._materialiseStored,
+                                        pkghash, tgtpath, pkgsize):
+            result = (self.DL_AlreadyPresent, None)
+        else:
+            result = await self._downloadFreshAsync(client, mirpath, pkgsize,
+                                                    pkghash, tgtpath)
+
+        return self._noteVerification(tgtpath, pkghash, result)
+
+    async def _downloadFreshAsync(self, client, mirpath, pkgsize,
+                                  pkghash, tgtpath):
+        """Coroutine equivalent of _downloadFresh(), which waits for
+        a transfer slot from the mirror host before connecting to it"""
+        loop = asyncio.get_running_loop()
+        partpath = tgtpath + self.PartialSuffix
+        throttle = client.Throttle(mirpath)
+        await throttle.Acquire()
+        (pkgref, progress) = self._startTransfer(tgtpath, pkgsize)
+        result = (self.DL_Failure, 'download abandoned')
+        try:
+            (hasher, offset) = await loop.run_in_executor(None,
+                                    self._resumePartial, partpath,
+                                    pkgsize, pkghash)
+            progress(0, offset)
+            if client.Handles(mirpath):
+                (dlsize, hasher) = await self._retrieveAsync(client,
+                                        throttle, mirpath, partpath,
+                                        hasher, offset, progress)
+            else:
+                (dlsize, hasher) = await loop.run_in_executor(None,
+                                        self._retrieve, mirpath, partpath,
+                                        hasher, offset, progress)
+            result = await loop.run_in_executor(None, self._withStoreLock,
+                                    pkghash, self._completeDownload,
+                                    partpath, tgtpath, dlsize, hasher,
+                                    pkgsize, pkghash)
+        except Exception as ex:
+            if client.IsOverload(ex):
+                throttle.Backoff()
+            if self._isNotFound(ex):
+                result = (self.DL_NotFound, str(ex))
+            else:
+                result = (self.DL_Failure, str(ex) or type(ex).__name__)
+        finally:
+            throttle.Release()
+            self._fetchStats.EndTransfer(pkgref,
+                                         result[0] == self.DL_Success)
+        return result
+
+    async def _retrieveAsync(self, client, throttle, URL, tgtpath,
+                             hasher=None, offset=0, progress=None,
+                             blksize=1<<16):
+        """Coroutine equivalent of _retrieve(), for HTTP(S) URLs"""
+        headers = None
+        if offset:
+            headers = { 'Range': 'bytes={0:d}-'.format(offset) }
+        try:
+            stream = await client.Open(URL, headers)
+        except urllib.error.HTTPError as ex:
+            if not offset or ex.code != 416:
+                raise
+            stream = await client.Open(URL)
+
+        try:
+            if offset and self._rangeStart(stream) != offset:
+                offset = 0
+                if hasher:
+                    hasher = hashlib.new(hasher.name)
+            watchdog = self._watchdog()
+
+            nbytes = offset
+            with open(tgtpath, ('ab' if offset else 'wb')) as fp:
+                while True:
+                    chunk = await stream.read(blksize)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+                    if hasher:
+                        hasher.update(chunk)
+                    nbytes += len(chunk)
+                    throttle.RecordTransfer(len(chunk))
+                    watchdog.Update(len(chunk))
+                    if progress:
+                        progress(len(chunk), nbytes)
+        finally:
+            stream.close()
+
+        return (nbytes, hasher)
+
+    def _fetchPackage(self, DLsummary, lastAttempt=True, serial=False):
+        """Download a single package and report its outcome,
+        returning FT_Present if the package is now present, FT_Retry if
+        another attempt may succeed, or otherwise FT_Failed or FT_Cancelled.
+
+        This may be called concurrently from multiple worker threads,
+        unless 'serial' is set, in which case the outcome is reported
+        as the completion of an operation announced beforehand."""
+        (pkgfile, pkgsize, pkghash, tgtpath) = DLsummary
+        if self._cancelling:
+            return self.FT_Cancelled
+        if serial:
+            self._statview.startOperation(self._fetchSummary(DLsummary))
+
+        mirrors = self._candidateMirrors(pkgfile)
+        missing = 0
+        for attempt, mirror in enumerate(mirrors, 1):
+            mirpath = urllib.parse.urljoin(mirror, pkgfile)
+            t0 = time.perf_counter()
+            (outcome, errmsg) = self._downloadShared(mirpath, pkgsize,
+                                                     pkghash, tgtpath)
+            missing += self._noteAttempt(DLsummary, mirror, outcome,
+                                         time.perf_counter() - t0)
+            if outcome in (self.DL_Success, self.DL_AlreadyPresent) \
+                    or self._cancelling or attempt == len(mirrors):
+                break
+            self._reportFailover(DLsummary, mirror, errmsg)
+
+        return self._reportFetch(DLsummary, outcome, errmsg,
+                                 (missing == len(mirrors)), lastAttempt,
+                                 serial)
+
+    def _showProgress(self, final=False):
+        """Periodically pass the statistics of downloads in progress
+        to the BuildViewer, or clear them once downloading has finished"""
+        now = time.monotonic()
+        if final:
+            self._statview.showProgress(None)
+        elif now >= self._progressDue:
+            self._statview.showProgress(self._fetchStats)
+            self._progressDue = now + self.ProgressInterval
+
+    def _candidateMirrors(self, pkgfile):
+        """List the mirror sites from which a package may be fetched,
+        in order of preference"""
+        if self._mirrorSet:
+            return self._mirrorSet.Candidates(pkgfile)
+        return [ self._mirror ]
+
+    def _noteAttempt(self, DLsummary, mirror, outcome, seconds):
+        """Record the outcome of fetching a package from one mirror,
+        returning 1 if the package was missing from that mirror"""
+        (pkgfile, pkgsize, pkghash, tgtpath) = DLsummary
+        if self._mirrorSet and outcome != self.DL_AlreadyPresent:
+            succeeded = (outcome == self.DL_Success)
+            self._mirrorSet.RecordOutcome(mirror, succeeded,
+                                          (pkgsize if succeeded else 0),
+                                          seconds)
+        if outcome == self.DL_NotFound:
+            return 1
+        elif outcome == self.DL_HashError:
+            with self._reportLock:
+                self._hashErrors[pkgfile] += 1
+        return 0
+
+    def _reportFailover(self, DLsummary, mirror, errmsg):
+        """Report that a package will be sought from another mirror"""
+        with self._reportLock:
+            self._statview(self._fetchSummary(DLsummary)
+                            + '... failed via {0} ({1}),' \
+                            ' trying another mirror'.format(mirror, errmsg))
+
+    def _reportFetch(self, DLsummary, outcome, errmsg,
+                     missing, lastAttempt, serial=False):
+        """Report the final outcome of fetching a package from
+        all candidate mirrors, returning one of the FT_* codes"""
+        (pkgfile, pkgsize, pkghash, tgtpath) = DLsummary
+        summary = self._fetchSummary(DLsummary)
+
+        def report(text, severity=BuildViewer.SEV_NORMAL):
+            if serial:
+                self._statview.endOperation(text, severity)
+            else:
+                self._statview(summary + '... ' + text, severity)
+
+        with self._reportLock:
+            if outcome == self.DL_Success:
+                report('done')
+                self._fetchStats.AddNew(pkgfile, pkgsize)
+                return self.FT_Present
+            elif outcome == self.DL_AlreadyPresent:
+                report('already present')
+                self._fetchStats.AddAlready(pkgfile, pkgsize)
+                return self.FT_Present
+
+            # Missing from every mirror, or repeatedly corrupt, is permanent:
+            permanent = missing \
+                        or (self._hashErrors[pkgfile] >= self.MaxHashErrors)
+            retry = not (lastAttempt or permanent or self._cancelling)
+            report(' FAILED ({0}){1}'.format(errmsg, (', will retry' if retry
+                                                       else '')),
+                   BuildViewer.SEV_WARNING)
+            if os.path.isfile(tgtpath):
+                os.remove(tgtpath)
+            if retry:
+                self._fetchStats.AddRetry(pkgfile)
+                return self.FT_Retry
+            if not self._cancelling:
+                self._fetchStats.AddFail(pkgfile, pkgsize)
+                return self.FT_Failed
+            return self.FT_Cancelled
+
+    def _fetchSummary(self, DLsummary):
+        (pkgfile, pkgsize, pkghash, tgtpath) = DLsummary
+        return '  {0} ({1})'.format(os.path.basename(pkgfile),
+                                    self._prettyfsize(pkgsize))
+
+    def _surveyMirrors(self):
+        """Determine which of the configured mirror sites are eligible
+        for downloading each package"""
+        mirrors = MirrorSet(self.mirror_urls, Viewer=self._statview,
+                            Pool=self._pool)
+        if self._extraMirrors:
+            iniURL = self.setup_ini_url
+            if iniURL.startswith(self._mirror):
+                relpath = iniURL[len(self._mirror):]
+            else:
+                relpath = '{0}/setup.xz'.format(self._cygarch)
+            (header, pkgdict) = self._masterList.GetHeaderAndPackages()
+            mirrors.Survey(relpath, header, self._optiondict['CacheDirectory'])
+        return mirrors
+
+    def _saveVerifiedIndex(self):
+        try:
+            self._verified.Save()
+        except OSError as ex:
+            self._statview('Failed to save index of verified packages'
+                           ' - {0}'.format(str(ex)),
+                           BuildViewer.SEV_WARNING)
+
+    def _downloadShared(self, mirpath, pkgsize, pkghash, tgtpath):
+        """Download a single package, unless another builder sharing
+        the same local mirror has already claimed it"""
+        registry = self._fetchRegistry
+        if registry is None:
+            return self._downloadSingle(mirpath, pkgsize, pkghash, tgtpath)
+
+        (claim, owner) = registry.Claim(tgtpath)
+        if not owner:
+            (outcome, errmsg) = claim.result()
+            if outcome == self.DL_Success:
+                outcome = self.DL_AlreadyPresent
+            return (outcome, errmsg)
+
+        result = (self.DL_Failure, 'download abandoned')
+        try:
+            result = self._downloadSingle(mirpath, pkgsize, pkghash, tgtpath)
+        finally:
+            registry.Release(tgtpath, claim, result,
+                             result[0] in (self.DL_Success,
+                                           self.DL_AlreadyPresent))
+        return result
+
     def _downloadSingle(self, mirpath, pkgsize, pkghash, tgtpath):
-        """Attempt to download and validate a single package from the mirror"""
-        outcome = self.DL_Failure
-        errmsg = None
+        """Attempt to download and validate a single package from the mirror
+
+        Newly downloaded files are hashed as their contents arrive,
+        so only pre-existing files need to be re-read from disk.
+        Any package store is only locked while files are copied
+        into or out of it, not while a package is being downloaded."""
+        result = self._checkExisting(pkgsize, pkghash, tgtpath)
+        if result:
+            return result
+
+        if self._store is not None \
+                and self._withStoreLock(pkghash, self._materialiseStored,
+                                        pkghash, tgtpath, pkgsize):
+            result = (self.DL_AlreadyPresent, None)
+        else:
+            result = self._downloadFresh(mirpath, pkgsize, pkghash, tgtpath)
+
+        return self._noteVerification(tgtpath, pkghash, result)
+
+    def _withStoreLock(self, pkghash, func, *args):
+        """Call a function while holding the lock on the entry
+        for a given hash-code within any package store"""
+        if self._store is None:
+            return func(*args)
+        with self._store.Locked(pkghash):
+            return func(*args)
+
+    def _materialiseStored(self, pkghash, tgtpath, pkgsize):
+        """Copy a package from the package store into the local mirror,
+        evicting the stored copy if its contents fail validation"""
+        if not self._store.Materialise(pkghash, tgtpath, pkgsize):
+            return False
+        if self._hashCheck(tgtpath, pkghash):
+            return True
+        self._statview('Discarding corrupt copy of {0} from package store' \
+                        .format(os.path.basename(tgtpath)),
+                       BuildViewer.SEV_WARNING)
+        try:
+            os.remove(tgtpath)
+            self._store.Evict(pkghash)
+        except OSError:
+            pass
+        return False
+
+    def _checkExisting(self, pkgsize, pkghash, tgtpath):
+        """Check any existing copy of a package within the local mirror,
+        returning None if the package still needs to be fetched"""
+        if not (os.path.isfile(tgtpath)
+                and os.path.getsize(tgtpath) == pkgsize):
+            return None
 
-        if os.path.isfile(tgtpath) and os.path.getsize(tgtpath) == pkgsize:
-            outcome = self.DL_AlreadyPresent
+        verified = not self._optiondict['ForceVerify'] \
+                        and self._verified.IsVerified(tgtpath, pkghash)
+        if not verified and not self._hashCheck(tgtpath, pkghash):
+            return self._noteVerification(tgtpath, pkghash,
+                            (self.DL_HashError, 'mismatched checksum'))
+        if self._store is not None:
+            self._store.Insert(tgtpath, pkghash)
+        if verified:
+            return (self.DL_AlreadyPresent, None)
+        return self._noteVerification(tgtpath, pkghash,
+                                      (self.DL_AlreadyPresent, None))
+
+    def _noteVerification(self, tgtpath, pkghash, result):
+        """Update the index of verified packages after an attempt
+        to fetch a package, passing through its (outcome, errmsg)"""
+        if result[0] in (self.DL_Success, self.DL_AlreadyPresent):
+            self._verified.Record(tgtpath, pkghash)
         else:
-            try:
-                dlsize = 0
-                urllib.request.urlretrieve(mirpath, tgtpath)
-                dlsize = os.path.getsize(tgtpath)
-                if dlsize == pkgsize:
-                    outcome = self.DL_Success
-                else:
-                    outcome = self.DL_SizeError
-                    errmsg = 'mismatched size: {0} vs {1}' \
-                                .format(self._prettyfsize(dlsize),
-                                        self._prettyfsize(pkgsize))
-            except Exception as ex:
-                errmsg = str(ex)
+            self._verified.Discard(tgtpath)
+        return result
+
+    def _downloadFresh(self, mirpath, pkgsize, pkghash, tgtpath):
+        """Fetch a package from the mirror, resuming any partial download,
+        and adding it to the package store (if any) once validated"""
+        partpath = tgtpath + self.PartialSuffix
+        (pkgref, progress) = self._startTransfer(tgtpath, pkgsize)
+        result = (self.DL_Failure, 'download abandoned')
+        try:
+            (hasher, offset) = self._resumePartial(partpath,
+                                                   pkgsize, pkghash)
+            progress(0, offset)
+            (dlsize, hasher) = self._retrieve(mirpath, partpath,
+                                              hasher, offset, progress)
+            result = self._withStoreLock(pkghash, self._completeDownload,
+                                         partpath, tgtpath, dlsize, hasher,
+                                         pkgsize, pkghash)
+        except Exception as ex:
+            if self._isNotFound(ex):
+                result = (self.DL_NotFound, str(ex))
+            else:
+                result = (self.DL_Failure, str(ex))
+        finally:
+            self._fetchStats.EndTransfer(pkgref, result[0] == self.DL_Success)
+        return result
+
+    def _startTransfer(self, tgtpath, pkgsize):
+        """Register a package transfer with the download statistics,
+        returning its name and a callback for reporting its progress"""
+        stats = self._fetchStats
+        pkgref = os.path.relpath(tgtpath, self._tgtdir)
+        stats.StartTransfer(pkgref, pkgsize)
+        def progress(nbytes, position):
+            stats.AddProgress(pkgref, nbytes, position)
+        return (pkgref, progress)
+
+    def _completeDownload(self, partpath, tgtpath, dlsize, hasher,
+                          pkgsize, pkghash):
+        """Validate a newly downloaded file, and move it into place"""
+        if dlsize != pkgsize:
+            if dlsize > pkgsize:
+                os.remove(partpath)
+            return (self.DL_SizeError, 'mismatched size: {0} vs {1}' \
+                            .format(self._prettyfsize(dlsize),
+                                    self._prettyfsize(pkgsize)))
+        if not self._hashCheck.Matches(hasher, pkghash):
+            os.remove(partpath)
+            return (self.DL_HashError, 'mismatched checksum')
+
+        if self._store is not None:
+            self._store.Insert(partpath, pkghash)
+        os.replace(partpath, tgtpath)
+        return (self.DL_Success, None)
+
+    @staticmethod
+    def _isNotFound(ex) -> bool:
+        """Check whether a download failed because the file does not exist"""
+        if isinstance(ex, urllib.error.HTTPError):
+            return ex.code in (404, 410)
+        if isinstance(ex, urllib.error.URLError):
+            return isinstance(ex.reason, FileNotFoundError)
+        return isinstance(ex, FileNotFoundError)
+
+    def _resumePartial(self, partpath, pkgsize, pkghash):
+        """Prepare to resume an incomplete download, returning a digest
+        object primed with the contents of any partial file,
+        together with the offset at which downloading should restart."""
+        hasher = self._hashCheck.Hasher(pkghash)
+        offset = 0
+        try:
+            partsize = os.path.getsize(partpath)
+            if 0 < partsize < pkgsize:
+                with open(partpath, 'rb') as fp:
+                    while True:
+                        chunk = fp.read(1 << 16)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                offset = partsize
+        except OSError:
+            pass
+        return (hasher, offset)
+
+    def _retrieve(self, URL, tgtpath, hasher=None, offset=0,
+                  progress=None, blksize=1<<16):
+        """Copy the contents of a URL into a local file,
+        optionally feeding each block into a digest object,
+        and returning the size of the file together with the digest.
+        Any progress callback receives the size of each block,
+        and the number of bytes of the file received so far.
+
+        If a non-zero offset is supplied, an HTTP Range request is used
+        to fetch only the remainder of the file, which is appended to
+        the existing prefix (assumed to have been fed into the digest).
+        If the server does not honour this, the whole file is fetched.
+
+        The transfer is abandoned if its throughput stays below
+        'MinThroughput' (kB/s) for 'SlowTransferTime' seconds, leaving
+        a partial file from which a later attempt can resume."""
+        headers = None
+        if offset:
+            headers = { 'Range': 'bytes={0:d}-'.format(offset) }
+        try:
+            stream = self._pool.Open(URL, headers)
+        except urllib.error.HTTPError as ex:
+            if not offset or ex.code != 416:
+                raise
+            stream = self._pool.Open(URL)
+
+        with stream:
+            if offset and self._rangeStart(stream) != offset:
+                offset = 0
+                if hasher:
+                    hasher = hashlib.new(hasher.name)
+
+            watchdog = self._watchdog()
+
+            # Accept partial blocks, so that slow transfers can be monitored:
+            read = getattr(stream, 'read1', stream.read)
+
+            nbytes = offset
+            with open(tgtpath, ('ab' if offset else 'wb')) as fp:
+                while True:
+                    chunk = read(blksize)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+                    if hasher:
+                        hasher.update(chunk)
+                    nbytes += len(chunk)
+                    watchdog.Update(len(chunk))
+                    if progress:
+                        progress(len(chunk), nbytes)
+
+        return (nbytes, hasher)
 
-        if outcome == self.DL_AlreadyPresent or outcome == self.DL_Success:
-            if not self._hashCheck(tgtpath, pkghash):
-                outcome = self.DL_HashError
-                errmsg = 'mismatched checksum'
+    def _watchdog(self) -> TransferWatchdog:
+        """Create a monitor for abandoning excessively slow downloads"""
+        return TransferWatchdog(1024 * (self._optiondict['MinThroughput'] or 0),
+                                self._optiondict['SlowTransferTime'])
 
-        return (outcome, errmsg)
+    @staticmethod
+    def _rangeStart(stream):
+        """Find the offset of a partial-content HTTP response"""
+        if getattr(stream, 'status', None) != 206:
+            return None
+        matches = re.match(r'bytes\s+(\d+)-',
+                           stream.headers.get('Content-Range', ''))
+        return int(matches.group(1)) if matches else None
 
     def _preparePaths(self, downloads):
         """Setup directories for packages due to be downloaded"""
@@ -785,10 +3352,10 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
 
             tgtpath = os.path.join(self._tgtdir, pkgfile)
             tgtdir = os.path.dirname(tgtpath)
-            if not os.path.isdir(tgtdir):
-                os.makedirs(tgtdir)
+            os.makedirs(tgtdir, exist_ok=True)
 
             self._garbage.RescueFile(tgtpath)
+            self._garbage.RescueFile(tgtpath + self.PartialSuffix)
             augdownloads.append((pkgfile, pkgsize, pkghash, tgtpath))
 
         return augdownloads
@@ -810,20 +3377,13 @@ https://www.mirrorservice.org/sites/sourceware.org/pub/cygwin/;www.mirrorservice
         """Get the local directory in which architecture-dependent
         Cygwin packages will be assembled"""
         archdir = os.path.join(self._tgtdir, self._cygarch)
-        if create and not os.path.isdir(archdir):
-            os.makedirs(archdir)
+        if create:
+            os.makedirs(archdir, exist_ok=True)
         return archdir
 
     def _prettyfsize(self, size):
         """Pretty-print file size, autoscaling units"""
-        divisors = [ ( 1<<30, 'GB' ), ( 1<<20, 'MB' ), ( 1<<10, 'kB' ), ( 1, 'B' ) ]
-
-        for div, unit in divisors:
-            qsize = float(size) / div
-            if qsize > 0.8:
-                return '{0:.3g}{1}'.format(qsize, unit)
-
-        return '{0:d}B'.format(size)
+        return prettyFileSize(size)
 
 
 
@@ -935,6 +3495,440 @@ class PackageSet:
 
 
 
+class DependencyTable:
+    """Forward and reverse dependencies between packages,
+    identified by integer ids, for a particular set of epochs.
+
+    Adjacency lists are held in compressed-sparse-row form, such that
+    the dependencies of package 'i' are targets[offsets[i]:offsets[i+1]]"""
+
+    def __init__(self, rows, unresolved):
+        self.unresolved = unresolved
+        self._components = None
+        self._condensation = None
+        (self._fwdOffsets, self._fwdTargets) = self._compress(rows)
+
+        reverse = [ [] for row in rows ]
+        for i, row in enumerate(rows):
+            for j in row:
+                reverse[j].append(i)
+        (self._revOffsets, self._revTargets) = self._compress(reverse)
+
+    def __len__(self):
+        return len(self._fwdOffsets) - 1
+
+    def Successors(self, node):
+        """Find the ids of packages on which the given package depends"""
+        return self._fwdTargets[self._fwdOffsets[node]:self._fwdOffsets[node+1]]
+
+    def Predecessors(self, node):
+        """Find the ids of packages which depend on the given package"""
+        return self._revTargets[self._revOffsets[node]:self._revOffsets[node+1]]
+
+    def GetComponents(self):
+        """Label each package by the strongly-connected component
+        of the dependency graph to which it belongs, with components
+        numbered such that dependencies precede their dependents"""
+        if self._components is None:
+            self._components = self._findComponents()
+        return self._components
+
+    def GetCondensation(self):
+        """Find the acyclic graph of dependencies between
+        strongly-connected components, returning the component label
+        of each package, the packages within each component, and
+        a DependencyTable whose nodes are components"""
+        if self._condensation is None:
+            components = self.GetComponents()
+            ncomps = (max(components) + 1) if components else 0
+            members = [ [] for c in range(ncomps) ]
+            rows = [ set() for c in range(ncomps) ]
+            for node, comp in enumerate(components):
+                members[comp].append(node)
+                for dep in self.Successors(node):
+                    if components[dep] != comp:
+                        rows[comp].add(components[dep])
+            self._condensation = (components, members,
+                                  DependencyTable([ sorted(r) for r in rows ],
+                                                  {}))
+        return self._condensation
+
+    def Closure(self, seeds, reverse=False):
+        """Find the ids of all packages reachable from the seed packages,
+        following either dependencies or (if reverse) dependents"""
+        if reverse:
+            (offsets, targets) = (self._revOffsets, self._revTargets)
+        else:
+            (offsets, targets) = (self._fwdOffsets, self._fwdTargets)
+
+        visited = bytearray(len(self))
+        stack = []
+        for node in seeds:
+            if not visited[node]:
+                visited[node] = 1
+                stack.append(node)
+        closure = list(stack)
+
+        while stack:
+            node = stack.pop()
+            for dep in targets[offsets[node]:offsets[node+1]]:
+                if not visited[dep]:
+                    visited[dep] = 1
+                    stack.append(dep)
+                    closure.append(dep)
+        return closure
+
+    def _findComponents(self):
+        """Apply Tarjan's algorithm, without recursion,
+        to find the strongly-connected components of the graph"""
+        (offsets, targets) = (self._fwdOffsets, self._fwdTargets)
+        npkgs = len(self)
+        index = array.array('l', [ -1 ]) * npkgs
+        lowlink = array.array('l', [ 0 ]) * npkgs
+        components = array.array('l', [ -1 ]) * npkgs
+        onstack = bytearray(npkgs)
+        stack = []
+        (counter, ncomps) = (0, 0)
+
+        for root in range(npkgs):
+            if index[root] >= 0:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onstack[root] = 1
+            work = [ (root, offsets[root]) ]
+
+            while work:
+                (node, pos) = work[-1]
+                end = offsets[node+1]
+                while pos < end:
+                    dep = targets[pos]
+                    pos += 1
+                    if index[dep] < 0:
+                        # Descend into unvisited dependency:
+                        work[-1] = (node, pos)
+                        index[dep] = lowlink[dep] = counter
+                        counter += 1
+                        stack.append(dep)
+                        onstack[dep] = 1
+                        work.append((dep, offsets[dep]))
+                        break
+                    elif onstack[dep] and index[dep] < lowlink[node]:
+                        lowlink[node] = index[dep]
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        if lowlink[node] < lowlink[parent]:
+                            lowlink[parent] = lowlink[node]
+                    if lowlink[node] == index[node]:
+                        while True:
+                            member = stack.pop()
+                            onstack[member] = 0
+                            components[member] = ncomps
+                            if member == node:
+                                break
+                        ncomps += 1
+
+        return components
+
+    @staticmethod
+    def _compress(rows):
+        offsets = array.array('l', [ 0 ])
+        targets = array.array('l')
+        for row in rows:
+            targets.extend(row)
+            offsets.append(len(targets))
+        return (offsets, targets)
+
+
+
+class DependencyGraph:
+    """Index of the dependencies between all packages in a setup.ini,
+    built once per package database, and shared by all dependency
+    expansions and contractions.
+
+    Packages are identified by integer ids, following the sorted order
+    of their names. Because dependencies may differ between epochs,
+    a DependencyTable is constructed on demand for each set of epochs,
+    with epochs whose dependencies are identical sharing their tables."""
+
+    def __init__(self, pkgdict):
+        self.names = sorted(pkgdict.keys())
+        self.index = { name: i for i, name in enumerate(self.names) }
+        self._pkgdict = pkgdict
+        self._epochRows = {}
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def GetIds(self, pkgnames):
+        """Convert package names into ids, ignoring unknown packages"""
+        index = self.index
+        return [ index[pkg] for pkg in pkgnames if pkg in index ]
+
+    def GetNames(self, ids):
+        names = self.names
+        return [ names[i] for i in ids ]
+
+    def GetTable(self, epochs=['curr']):
+        """Find the table of dependencies that apply to any of a set
+        of epochs, with each package depending on the union of
+        its dependencies across those epochs"""
+        with self._lock:
+            variants = []
+            for epoch in sorted(set(epochs), key=str):
+                rows = self._getEpochRows(epoch)
+                if not any(rows is v for v in variants):
+                    variants.append(rows)
+            key = tuple(id(v) for v in variants)
+
+            table = self._tables.get(key)
+            if table is None:
+                table = self._buildTable(variants)
+                self._tables[key] = table
+            return table
+
+    def _getEpochRows(self, epoch):
+        """Find dependency ids, and unresolvable dependency names,
+        of each package within a single epoch"""
+        rows = self._epochRows.get(epoch)
+        if rows is not None:
+            return rows
+
+        index = self.index
+        deps = []
+        unresolved = {}
+        for i, pkg in enumerate(self.names):
+            row = []
+            for req in self._pkgdict[pkg].GetDependencies([epoch]):
+                j = index.get(req)
+                if j is not None:
+                    row.append(j)
+                else:
+                    unresolved.setdefault(i, []).append(req)
+            deps.append(tuple(row))
+        rows = (deps, unresolved)
+
+        # Share dependencies with any equivalent epoch:
+        for other in self._epochRows.values():
+            if other == rows:
+                rows = other
+                break
+        self._epochRows[epoch] = rows
+        return rows
+
+    def _buildTable(self, variants):
+        if len(variants) == 1:
+            (rows, unresolved) = variants[0]
+        else:
+            rows = []
+            unresolved = {}
+            for i in range(len(self.names)):
+                merged = set()
+                for (deps, missing) in variants:
+                    merged.update(deps[i])
+                    for req in missing.get(i, []):
+                        if not req in unresolved.setdefault(i, []):
+                            unresolved[i].append(req)
+                rows.append(sorted(merged))
+        return DependencyTable(rows, unresolved)
+
+
+
+class BitsetWeigher:
+    """Mechanism for summing the weights of members of a set,
+    represented as the bits of an arbitrary-precision integer.
+
+    Weights are sliced into bit-planes, such that the total weight
+    is obtained from one population count per binary digit
+    of the largest weight, rather than from one step per member."""
+
+    def __init__(self, weights):
+        nplanes = max(weights).bit_length() if weights else 0
+        planes = [ 0 ] * nplanes
+        for idx, weight in enumerate(weights):
+            bit = 0
+            while weight:
+                if weight & 1:
+                    planes[bit] |= 1 << idx
+                weight >>= 1
+                bit += 1
+        self._planes = [ (shift, mask) for shift, mask in enumerate(planes)
+                                            if mask ]
+
+    def __call__(self, bitset):
+        return sum(PopCount(bitset & mask) << shift
+                        for shift, mask in self._planes)
+
+
+if hasattr(int, 'bit_count'):
+    PopCount = int.bit_count
+else:
+    def PopCount(bitset):
+        """Count the number of bits set within a non-negative integer"""
+        return bin(bitset).count('1')
+
+
+
+class IncrementalResolver:
+    """Dependency closure of a changing selection of packages,
+    updated in proportion to the size of each change.
+
+    Each strongly-connected component of the dependency graph carries
+    a reference count of the explicit selections within it, plus the
+    number of components within the closure that depend upon it.
+    Because the graph of components is acyclic, a component belongs
+    to the closure exactly when its reference count is non-zero."""
+
+    def __init__(self, graph, epochs=['curr'], sizes=None):
+        self._graph = graph
+        table = graph.GetTable(epochs)
+        (self._components, self._members, self._condensed) = \
+                                                    table.GetCondensation()
+        ncomps = len(self._members)
+        self._refcounts = array.array('l', [ 0 ]) * ncomps
+
+        self._compSizes = array.array('q', [ 0 ]) * ncomps
+        if sizes:
+            for comp, members in enumerate(self._members):
+                self._compSizes[comp] = sum(sizes[i] for i in members)
+
+        self._selected = set()
+        self._npackages = 0
+        self._nbytes = 0
+
+    def __contains__(self, pkgname):
+        node = self._graph.index.get(pkgname)
+        return node is not None \
+                and self._refcounts[self._components[node]] > 0
+
+    def GetSelected(self):
+        return sorted(self._selected)
+
+    def GetPackages(self):
+        """List all packages within the dependency closure of the selection"""
+        names = self._graph.names
+        packages = [ names[node]
+                        for comp, members in enumerate(self._members)
+                            if self._refcounts[comp] > 0
+                                for node in members ]
+        packages.sort()
+        return packages
+
+    def GetTotals(self):
+        """Find the number of packages, and their total download size,
+        within the current closure"""
+        return (self._npackages, self._nbytes)
+
+    def Add(self, pkgname):
+        """Select a package, returning the number of packages,
+        and total download size, added to the closure"""
+        comp = self._lookup(pkgname)
+        if pkgname in self._selected:
+            return (0, 0)
+        self._selected.add(pkgname)
+        (npkgs, nbytes) = self._increment(comp)
+        self._npackages += npkgs
+        self._nbytes += nbytes
+        return (npkgs, nbytes)
+
+    def Remove(self, pkgname):
+        """Deselect a package, returning the number of packages,
+        and total download size, removed from the closure"""
+        comp = self._lookup(pkgname)
+        if not pkgname in self._selected:
+            return (0, 0)
+        self._selected.remove(pkgname)
+        (npkgs, nbytes) = self._decrement(comp)
+        self._npackages -= npkgs
+        self._nbytes -= nbytes
+        return (npkgs, nbytes)
+
+    def PreviewAdd(self, pkgname):
+        """Find the number of packages, and download size,
+        that would be added to the closure by selecting a package"""
+        comp = self._lookup(pkgname)
+        if pkgname in self._selected or self._refcounts[comp] > 0:
+            return (0, 0)
+        (npkgs, nbytes) = (0, 0)
+        visited = { comp }
+        stack = [ comp ]
+        while stack:
+            comp = stack.pop()
+            npkgs += len(self._members[comp])
+            nbytes += self._compSizes[comp]
+            for dep in self._condensed.Successors(comp):
+                if self._refcounts[dep] == 0 and not dep in visited:
+                    visited.add(dep)
+                    stack.append(dep)
+        return (npkgs, nbytes)
+
+    def PreviewRemove(self, pkgname):
+        """Find the number of packages, and download size,
+        that would be removed from the closure by deselecting a package"""
+        comp = self._lookup(pkgname)
+        if not pkgname in self._selected:
+            return (0, 0)
+        (npkgs, nbytes) = (0, 0)
+        deltas = { comp: 1 }
+        stack = [ comp ]
+        while stack:
+            comp = stack.pop()
+            if self._refcounts[comp] > deltas[comp]:
+                continue
+            npkgs += len(self._members[comp])
+            nbytes += self._compSizes[comp]
+            for dep in self._condensed.Successors(comp):
+                deltas[dep] = deltas.get(dep, 0) + 1
+                if deltas[dep] == self._refcounts[dep]:
+                    stack.append(dep)
+        return (npkgs, nbytes)
+
+    def _lookup(self, pkgname):
+        node = self._graph.index.get(pkgname)
+        if node is None:
+            raise PMCygException('Invalid package name "{0}"' \
+                                    .format(pkgname))
+        return self._components[node]
+
+    def _increment(self, comp):
+        """Increase reference count of component, recursively
+        adding its dependencies if it has newly joined the closure"""
+        (npkgs, nbytes) = (0, 0)
+        refcounts = self._refcounts
+        stack = [ comp ]
+        while stack:
+            comp = stack.pop()
+            refcounts[comp] += 1
+            if refcounts[comp] > 1:
+                continue
+            npkgs += len(self._members[comp])
+            nbytes += self._compSizes[comp]
+            stack.extend(self._condensed.Successors(comp))
+        return (npkgs, nbytes)
+
+    def _decrement(self, comp):
+        """Decrease reference count of component, recursively
+        releasing its dependencies if it has left the closure"""
+        (npkgs, nbytes) = (0, 0)
+        refcounts = self._refcounts
+        stack = [ comp ]
+        while stack:
+            comp = stack.pop()
+            refcounts[comp] -= 1
+            if refcounts[comp] > 0:
+                continue
+            npkgs += len(self._members[comp])
+            nbytes += self._compSizes[comp]
+            stack.extend(self._condensed.Successors(comp))
+        return (npkgs, nbytes)
+
+
+
 class PkgSetProcessor(BuildReporter):
     """Utilities for computing package dependencies,
     given user-supplied selections of Cygwin package names,
@@ -947,37 +3941,18 @@ class PkgSetProcessor(BuildReporter):
     def ExpandDependencies(self, selected, epochs=['curr'],
                            ignoreUnresolved=False):
         """Expand list of packages to include all their dependencies"""
-        pkgdict = self._masterList.GetPackageDict()
-
-        additions = set(selected)
-        packages = set()
-        badpkgnames = []
-        badrequires = set()
+        graph = self._masterList.GetDependencyGraph()
+        table = graph.GetTable(epochs)
 
-        while additions:
-            pkg = additions.pop()
-            packages.add(pkg)
+        selected = set(selected)
+        badpkgnames = [ pkg for pkg in selected if not pkg in graph.index ]
+        closure = table.Closure(graph.GetIds(selected))
 
-            pkginfo = pkgdict.get(pkg, None)
-            if not pkginfo:
-                badpkgnames.append(pkg)
-                continue
-
-            # Find dependencies of current package & add to stack:
-            for epoch in epochs:
-                try:
-                    reqlist = pkginfo.GetDependencies([epoch])
-                    for r in reqlist:
-                        if not pkgdict.get(r):
-                            badrequires.add((pkg, r))
-                            continue
-                        if not r in packages:
-                            additions.add(r)
-                except:
-                    if not pkginfo.HasFileContent():
-                        self._statview('Cannot find epoch \'{0}\' for {1}' \
-                                        .format(epoch, pkg),
-                                       BuildViewer.SEV_WARNING)
+        badrequires = set()
+        if table.unresolved:
+            for node in closure:
+                for dep in table.unresolved.get(node, []):
+                    badrequires.add((graph.names[node], dep))
 
         if badpkgnames and not ignoreUnresolved:
             badpkgnames.sort()
@@ -993,45 +3968,171 @@ class PkgSetProcessor(BuildReporter):
                                  .format(n=nBad, p=', '.join(truncbad)))
         if badrequires:
             links = [ '{0}->{1}'.format(pkg, dep)
-                        for (pkg, dep) in badrequires ]
+                        for (pkg, dep) in sorted(badrequires) ]
             self._statview('Master package list contains unresolvable'
                            ' dependencies: {0}'.format(', '.join(links)),
                            BuildViewer.SEV_WARNING)
 
-        packages = list(packages)
+        packages = graph.GetNames(closure) + badpkgnames
         packages.sort()
 
         return packages
 
-    def ContractDependencies(self, pkglist, minvotes=6):
-        """Remove (most) automatically installed packages from list,
+    def MakeResolver(self, selected=[], epochs=['curr'],
+                     includeSources=False):
+        """Construct an IncrementalResolver, initially holding
+        the closure of the given packages, which can then be
+        adjusted one package at a time"""
+        graph = self._masterList.GetDependencyGraph()
+        pkgdict = self._masterList.GetPackageDict()
+        sizes = [ sum(self._downloadFiles(pkgdict[pkg], epochs,
+                                          includeSources).values())
+                    for pkg in graph.names ]
+
+        resolver = IncrementalResolver(graph, epochs, sizes)
+        for pkg in selected:
+            resolver.Add(pkg)
+        return resolver
+
+    def ComputeClosureCosts(self, selected=[], epochs=['curr'],
+                            includeSources=False):
+        """Find the number of files, and bytes, within the dependency
+        closure of every available package, together with the bytes
+        that each package contributes to the closure of a selection.
+
+        This returns a dictionary mapping each package name onto
+        a tuple of (closure files, closure bytes, unique bytes), where
+        the last field is the size that would be removed by deselecting
+        a selected package, or that would be added by selecting any other.
+        Closures are computed in bulk, as bitsets over the acyclic graph
+        of strongly-connected components."""
+        graph = self._masterList.GetDependencyGraph()
+        pkgdict = self._masterList.GetPackageDict()
+        table = graph.GetTable(epochs)
+        (components, members, condensed) = table.GetCondensation()
+
+        ncomps = len(members)
+        compFiles = [ 0 ] * ncomps
+        compBytes = [ 0 ] * ncomps
+        for node, pkg in enumerate(graph.names):
+            files = self._downloadFiles(pkgdict[pkg], epochs, includeSources)
+            compFiles[components[node]] += len(files)
+            compBytes[components[node]] += sum(files.values())
+        countFiles = BitsetWeigher(compFiles)
+        countBytes = BitsetWeigher(compBytes)
+
+        # Components are numbered such that dependencies come first:
+        reach = [ 0 ] * ncomps
+        for comp in range(ncomps):
+            bits = 1 << comp
+            for dep in condensed.Successors(comp):
+                bits |= reach[dep]
+            reach[comp] = bits
+
+        # Find closure of selection, omitting each selected package in turn:
+        selnodes = graph.GetIds(sorted(set(selected)))
+        nsel = len(selnodes)
+        (prefix, suffix) = ([ 0 ] * (nsel + 1), [ 0 ] * (nsel + 1))
+        for i in range(nsel):
+            prefix[i+1] = prefix[i] | reach[components[selnodes[i]]]
+            suffix[nsel-i-1] = suffix[nsel-i] | \
+                                reach[components[selnodes[nsel-i-1]]]
+        closure = prefix[nsel]
+        remainders = { selnodes[i]: (prefix[i] | suffix[i+1])
+                            for i in range(nsel) }
+
+        costs = {}
+        compCosts = {}
+        for node, pkg in enumerate(graph.names):
+            comp = components[node]
+            if not comp in compCosts:
+                compCosts[comp] = (countFiles(reach[comp]),
+                                   countBytes(reach[comp]),
+                                   countBytes(reach[comp] & ~closure))
+            (nfiles, nbytes, unique) = compCosts[comp]
+            if node in remainders:
+                unique = countBytes(closure & ~remainders[node])
+            costs[pkg] = (nfiles, nbytes, unique)
+
+        return costs
+
+    def MakeCostReport(self, stream, selected=[], epochs=['curr'],
+                       includeSources=False):
+        """Generate tab-separated listing of the dependency-closure
+        costs of every package, relative to a selection of packages,
+        emitting this via the supplied output stream."""
+        costs = self.ComputeClosureCosts(selected, epochs, includeSources)
+        selected = set(pkg for pkg in selected if pkg in costs)
+        resolver = self.MakeResolver(selected, epochs, includeSources)
+        (npkgs, nbytes) = resolver.GetTotals()
+
+        lines = [ \
+            '# Dependency-closure costs for pmcyg' \
+                ' (Cygwin(TM) Partial Mirror)',
+            '# Autogenerated on ' + time.asctime(),
+            '# from: ' + self._masterList.GetSourceURL(),
+            '# Selection of {0:d} packages requires {1:d} packages,' \
+                ' totalling {2:d} bytes'.format(len(selected), npkgs, nbytes),
+            '#',
+            '# Columns: package, selected (*), files in closure,' \
+                ' bytes in closure,',
+            '#   bytes removed if deselected, or added if selected'
+        ]
+        print('\n'.join(lines), file=stream)
+
+        ordering = sorted(costs.items(),
+                          key=lambda item: (not item[0] in selected,
+                                            -item[1][2], -item[1][1],
+                                            item[0]))
+        for pkg, (nfiles, nbytes, unique) in ordering:
+            stream.write('{0}\t{1}\t{2:d}\t{3:d}\t{4:d}\n' \
+                            .format(pkg, '*' if pkg in selected else '',
+                                    nfiles, nbytes, unique))
+
+    def FindDependents(self, selected, epochs=['curr']):
+        """Find all packages which directly or indirectly depend on
+        any of the selected packages, including those packages themselves"""
+        graph = self._masterList.GetDependencyGraph()
+        table = graph.GetTable(epochs)
+        closure = table.Closure(graph.GetIds(selected), reverse=True)
+        return sorted(graph.GetNames(closure))
+
+    def ContractDependencies(self, pkglist, epochs=['curr']):
+        """Remove automatically installed packages from list,
         such that an initial selection of packages can be reduced to
-        a minimal subset that has the same effect after dependency expansion."""
-        dependencies = self._buildDependencies()
-        votes = { p: 0 for p in pkglist }
-
-        # Find number of times each package is cited as a dependency:
-        for pkg in pkglist:
-            reqs = dependencies.get(pkg, [])
-            for req in reqs:
-                votes[req] = votes.get(req, 0) + 1
-
-        # Finding zero-vote packages would be sufficient if the graph of
-        # dependencies did not contain loops (e.g. gcc-mingw-g++ <-> gcc-g++).
-        # We add packages with many votes because they are probably worth
-        # listing explicitly, even if they would be installed as dependencies
-        # of zero-vote packages.
-        primaries = [pkg for pkg, n in votes.items()
-                            if n == 0 or n >= minvotes]
-
-        # Preserve any packages not covered by the tree grown from
-        # the zero-vote packages, to handle segments of the dependency graph
-        # containing loops, allowing for packages (e.g. zlib0) that might be
-        # in the process of being declared obsolete:
-        coverage = self.ExpandDependencies(primaries, ignoreUnresolved=True)
-        contracted = set(pkglist).difference(coverage)
-
-        packages = list(contracted.union(primaries))
+        a minimal subset that has the same effect after dependency expansion.
+
+        Packages within dependency loops (e.g. gcc-mingw-g++ <-> gcc-g++)
+        are grouped into strongly-connected components, from which
+        one package is retained for each component of the expanded
+        selection that is not itself a dependency of another component."""
+        graph = self._masterList.GetDependencyGraph()
+        table = graph.GetTable(epochs)
+        components = table.GetComponents()
+        closure = table.Closure(graph.GetIds(pkglist))
+
+        covered = set()
+        for node in closure:
+            comp = components[node]
+            for dep in table.Successors(node):
+                if components[dep] != comp:
+                    covered.add(components[dep])
+
+        # Choose representative of each uncovered component,
+        # preferring packages that were originally listed:
+        listed = set(pkglist)
+        chosen = {}
+        for node in closure:
+            comp = components[node]
+            if comp in covered:
+                continue
+            pkg = graph.names[node]
+            rank = (not pkg in listed, pkg)
+            if comp not in chosen or rank < chosen[comp]:
+                chosen[comp] = rank
+
+        packages = [ pkg for (unlisted, pkg) in chosen.values() ]
+        packages.extend(pkg for pkg in listed if not pkg in graph.index)
         packages.sort()
 
         return packages
@@ -1128,40 +4229,136 @@ class PkgSetProcessor(BuildReporter):
                 os.remove(fn)
             os.rename(newfn, fn)
 
+    @staticmethod
+    def _downloadFiles(pkginfo, epochs, includeSources=False):
+        """Find the sizes of the files that would be downloaded
+        for a package, across a set of epochs"""
+        pkgtypes = set([ pkginfo.GetDefaultFile() ])
+        if includeSources:
+            pkgtypes.add('source')
+        files = {}
+        for ptype in pkgtypes:
+            for epoch in epochs:
+                try:
+                    flds = pkginfo.GetAny(ptype, [epoch]).split()
+                    files[flds[0]] = int(flds[1])
+                except (AttributeError, IndexError, ValueError):
+                    pass
+        return files
 
-    def _buildDependencies(self, epoch='curr'):
-        """Build lookup table of dependencies of each available package"""
-        pkgdict = self._masterList.GetPackageDict()
-        dependencies = {}
-        for pkg, pkginfo in pkgdict.items():
-            try:
-                dependencies[pkg] = pkginfo.GetDependencies([epoch])
-            except:
-                pass
-        return dependencies
 
 
+class PackageListCache:
+    """On-disk cache of parsed setup.ini databases, allowing a
+    MasterPackageList to be restored without re-parsing its source
+    unless that has changed since it was last downloaded.
 
-class MasterPackageList(BuildReporter):
-    """Database of available Cygwin packages built from 'setup.ini' file"""
+    Entries are keyed by the URL of the setup.ini file, and record
+    the HTTP validators (ETag etc) and header fields (setup-timestamp etc)
+    of the version from which they were built. A copy of the raw
+    setup.ini file is also kept, for refreshing via conditional GET.
+    Entries that have not been used recently are evicted."""
 
-    RE_DBline = re.compile(r'''
-          ((?P<relinfo>^(release|arch|setup-\S+)) :
-                                \s+ (?P<relParam>\S+) $)
-        | (?P<comment>\# .* $)
-        | (?P<package>^@ \s+ (?P<pkgName> \S+) $)
-        | (?P<epoch>^\[ (?P<epochName>[a-z]+) \] $)
-        | ((?P<field>^[a-zA-Z][-a-zA-Z0-9]+) : \s+ (?P<fieldVal> .*) $)
-        | (?P<blank>^\s* $)
-        ''', re.VERBOSE)
+    FormatVersion = 3
+    MaxEntries = 16
+    MaxAge = 90 * 86400
+
+    def __init__(self, cachedir: str) -> None:
+        self._cachedir = cachedir
+
+    def Load(self, URL: str):
+        """Retrieve the cached entry for a URL, or None"""
+        try:
+            with open(self._path(URL), 'rb') as fp:
+                entry = pickle.load(fp)
+            if entry.get('format') == self.FormatVersion \
+                    and entry.get('url') == URL:
+                os.utime(self._path(URL))
+                return entry
+        except Exception:
+            pass
+        return None
+
+    def Store(self, URL: str, validators: dict,
+              header: dict, packages: dict) -> None:
+        """Atomically record a parsed database, ignoring any errors"""
+        entry = { 'format':     self.FormatVersion,
+                  'url':        URL,
+                  'validators': validators,
+                  'header':     header,
+                  'packages':   packages }
+        path = self._path(URL)
+        tmppath = '{0}.{1:d}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self._cachedir, exist_ok=True)
+            with open(tmppath, 'wb') as fp:
+                pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, path)
+        except (OSError, pickle.PicklingError):
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+        self.Prune(keep=URL)
+
+    def Prune(self, keep: str=None) -> None:
+        """Remove entries (and their copies of setup.ini) which have not
+        been used within MaxAge seconds, together with the least recently
+        used entries beyond the first MaxEntries, except that for 'keep'"""
+        pattern = re.compile(r'^(?:{0})?setup-([0-9a-f]{{24}})\.' \
+                                .format(re.escape(ValidatedCopy.SidecarPrefix)))
+        entries = {}
+        try:
+            for filename in os.listdir(self._cachedir):
+                matches = pattern.match(filename)
+                if not matches:
+                    continue
+                path = os.path.join(self._cachedir, filename)
+                entry = entries.setdefault(matches.group(1), [ 0.0, [] ])
+                entry[0] = max(entry[0], os.path.getmtime(path))
+                entry[1].append(path)
+        except OSError:
+            return
+
+        keepDigest = self._digest(keep) if keep else None
+        ranked = sorted(entries.items(), key=lambda item: item[1][0],
+                        reverse=True)
+        horizon = time.time() - self.MaxAge
+        for idx, (digest, (newest, paths)) in enumerate(ranked):
+            if digest == keepDigest:
+                continue
+            if idx >= self.MaxEntries or newest < horizon:
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def LocalCopy(self, URL: str, pool=None) -> ValidatedCopy:
+        """Construct a local copy of the raw setup.ini file,
+        which can be refreshed via conditional requests"""
+        suffix = URL.rsplit('/', 1)[-1].rsplit('.', 1)[-1]
+        return ValidatedCopy(URL, self._path(URL, suffix), pool)
+
+    def _path(self, URL: str, suffix: str='pickle') -> str:
+        return os.path.join(self._cachedir,
+                            'setup-{0}.{1}'.format(self._digest(URL), suffix))
 
-    RE_RSTRIP = re.compile(r'\s+$')
+    @staticmethod
+    def _digest(URL: str) -> str:
+        return hashlib.sha256(URL.encode('utf-8')).hexdigest()[:24]
+
+
+
+class MasterPackageList(BuildReporter):
+    """Database of available Cygwin packages built from 'setup.ini' file"""
 
-    def __init__(self, iniURL=None, Viewer=None):
+    def __init__(self, iniURL=None, Viewer=None, Pool=None):
         BuildReporter.__init__(self, Viewer)
 
+        self._pool = Pool if Pool else ConnectionPool()
         self._pkgLock = threading.Lock()
         self._iniURL = None
+        self._diskCache = None
+        self._loadTimes = {}
         self.ClearCache()
         self.SetSourceURL(iniURL)
 
@@ -1170,15 +4367,24 @@ class MasterPackageList(BuildReporter):
             self._pkgLock.acquire()
             self._ini_header = None
             self._ini_packages = None
+            self._depGraph = None
         finally:
             self._pkgLock.release()
 
     def GetSourceURL(self):
         return self._iniURL
 
+    def SetCacheDir(self, cachedir=None):
+        """Set directory in which parsed package lists are cached
+        between sessions (or None to disable caching)"""
+        self._diskCache = PackageListCache(cachedir) if cachedir else None
+
     def SetSourceURL(self, iniURL=None, reload=False):
         if reload or iniURL != self._iniURL:
             self.ClearCache()
+            # Timings of loading any previous package list are now irrelevant:
+            with self._pkgLock:
+                self._loadTimes = {}
         self._iniURL = iniURL
 
     def GetHeaderInfo(self):
@@ -1196,6 +4402,25 @@ class MasterPackageList(BuildReporter):
     def HasCachedData(self):
         return (self._ini_header and self._ini_packages)
 
+    def TakeLoadTimes(self):
+        """Find the time (in seconds) spent fetching ('ini-fetch')
+        and parsing ('parse') setup.ini since this was last called,
+        or since the source URL was changed.
+        When setup.ini is not cached, it is parsed while being fetched,
+        so the fetching time only covers connecting to the server."""
+        with self._pkgLock:
+            (times, self._loadTimes) = (self._loadTimes, {})
+            return times
+
+    def GetDependencyGraph(self):
+        """Find the index of dependencies between all packages,
+        building this on first use"""
+        pkgdict = self.GetPackageDict()
+        with self._pkgLock:
+            if self._depGraph is None:
+                self._depGraph = DependencyGraph(pkgdict)
+            return self._depGraph
+
     def GetCategories(self):
         """Construct lists of packages grouped into categories"""
 
@@ -1223,14 +4448,22 @@ class MasterPackageList(BuildReporter):
                 return
             self._statview.startOperation('Scanning mirror index at {0:s}' \
                                             .format(self._iniURL))
-            self._parseSource()
-            self._statview.endOperation('done')
+            t0 = time.perf_counter()
+            fetched = self._loadTimes.get('ini-fetch', 0.0)
+            if self._parseSource():
+                self._statview.endOperation('done (cached)')
+            else:
+                self._statview.endOperation('done')
+            fetching = self._loadTimes.get('ini-fetch', 0.0) - fetched
+            self._loadTimes['parse'] = self._loadTimes.get('parse', 0.0) \
+                            + max(0.0, time.perf_counter() - t0 - fetching)
         finally:
             self._statview.flushOperation()
             self._pkgLock.release()
 
     def _parseSource(self):
-        """Acquire setup.ini file from supplied URL and parse package info
+        """Acquire setup.ini file from supplied URL and parse package info,
+        returning True if the result could be taken from the on-disk cache
 
         The format of Cygwin's "setup.ini" files is described at
         https://sourceware.org/cygwin-apps/setup.ini.html
@@ -1238,127 +4471,209 @@ class MasterPackageList(BuildReporter):
         self._ini_header = {}
         self._ini_packages = {}
 
+        (cached, localCopy) = (None, None)
+        if self._diskCache:
+            cached = self._diskCache.Load(self._iniURL)
+            localCopy = self._diskCache.LocalCopy(self._iniURL, self._pool)
+
+        t0 = time.perf_counter()
         try:
-            fp = SetupIniFetcher(self._iniURL)
+            fp = SetupIniFetcher(self._iniURL, self._pool, localCopy)
         except Exception as ex:
             raise PMCygException("Failed to open {0:s} - {1:s}" \
                                     .format(self._iniURL, str(ex)))
+        self._loadTimes['ini-fetch'] = time.perf_counter() - t0 \
+                                        + self._loadTimes.get('ini-fetch', 0.0)
 
-        lineno = 0
-        self._pkgname = None
-        self._pkgtxt = []
-        self._pkgdict = PackageSummary()
-        self._epoch = None
-        self._fieldname = None
-        self._fieldlines = None
-        self._inquote = False
+        if cached and fp.validators \
+                and fp.validators == cached['validators']:
+            fp.close()
+            self._adoptCached(cached)
+            return True
 
-        for line in fp:
-            lineno += 1
+        lines = iter(fp)
+        (line, lineno) = self._parseHeader(lines)
 
-            if self._inquote and self._fieldname:
-                self._ingestQuotedLine(line)
-            else:
-                self._ingestOrdinaryLine(line, lineno=lineno)
+        if cached and self._ini_header.get('setup-timestamp') \
+                and self._ini_header == cached['header']:
+            fp.close()
+            self._adoptCached(cached)
+            self._diskCache.Store(self._iniURL, fp.validators,
+                                  self._ini_header, self._ini_packages)
+            return True
 
-            if self._pkgname:
-                self._pkgtxt.append(line)
+        self._parsePackages(line, lines, lineno)
         fp.close()
 
-        self._finalizePackage()
+        if self._diskCache:
+            self._diskCache.Store(self._iniURL, fp.validators,
+                                  self._ini_header, self._ini_packages)
+        return False
 
-    def _ingestQuotedLine(self, line):
-        trimmed = line.rstrip()
-        if trimmed.endswith('"'):
-            self._fieldlines.append(trimmed[0:-1])
-            self._pkgdict.Set(self._fieldname,
-                                '\n'.join(self._fieldlines), self._epoch)
-            self._fieldname = None
-            self._inquote = False
-        else:
-            self._fieldlines.append(trimmed)
-
-    def _ingestOrdinaryLine(self, line, lineno=None):
-        """Classify current line as package definition/field etc"""
-        matches = self.RE_DBline.match(line)
-        if not matches:
-            raise SyntaxError("Unrecognized content on line {0:d}" \
-                                .format(lineno))
-
-        if matches.group('relinfo'):
-            self._ini_header[matches.group('relinfo')] = matches.group('relParam')
-        elif matches.group('comment'):
-            pass
-        elif matches.group('package'):
-            self._finalizePackage()
-
-            self._pkgname = matches.group('pkgName')
-            self._epoch = 'curr'
-            self._fieldname = None
-        elif matches.group('epoch'):
-            self._epoch = matches.group('epochName')
-        elif matches.group('field'):
-            self._fieldname = matches.group('field')
-            self._fieldtext = matches.group('fieldVal')
-            quotepos = self._fieldtext.find('"')
-            if quotepos < 0:
-                # Field value appears without quotation marks on single line:
-                self._pkgdict.Set(self._fieldname,
-                                    self._fieldtext, self._epoch)
-            if quotepos >= 0:
-                if quotepos > 0:
-                    # Field value contains additional metadata prefix:
-                    prefix = self._fieldtext[0:quotepos].strip()
-                    self._fieldname += '_' + prefix
-                    self._fieldtext = self._fieldtext[(quotepos+1):]
-                if self._fieldtext[1:].endswith('"'):
-                    # Quoted string starts and ends on current line:
-                    self._pkgdict.Set(self._fieldname,
-                                        self._fieldtext[1:-1], self._epoch)
-                else:
-                    # Quoted string starts on current line, presumably ending later:
-                    self._fieldlines = [ self._fieldtext[1:] ]
-                    self._inquote = True
-
-            if self._fieldtext.startswith('"'):
-                if self._fieldtext[1:].endswith('"'):
-                    self._pkgdict.Set(self._fieldname,
-                                        self._fieldtext[1:-1], self._epoch)
+    def _adoptCached(self, cached):
+        self._ini_header = cached['header']
+        self._ini_packages = cached['packages']
+
+    def _parseHeader(self, lines):
+        """Ingest release information preceding the first package,
+        returning the first package line and its line-number"""
+        lineno = 0
+        for line in lines:
+            lineno += 1
+            lead = line[:1]
+            if lead == '@':
+                return (line, lineno)
+            if lead == '#' or not line.strip():
+                continue
+            (name, sep, value) = line.partition(':')
+            if not sep or not value[:1].isspace():
+                raise SyntaxError("Unrecognized content on line {0:d}" \
+                                    .format(lineno))
+            self._ini_header[name] = value.strip()
+        return (None, lineno)
+
+    def _parsePackages(self, line, lines, lineno):
+        """Ingest package records, starting from an "@ pkgname" line
+
+        Lines are classified by their first character, with all
+        parser state held in local variables, because this loop
+        dominates the time taken to read each setup.ini file."""
+        packages = self._ini_packages
+        textbuf = PackageTextBuffer()
+        pkgname = None
+        pkgtxt = []
+        pkgdict = None
+        epoch = None
+        quoted = None       # Name of field whose value spans several lines
+        fieldlines = None
+
+        while line is not None:
+            if quoted:
+                trimmed = line.rstrip()
+                if trimmed.endswith('"'):
+                    fieldlines.append(trimmed[:-1])
+                    pkgdict.Set(quoted, '\n'.join(fieldlines), epoch)
+                    quoted = None
                 else:
-                    self._fieldlines = [ self._fieldtext[1:] ]
-                    self._inquote = True
+                    fieldlines.append(trimmed)
+                pkgtxt.append(line)
+                line = next(lines, None)
+                lineno += 1
+                continue
+
+            lead = line[:1]
+            if lead == '@':
+                if pkgname:
+                    packages[pkgname] = self._finalizePackage(pkgdict, pkgtxt,
+                                                              textbuf)
+                words = line[1:].split()
+                if len(words) != 1 or not line[1:2].isspace():
+                    raise SyntaxError("Unrecognized package on line {0:d}" \
+                                        .format(lineno))
+                pkgname = words[0]
+                pkgtxt = []
+                pkgdict = PackageSummary()
+                epoch = 'curr'
+            elif lead == '[':
+                trimmed = line.rstrip()
+                if not trimmed.endswith(']'):
+                    raise SyntaxError("Unrecognized epoch on line {0:d}" \
+                                        .format(lineno))
+                epoch = trimmed[1:-1]
+            elif lead == '#':
+                pass
+            elif lead.isspace() or not lead:
+                if line.strip():
+                    raise SyntaxError("Unexpected indentation on line {0:d}" \
+                                        .format(lineno))
             else:
-                self._pkgdict.Set(self._fieldname,
-                                    self._fieldtext, self._epoch)
+                (name, sep, value) = line.partition(':')
+                if not sep or not value[:1].isspace() \
+                        or not name.replace('-', '').isalnum():
+                    raise SyntaxError("Unrecognized content on line {0:d}" \
+                                        .format(lineno))
+                value = value.strip()
+                quotepos = value.find('"')
+                if quotepos < 0:
+                    pkgdict.Set(name, value, epoch)
+                else:
+                    if quotepos > 0:
+                        # Field value contains additional metadata prefix,
+                        # e.g. 'message: pkgname "text"':
+                        name += '_' + value[:quotepos].strip()
+                    value = value[(quotepos+1):]
+                    if value.endswith('"'):
+                        pkgdict.Set(name, value[:-1], epoch)
+                    else:
+                        # Quoted string presumably ends on a later line:
+                        fieldlines = [ value ]
+                        quoted = name
+
+            pkgtxt.append(line)
+            line = next(lines, None)
+            lineno += 1
+
+        if pkgname:
+            packages[pkgname] = self._finalizePackage(pkgdict, pkgtxt, textbuf)
 
-    def _finalizePackage(self):
+    def _finalizePackage(self, pkgdict, pkgtxt, textbuf):
         """Final assembly of text & field records describing single package"""
+        pkgdict.SetText(textbuf, ''.join(pkgtxt).rstrip())
+        pkgdict.IndexDependencies()
+        return pkgdict
+
 
-        if not self._pkgname:
-            return
 
-        self._pkgdict.Set('TEXT', self.RE_RSTRIP.sub('', ''.join(self._pkgtxt)))
-        self._ini_packages[self._pkgname] = self._pkgdict
+class PackageTextBuffer:
+    """Shared store of the raw setup.ini records of many packages,
+    held as a single block of UTF-8 bytes, from which the text
+    of individual packages is only decoded on demand."""
+    __slots__ = ('_data',)
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def __len__(self):
+        return len(self._data)
 
-        self._pkgname = None
-        self._pkgtxt = []
-        self._pkgdict = PackageSummary()
+    def Append(self, text):
+        """Add package text, returning its (offset, length) in the buffer"""
+        raw = text.encode(SI_TEXT_ENCODING)
+        offset = len(self._data)
+        self._data.extend(raw)
+        return (offset, len(raw))
 
+    def Get(self, offset, length):
+        return self._data[offset:(offset + length)].decode(SI_TEXT_ENCODING)
 
 
 class PackageSummary:
     """Dictionary-like container of package information,
-    specialized to cope with multiple epochs"""
+    specialized to cope with multiple epochs
+
+    Fields are held in one dictionary per epoch, with interned
+    field and epoch names, so that the many thousands of instances
+    built from each setup.ini share as much storage as possible.
+    The raw 'TEXT' of the package may be held in a PackageTextBuffer."""
+    __slots__ = ('_epochs', '_deps', '_textbuf', '_textpos', '_textlen')
+
+    # Fields whose values are frequently repeated between packages:
+    InternedFields = frozenset(('category', 'version'))
 
     def __init__(self):
-        self._pkginfo = {}
-        self._epochs = set()
+        self._epochs = {}
+        self._deps = None
+        self._textbuf = None
+        self._textpos = 0
+        self._textlen = 0
 
     def GetAny(self, field, epochset=[], allow_test=True):
         """Lookup the value of a particular field for a set of possible epochs.
 
         An empty set of allowed epochs matches current or default epoch
         """
+        if field == 'TEXT' and self._textbuf is not None:
+            return self._textbuf.Get(self._textpos, self._textlen)
 
         value = None
         epochset = list(epochset)
@@ -1370,25 +4685,30 @@ class PackageSummary:
             epochset.append('test')
             # libssl3 has been observed around 01Jul23 being required by installer, but only available in the "test" epoch
         for epoch in epochset:
-            value = self._pkginfo.get((field, epoch), None)
-            if value: break
+            fields = self._epochs.get(epoch)
+            if fields:
+                value = fields.get(field, None)
+                if value: break
         return value
 
     def GetAll(self, field, epochset=[]):
         """Lookup the values of a particular field,
         across all possible epochs in the supplied list."""
+        if field == 'TEXT' and self._textbuf is not None:
+            return [ self._textbuf.Get(self._textpos, self._textlen) ]
+
         values = []
         if not epochset:
-            epochset = self._epochs
+            epochset = self._epochs.keys()
         for epoch in epochset:
-            val = self._pkginfo.get((field, epoch), None)
+            val = self._epochs.get(epoch, {}).get(field, None)
             if val: values.append(val)
         return values
 
     def HasFileContent(self):
         """Determine whether package has non-empty binary or source file"""
         for variant in ('install', 'source'):
-            if self.GetAny(variant, self._epochs):
+            if self.GetAny(variant, self._epochs.keys()):
                 return True
         return False
 
@@ -1407,19 +4727,69 @@ class PackageSummary:
         return False
 
     def GetDependencies(self, epochset=[]):
-        """Return a list of other packages on which this package depends."""
-        all_deps = []
-        deps, reqs = ( self.GetAny(f) for f in ('depends2', 'requires') )
-        if deps:
-            all_deps.extend(x.strip() for x in deps.split(','))
-        if reqs:
-            all_deps.extend(x.split())
-        return sorted(set(all_deps))
+        """Return a list of other packages on which this package depends,
+        in any of the given epochs (or the current epoch by default)
+
+        Epochs without their own dependency fields inherit
+        those of the current (or default, or test) epoch."""
+        if self._deps is None:
+            self.IndexDependencies()
+        deps = self._deps
+        fallback = deps.get('curr') or deps.get(None) or deps.get('test') \
+                        or ()
+        if not epochset:
+            epochset = [ 'curr' ]
+
+        variants = []
+        for epoch in epochset:
+            reqs = deps.get(epoch) or fallback
+            if not any(reqs is v for v in variants):
+                variants.append(reqs)
+        if len(variants) == 1:
+            return list(variants[0])
+        return sorted(set().union(*variants))
+
+    def IndexDependencies(self):
+        """Parse the depends2/requires fields of each epoch,
+        with epochs having identical dependencies sharing storage"""
+        self._deps = {}
+        for epoch, fields in self._epochs.items():
+            deps, reqs = ( fields.get(f) for f in ('depends2', 'requires') )
+            if not (deps or reqs):
+                continue
+            all_deps = set()
+            if deps:
+                all_deps.update(x.strip() for x in deps.split(','))
+            if reqs:
+                all_deps.update(reqs.split())
+            all_deps.discard('')
+            all_deps = tuple(sorted(sys.intern(d) for d in all_deps))
+            for other in self._deps.values():
+                if other == all_deps:
+                    all_deps = other
+                    break
+            self._deps[epoch] = all_deps
 
     def Set(self, field, value, epoch=None):
         """Record field=value for a particular epoch (e.g. curr/prev/None)"""
-        self._pkginfo[(field, epoch)] = value
-        self._epochs.add(epoch)
+        if epoch is not None:
+            epoch = sys.intern(epoch)
+        fields = self._epochs.get(epoch)
+        if fields is None:
+            fields = self._epochs[epoch] = {}
+        if field in self.InternedFields:
+            value = sys.intern(value)
+        fields[sys.intern(field)] = value
+        if field == 'TEXT':
+            self._textbuf = None
+        elif field in ('depends2', 'requires'):
+            self._deps = None
+
+    def SetText(self, textbuf, text):
+        """Record the raw setup.ini text of the package,
+        within a buffer shared with other packages"""
+        (self._textpos, self._textlen) = textbuf.Append(text)
+        self._textbuf = textbuf
 
 
 ##
@@ -1428,9 +4798,18 @@ class PackageSummary:
 
 class FetchStats:
     """Mechanism for accumulating statistics of the progress
-    of package downloads."""
+    of package downloads.
+
+    As well as counting whole packages, this tracks the bytes received
+    by each transfer still in progress, so that the overall throughput
+    and the time remaining can be estimated. All methods may be called
+    concurrently from multiple download threads."""
+
+    RateWindow = 10.0
 
     def __init__(self, downloads=None):
+        self._lock = threading.Lock()
+
         # Record of total bytes downloaded:
         self._newSize = 0
         self._alreadySize = 0
@@ -1443,6 +4822,13 @@ class FetchStats:
         self._failCount = 0
         self._totalCount = 0
 
+        # Record of transfers in progress, and recently received bytes:
+        self._inflight = {}
+        self._received = 0
+        self._samples = collections.deque()
+        self._timings = {}
+        self._retries = collections.Counter()
+
         if downloads:
             self._totalSize = sum([size for (ref, size, hash) in downloads])
             self._totalCount = len(downloads)
@@ -1454,30 +4840,332 @@ class FetchStats:
     def Counts(self):
         """Find the number of packages downloaded,
         as a tuple of total/new/pre-existing/failed."""
-        return { 'Total': self._totalCount,
-                'New': self._newCount,
-                'Already': self._alreadyCount,
-                'Fail': self._failCount }
+        with self._lock:
+            return { 'Total': self._totalCount,
+                    'New': self._newCount,
+                    'Already': self._alreadyCount,
+                    'Fail': self._failCount }
+
+    def Sizes(self):
+        """Find the number of bytes in each category of package,
+        including those received so far by transfers in progress"""
+        with self._lock:
+            return { 'Total': self._totalSize,
+                    'New': self._newSize,
+                    'Already': self._alreadySize,
+                    'Fail': self._failSize,
+                    'InFlight': sum(pos for (pos, size, t0, t1)
+                                        in self._inflight.values()),
+                    'Received': self._received }
 
     def Failures(self):
         return self._failCount
 
     def AddNew(self, pkg, size):
         """Mark the named package as being newly downloaded"""
-        self._newSize += size
-        self._newCount += 1
+        with self._lock:
+            self._newSize += size
+            self._newCount += 1
 
     def AddAlready(self, pkg, size):
         """Mark the named package as having previously been
         successfully downloaded."""
-        self._alreadySize += size
-        self._alreadyCount += 1
+        with self._lock:
+            self._alreadySize += size
+            self._alreadyCount += 1
 
     def AddFail(self, pkg, size):
         """Mark the named package as having failed
         to download successfully"""
-        self._failSize += size
-        self._failCount += 1
+        with self._lock:
+            self._failSize += size
+            self._failCount += 1
+
+    def AddRetry(self, pkg):
+        """Note that a package will be downloaded again after failing"""
+        with self._lock:
+            self._retries[pkg] += 1
+
+    def Retries(self):
+        """Find the number of retries needed by each package"""
+        with self._lock:
+            return dict(self._retries)
+
+    def StartTransfer(self, pkg, size, offset=0):
+        """Note that a package is about to be requested from a mirror,
+        possibly resuming from an existing partial download"""
+        with self._lock:
+            self._inflight[pkg] = [ offset, size, time.monotonic(), None ]
+
+    def AddProgress(self, pkg, nbytes, position=None):
+        """Note the arrival of a block of data for a package,
+        together with the number of bytes of the package now present"""
+        now = time.monotonic()
+        with self._lock:
+            transfer = self._inflight.get(pkg)
+            if transfer:
+                transfer[0] = position if position is not None \
+                                else transfer[0] + nbytes
+                if transfer[3] is None and nbytes:
+                    transfer[3] = now
+            if not nbytes:
+                return
+            self._received += nbytes
+            self._samples.append((now, self._received))
+            while len(self._samples) > 2 \
+                    and self._samples[1][0] < now - self.RateWindow:
+                self._samples.popleft()
+
+    def EndTransfer(self, pkg, succeeded=True):
+        """Note that a transfer has finished, recording the latency
+        (time until data started to arrive) and duration of the transfer
+        if the package was downloaded successfully"""
+        now = time.monotonic()
+        with self._lock:
+            transfer = self._inflight.pop(pkg, None)
+            if transfer and succeeded and transfer[3] is not None:
+                self._timings[pkg] = (transfer[3] - transfer[2],
+                                      now - transfer[3])
+
+    def InFlight(self):
+        """List the (package, bytes received, size) of each transfer
+        in progress"""
+        with self._lock:
+            return [ (pkg, pos, size) for pkg, (pos, size, t0, t1)
+                        in self._inflight.items() ]
+
+    def Timings(self):
+        """Find the (latency, transfer time), in seconds,
+        of each successfully downloaded package"""
+        with self._lock:
+            return dict(self._timings)
+
+    def Throughput(self):
+        """Estimate the recent rate of downloading, in bytes per second"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._samples or self._samples[-1][0] < now - self.RateWindow:
+                return 0.0
+            (t0, b0) = self._samples[0]
+            if len(self._samples) < 2 or now - t0 <= 0:
+                return 0.0
+            return (self._received - b0) / max(now - t0, 1e-3)
+
+    def ETA(self):
+        """Estimate the number of seconds until all packages
+        have been downloaded, or None if this cannot be estimated"""
+        rate = self.Throughput()
+        if rate <= 0:
+            return None
+        sizes = self.Sizes()
+        remaining = sizes['Total'] - sizes['New'] - sizes['Already'] \
+                        - sizes['Fail'] - sizes['InFlight']
+        return max(0.0, remaining / rate)
+
+    def Describe(self):
+        """Summarize the progress of downloading in a single line"""
+        sizes = self.Sizes()
+        done = sizes['New'] + sizes['Already'] + sizes['Fail'] \
+                + sizes['InFlight']
+        text = '{0}/{1}'.format(prettyFileSize(done),
+                                prettyFileSize(sizes['Total']))
+        ntransfers = len(self.InFlight())
+        if ntransfers:
+            text += ', {0:d} active'.format(ntransfers)
+        rate = self.Throughput()
+        if rate > 0:
+            text += ', {0}/s'.format(prettyFileSize(rate))
+        eta = self.ETA()
+        if eta is not None:
+            (mins, secs) = divmod(int(eta), 60)
+            (hrs, mins) = divmod(mins, 60)
+            text += ', ETA ' + ('{0:d}h{1:02d}m'.format(hrs, mins) if hrs
+                                else '{0:d}m{1:02d}s'.format(mins, secs))
+        return text
+
+    def Merge(self, other):
+        """Accumulate the statistics of another set of downloads"""
+        with self._lock, other._lock:
+            for attr in ('Size', 'Count'):
+                for kind in ('_new', '_already', '_fail', '_total'):
+                    field = kind + attr
+                    setattr(self, field,
+                            getattr(self, field) + getattr(other, field))
+            self._received += other._received
+            self._timings.update(other._timings)
+            self._retries.update(other._retries)
+
+
+class AggregateFetchStats(FetchStats):
+    """Read-only view of the combined progress of several concurrent
+    sets of downloads, e.g. those of different architectures"""
+
+    def __init__(self, members: list) -> None:
+        FetchStats.__init__(self)
+        self._members = list(members)
+
+    def TotalSize(self):
+        return sum(member.TotalSize() for member in self._members)
+
+    def Counts(self):
+        return self._combine(member.Counts() for member in self._members)
+
+    def Sizes(self):
+        return self._combine(member.Sizes() for member in self._members)
+
+    def InFlight(self):
+        return [ transfer for member in self._members
+                            for transfer in member.InFlight() ]
+
+    def Throughput(self):
+        return sum(member.Throughput() for member in self._members)
+
+    @staticmethod
+    def _combine(tallies) -> dict:
+        total = collections.Counter()
+        for tally in tallies:
+            total.update(tally)
+        return dict(total)
+
+
+
+class RunMetrics:
+    """Record of the time spent in each phase of building a local mirror,
+    and of the performance of each mirror site, from which a structured
+    report of a complete run can be generated."""
+
+    Phases = ( 'ini-fetch', 'parse', 'resolve', 'fetch-list',
+               'download', 'gc', 'iso' )
+
+    def __init__(self, archs=None):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._mirrors = {}
+        self.archs = list(archs or [])
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def Phase(self, name):
+        """Context manager which records the time spent within a phase"""
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.AddDuration(name, time.perf_counter() - t0)
+
+    def AddDuration(self, name, seconds):
+        with self._lock:
+            self._durations[name] = self._durations.get(name, 0.0) + seconds
+
+    def Durations(self):
+        """Find the time, in seconds, spent in each phase"""
+        with self._lock:
+            return dict(self._durations)
+
+    def AddMirrorOutcomes(self, outcomes):
+        """Accumulate the (successes, failures, bytes, seconds)
+        of downloads from each mirror site"""
+        with self._lock:
+            for URL, outcome in outcomes.items():
+                total = self._mirrors.setdefault(URL, [ 0, 0, 0, 0.0 ])
+                for idx, value in enumerate(outcome):
+                    total[idx] += value
+
+    def MirrorOutcomes(self):
+        with self._lock:
+            return { URL: tuple(outcome)
+                        for URL, outcome in self._mirrors.items() }
+
+    def Merge(self, other):
+        """Combine the metrics of a concurrent build (e.g. of another
+        architecture), for which phases will have overlapped in time"""
+        for name, seconds in other.Durations().items():
+            with self._lock:
+                self._durations[name] = max(seconds,
+                                            self._durations.get(name, 0.0))
+        self.AddMirrorOutcomes(other.MirrorOutcomes())
+
+    def MakeReport(self, stats, nslowest=10):
+        """Construct a JSON-compatible summary of a run, combining
+        these metrics with the statistics of a FetchStats object"""
+        sizes = stats.Sizes()
+        retries = stats.Retries()
+        slowest = sorted(stats.Timings().items(),
+                         key=lambda item: sum(item[1]), reverse=True)
+
+        mirrors = {}
+        for URL, (nok, nfail, nbytes, seconds) \
+                in sorted(self.MirrorOutcomes().items()):
+            mirrors[URL] = { 'ok': nok, 'failed': nfail,
+                             'bytes': nbytes, 'seconds': seconds,
+                             'throughput': (nbytes / seconds if seconds
+                                                else 0.0) }
+
+        return {
+            'archs':    self.archs,
+            'started':  self.started,
+            'finished': time.time(),
+            'phases':   { name: seconds for name, seconds
+                            in self.Durations().items() },
+            'packages': { kind.lower(): count for kind, count
+                            in stats.Counts().items() },
+            'bytes':    { kind.lower(): sizes[kind] for kind in
+                            ('Total', 'New', 'Already', 'Fail', 'Received') },
+            'retries':  { 'total': sum(retries.values()),
+                          'files': len(retries) },
+            'mirrors':  mirrors,
+            'slowest':  [ { 'file': pkg, 'latency': latency,
+                            'transfer': duration }
+                            for pkg, (latency, duration)
+                                in slowest[:nslowest] ]
+        }
+
+    @staticmethod
+    def FormatPrometheus(report, prefix='pmcyg'):
+        """Render a run report in the text format read by
+        the Prometheus node-exporter's textfile collector"""
+        lines = []
+        def quote(value):
+            return '"{0}"'.format(str(value).replace('\\', '\\\\')
+                                    .replace('"', '\\"').replace('\n', '\\n'))
+        def metric(name, helptext, samples):
+            name = prefix + '_' + name
+            lines.append('# HELP {0} {1}'.format(name, helptext))
+            lines.append('# TYPE {0} gauge'.format(name))
+            for labels, value in samples:
+                labeltext = ','.join('{0}={1}'.format(key, quote(val))
+                                     for key, val in labels)
+                lines.append('{0}{1} {2}'.format(name,
+                                    ('{' + labeltext + '}' if labels else ''),
+                                    repr(float(value))))
+
+        metric('last_run_timestamp_seconds',
+               'Time at which the most recent build finished',
+               [ ((), report['finished']) ])
+        metric('run_duration_seconds', 'Duration of the most recent build',
+               [ ((), report['finished'] - report['started']) ])
+        metric('phase_duration_seconds', 'Time spent in each build phase',
+               [ ((('phase', phase),), seconds)
+                    for phase, seconds in sorted(report['phases'].items()) ])
+        metric('packages', 'Number of packages by download outcome',
+               [ ((('outcome', kind),), count)
+                    for kind, count in sorted(report['packages'].items()) ])
+        metric('package_bytes', 'Size of packages by download outcome',
+               [ ((('outcome', kind),), count)
+                    for kind, count in sorted(report['bytes'].items()) ])
+        metric('retries', 'Number of repeated download attempts',
+               [ ((), report['retries']['total']) ])
+        metric('retried_files', 'Number of packages needing a retry',
+               [ ((), report['retries']['files']) ])
+        metric('mirror_downloads', 'Number of downloads from each mirror',
+               [ ((('mirror', URL), ('outcome', outcome)), entry[key])
+                    for URL, entry in sorted(report['mirrors'].items())
+                    for outcome, key in (('ok', 'ok'), ('failed', 'failed')) ])
+        metric('mirror_throughput_bytes_per_second',
+               'Average download speed from each mirror',
+               [ ((('mirror', URL),), entry['throughput'])
+                    for URL, entry in sorted(report['mirrors'].items()) ])
+        return '\n'.join(lines) + '\n'
 
 
 
@@ -1495,6 +5183,9 @@ class GarbageCollector(BuildReporter):
         self._topdirs = None
         self._topdepth = {}
         self._suspicious = True
+        self._verified = None
+        self._store = None
+        self._lock = threading.Lock()
 
         # Lists of file and directory names that indicate that the user's
         # top-level download directory contains important files
@@ -1543,22 +5234,33 @@ class GarbageCollector(BuildReporter):
                     if os.path.islink(fullname):
                         self._suspicious = True
 
+    def SetVerifiedIndex(self, index: VerifiedIndex) -> None:
+        """Attach an index of verified packages, from which
+        entries will be removed as files are purged"""
+        self._verified = index
+
+    def SetPackageStore(self, store: PackageStore) -> None:
+        """Attach a shared package store, from which entries
+        will be removed once no longer linked into any local mirror"""
+        self._store = store
+
     def RescueFile(self, filename):
         """Signal that file should not be included in deletions list"""
 
         filename = self._canonPath(filename)
         dirname, basename = os.path.split(filename)
-        try:
-            self._files.remove(filename)
-        except:
-            pass
+        with self._lock:
+            try:
+                self._files.remove(filename)
+            except:
+                pass
 
-        dirsegs = dirname.split(os.sep)
-        maxdepth = len(dirsegs)
-        for depth in range(maxdepth, 0, -1):
-            pardir = self._canonPath(os.sep.join(dirsegs[0:depth]))
-            if pardir in self._directories:
-                self._directories.remove(pardir)
+            dirsegs = dirname.split(os.sep)
+            maxdepth = len(dirsegs)
+            for depth in range(maxdepth, 0, -1):
+                pardir = self._canonPath(os.sep.join(dirsegs[0:depth]))
+                if pardir in self._directories:
+                    self._directories.remove(pardir)
 
     def GetNfiles(self):
         return len(self._files)
@@ -1600,6 +5302,8 @@ class GarbageCollector(BuildReporter):
         try:
             for fl in self._files:
                 os.remove(fl)
+                if self._verified is not None:
+                    self._verified.Discard(fl)
             rdirs = self._directories
 
             # Use reverse-alphabetic sort to approximate depth-first dirsearch:
@@ -1611,6 +5315,19 @@ class GarbageCollector(BuildReporter):
             self._statview('Failed to remove outdated files - ' + str(ex),
                            BuildViewer.SEV_WARNING)
 
+        if self._verified is not None:
+            try:
+                self._verified.Save()
+            except OSError:
+                pass
+
+        if self._store is not None and self._files:
+            try:
+                self._store.Prune()
+            except OSError as ex:
+                self._statview('Failed to prune package store - ' + str(ex),
+                               BuildViewer.SEV_WARNING)
+
     def _checkTopSuspiciousness(self, topdir):
         """Try to protect user from accidentally deleting
         anything other than an old Cygwin repository"""
@@ -73,6 +73,11 @@ class TKgui:
                                padx=4, pady=2)
         row += 1
 
+        self.progress_txt = Tk.Label(rootwin, anchor=Tk.W)
+        self.progress_txt.grid(row=row, column=0, sticky=Tk.E+Tk.W+Tk.S,
+                               padx=4)
+        row += 1
+
         self.updatePkgSelection(pkgfiles)
         self._state = GUIstate(self)
         self._updateState(GUIconfigState(self))
@@ -421,7 +426,9 @@ the terms of the GNU General Public License (v3).""".format(PMCYG_VERSION))
                 empty = True
 
     def updateProgress(self):
-        self.progress_bar.Update(self.builder._fetchStats)
+        stats = self.builder._fetchStats
+        self.progress_bar.Update(stats)
+        self.progress_txt.config(text=stats.Describe())
 
     def _txFields(self):
         """Transfer values of GUI controls to PMbuilder object"""
@@ -498,7 +505,9 @@ class GUItidyState(GUIstate):
 
     def tick(self):
         if self._confirmer.HasResponded():
-            self._confirmer.ActionResponse()
+            with self._builder.GetRunMetrics().Phase('gc'):
+                self._confirmer.ActionResponse()
+            self._builder.WriteRunReport()
             return GUIconfigState(self._parent)
         return self
 
@@ -642,7 +651,8 @@ class GUIgarbageConfirmer(GarbageConfirmer):
 
 class GUIprogressBar(Tk.Canvas):
     """GUI widget representing a multi-colour progress bar
-    representing the number of packages downloaded."""
+    representing the number of bytes downloaded, including
+    those of packages whose download is still in progress."""
     def __init__(self, *args, **kwargs):
         Tk.Canvas.__init__(self, background='grey50', height=8,
                             *args, **kwargs)
@@ -650,24 +660,28 @@ class GUIprogressBar(Tk.Canvas):
         self._rectFail = None
         self._rectAlready = None
         self._rectNew = None
+        self._rectInFlight = None
 
     def Update(self, stats):
         width, height = self.winfo_width(), self.winfo_height()
 
-        totsize = stats.TotalSize()
+        sizes = stats.Sizes()
+        totsize = sizes['Total']
 
-        configs = [ ('_failSize',    '_rectFail',    'OrangeRed'),
-                    ('_alreadySize', '_rectAlready', 'SeaGreen'),
-                    ('_newSize',     '_rectNew',     'LimeGreen') ]
+        configs = [ ('Fail',     '_rectFail',     'OrangeRed'),
+                    ('Already',  '_rectAlready',  'SeaGreen'),
+                    ('New',      '_rectNew',      'LimeGreen'),
+                    ('InFlight', '_rectInFlight', 'PaleGreen') ]
         xpos = 0
-        for s_attr, b_attr, colour in configs:
+        for s_key, b_attr, colour in configs:
             oldrect = getattr(self, b_attr)
             if oldrect:
                 self.delete(oldrect)
+                setattr(self, b_attr, None)
 
             if totsize <= 0: continue
 
-            barwidth = (width * getattr(stats, s_attr)) // totsize
+            barwidth = (width * sizes[s_key]) // totsize
             if barwidth <= 0: continue
 
             newrect = self.create_rectangle(xpos, 1, xpos + barwidth, height - 1, fill=colour, width=0)
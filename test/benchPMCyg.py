@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# Timing benchmarks for Cygwin Partial Mirror (pmcyg)
+#
+# Usage: python3 benchPMCyg.py [--setup path/to/setup.xz]
+#
+# If no setup.ini file is supplied, and none is present in the test
+# directory, a synthetic file of realistic size is generated.
+
+import argparse, lzma, os, random, sys, tempfile, time, urllib.parse
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTDIR, '..'))
+from pmcyg.core import *
+
+
+def synthesizeSetupIni(filename, npkgs=15000, seed=2009):
+    """Write a random setup.ini with roughly the shape of the x86_64 one"""
+    rnd = random.Random(seed)
+    words = [ 'library', 'tool', 'utility', 'support', 'data', 'runtime',
+              'development', 'files', 'for', 'the', 'GNU', 'X11' ]
+    cats = [ 'Admin', 'Archive', 'Base', 'Devel', 'Doc', 'Editors', 'Libs',
+             'Math', 'Net', 'Perl', 'Python', 'Shells', 'Text', 'Utils' ]
+    def text(n):
+        return ' '.join(rnd.choice(words) for i in range(n))
+    def release(name, ver, kind):
+        digest = '{0:0128x}'.format(rnd.getrandbits(512))
+        return '{0}: x86_64/release/{1}/{1}-{2}{3}.tar.xz {4:d} {5}' \
+                    .format(kind, name, ver, '-src' if kind == 'source' else '',
+                            rnd.randint(1000, 1<<22), digest)
+
+    names = [ 'pkg{0:05d}'.format(i) for i in range(npkgs) ]
+    with open(filename, 'wt', encoding='utf-8') as fp:
+        fp.write('# Synthetic setup.ini for benchmarking\n'
+                 'release: cygwin\narch: x86_64\n'
+                 'setup-timestamp: 1696000000\nsetup-version: 2.926\n\n')
+        for idx, name in enumerate(names):
+            deps = sorted(set(rnd.choice(names[:idx+1])
+                                for i in range(rnd.randint(0, 8))) - {name})
+            fp.write('@ {0}\nsdesc: "{1}"\nldesc: "{2}\n{3}"\n'
+                     'category: {4}\nrequires: {5}\n'
+                     .format(name, text(5), text(10), text(8),
+                             rnd.choice(cats), ' '.join(deps)))
+            for epoch, ver in (('curr', '1.2-1'), ('prev', '1.1-1')):
+                if epoch != 'curr':
+                    fp.write('[{0}]\n'.format(epoch))
+                fp.write('version: {0}\n{1}\n{2}\ndepends2: {3}\n'
+                         .format(ver, release(name, ver, 'install'),
+                                 release(name, ver, 'source'),
+                                 ', '.join(deps)))
+            fp.write('\n')
+
+
+def timeIt(label, func, repeats):
+    """Report best-of-N timing of a function"""
+    best = None
+    for r in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print('{0:<32s} {1:8.3f}s'.format(label, best))
+    return result
+
+
+def benchParsing(iniURL, repeats):
+    def parse():
+        pkglist = MasterPackageList(iniURL, Viewer=SilentBuildViewer())
+        return pkglist.GetPackageDict()
+
+    packages = timeIt('Parsing setup.ini', parse, repeats)
+    print('  ({0:d} packages)'.format(len(packages)))
+    return packages
+
+
+def benchContraction(iniURL, repeats, nselected=400, seed=2009):
+    """Time contraction of a large expanded selection,
+    such as the set of packages installed on a mature Cygwin system"""
+    pkglist = MasterPackageList(iniURL, Viewer=SilentBuildViewer())
+    pkgProc = PkgSetProcessor(pkglist)
+    names = sorted(pkglist.GetPackageDict().keys())
+    selected = random.Random(seed).sample(names, min(nselected, len(names)))
+    installed = pkgProc.ExpandDependencies(selected)
+
+    contracted = timeIt('Contracting dependencies',
+                        lambda: pkgProc.ContractDependencies(installed),
+                        repeats)
+    print('  ({0:d} packages -> {1:d})'.format(len(installed),
+                                               len(contracted)))
+    return contracted
+
+
+def benchClosureCosts(iniURL, repeats, nselected=100, seed=2009):
+    """Time computation of the closure size of every package"""
+    pkglist = MasterPackageList(iniURL, Viewer=SilentBuildViewer())
+    pkgProc = PkgSetProcessor(pkglist)
+    names = sorted(pkglist.GetPackageDict().keys())
+    selected = random.Random(seed).sample(names, min(nselected, len(names)))
+    pkglist.GetDependencyGraph()
+
+    return timeIt('Computing closure costs',
+                  lambda: pkgProc.ComputeClosureCosts(selected, [ 'curr' ]),
+                  repeats)
+
+
+def findSetupIni(tmpdir):
+    """Locate or generate an uncompressed setup.ini file"""
+    for fname in ('setup.ini', 'setup.xz'):
+        path = os.path.join(TESTDIR, fname)
+        if os.path.isfile(path):
+            break
+    else:
+        path = os.path.join(tmpdir, 'setup.ini')
+        synthesizeSetupIni(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing benchmarks for pmcyg')
+    parser.add_argument('--setup', type=str, default=None,
+            help='Location of setup.ini or setup.xz file')
+    parser.add_argument('--repeats', type=int, default=3,
+            help='Number of repetitions of each benchmark')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.setup if args.setup else findSetupIni(tmpdir)
+        if path.endswith('.xz'):
+            # Avoid decompression time dominating parsing time:
+            with lzma.open(path, 'rb') as src:
+                path = os.path.join(tmpdir, 'setup.ini')
+                with open(path, 'wb') as dst:
+                    dst.write(src.read())
+        iniURL = 'file:' + urllib.request.pathname2url(os.path.abspath(path))
+
+        benchParsing(iniURL, args.repeats)
+        benchContraction(iniURL, args.repeats)
+        benchClosureCosts(iniURL, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,8 @@
 # Unit-tests for Cygwin Partial Mirror (pmcyg)
 # RW Penney, August 2009
 
-import codecs, os, random, re, string, io, sys, \
-       tempfile, unittest, urllib.parse
+import asyncio, codecs, functools, http.server, json, os, random, re, shutil, \
+       socket, string, io, sys, tempfile, threading, unittest, urllib.parse
 sys.path.insert(0, '..')
 from pmcyg.core import *
 
@@ -49,6 +49,34 @@ class testSetupIniFetcher(unittest.TestCase):
 
         self._validate(tmpfile, seed, count)
 
+    def testStreaming(self):
+        """Check line-splitting across small blocks of multi-byte text"""
+        lines = [ 'sdesc: "café – {0:d}"\n'.format(i)
+                    for i in range(1000) ]
+        for suffix, opener in [ ('ini', open),
+                                ('bz2', bz2.open),
+                                ('xz', lzma.open) ]:
+            tmpfile = os.path.join(self._tmpdir.name, 'multi.' + suffix)
+            with opener(tmpfile, 'wb') as fp:
+                fp.write(''.join(lines).encode('utf-8'))
+
+            fetcher = SetupIniFetcher('file:' + tmpfile, blksize=7)
+            self.assertEqual(list(fetcher), lines)
+            fetcher.close()
+
+        # Concatenated compressed streams should all be decoded:
+        for suffix, compress in [ ('bz2', bz2.compress),
+                                  ('xz', lzma.compress) ]:
+            tmpfile = os.path.join(self._tmpdir.name, 'streams.' + suffix)
+            with open(tmpfile, 'wb') as fp:
+                for part in (lines[:15], lines[15:16], lines[16:]):
+                    fp.write(compress(''.join(part).encode('utf-8')))
+
+            for blksize in (7, 1 << 16):
+                fetcher = SetupIniFetcher('file:' + tmpfile, blksize=blksize)
+                self.assertEqual(list(fetcher), lines)
+                fetcher.close()
+
     def _validate(self, filename, seed, count):
         fetcher = SetupIniFetcher('file:' + filename)
         nlines = 0
@@ -73,6 +101,382 @@ class testSetupIniFetcher(unittest.TestCase):
 
 
 
+class testConnectionPool(unittest.TestCase):
+    """Tests of persistent HTTP connections to a local web-server"""
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.mirror = makeLocalMirror(self._tmpdir.name)
+        self.server = LocalHTTPServer(self._tmpdir.name)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self._tmpdir.cleanup()
+
+    def testReuse(self):
+        pool = ConnectionPool()
+        for relpath, content in self.mirror['files'].items():
+            with pool.Open(self.server.url + relpath) as resp:
+                self.assertEqual(resp.read(), content)
+        self.assertEqual(self.server.connections, 1)
+
+        pool.Close()
+        with pool.Open(self.server.url + relpath) as resp:
+            self.assertEqual(resp.read(), content)
+        self.assertEqual(self.server.connections, 2)
+
+    def testMissing(self):
+        pool = ConnectionPool()
+        for attempt in range(3):
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                pool.Open(self.server.url + 'nowhere.txt')
+            self.assertEqual(ctx.exception.code, 404)
+
+            relpath, content = random.choice(list(self.mirror['files'].items()))
+            with pool.Open(self.server.url + relpath) as resp:
+                self.assertEqual(resp.read(), content)
+
+    def testTimeouts(self):
+        stalled = TricklingServer()
+        try:
+            pool = ConnectionPool()
+            pool.SetTimeouts(connect=1.0, read=0.2)
+            t0 = time.monotonic()
+            with self.assertRaises(socket.timeout):
+                pool.Open(stalled.url + 'setup.xz')
+            self.assertLess(time.monotonic() - t0, 5.0)
+        finally:
+            stalled.shutdown()
+
+        trickle = TricklingServer(interval=0.02)
+        try:
+            builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                CacheDirectory=None,
+                                MinThroughput=100, SlowTransferTime=0.3)
+            tgtpath = os.path.join(self._tmpdir.name, 'slow.part')
+            t0 = time.monotonic()
+            with self.assertRaises(PMCygException):
+                builder._retrieve(trickle.url + 'slow.tar.xz', tgtpath)
+            self.assertLess(time.monotonic() - t0, 5.0)
+            self.assertGreater(os.path.getsize(tgtpath), 0)
+        finally:
+            trickle.shutdown()
+
+    def testAsyncTimeouts(self):
+        trickle = TricklingServer(interval=1.0)
+        try:
+            builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                CacheDirectory=None,
+                                DownloadEngine='asyncio')
+            builder.SetTargetDir(self._tmpdir.name)
+            tgtpath = os.path.join(self._tmpdir.name, 'slow.tar.xz')
+            URL = trickle.url + 'slow.tar.xz'
+
+            async def fetch():
+                client = AsyncHTTPClient(initialTransfers=4)
+                client.SetTimeouts(connect=1.0, read=0.2)
+                try:
+                    result = await builder._downloadFreshAsync(client, URL,
+                                                1000000, '0' * 128, tgtpath)
+                finally:
+                    await client.Close()
+                return (result, client.Throttle(URL).limit)
+
+            t0 = time.monotonic()
+            ((outcome, errmsg), limit) = asyncio.run(fetch())
+            self.assertLess(time.monotonic() - t0, 5.0)
+            self.assertEqual(outcome, PMbuilder.DL_Failure)
+            self.assertEqual(limit, 2)
+        finally:
+            trickle.shutdown()
+
+    def testBuild(self):
+        builder = PMbuilder(Viewer=SilentBuildViewer(), CacheDirectory=None,
+                            MirrorSite=self.server.url, DownloadThreads=2)
+        builder.setup_ini_url = self.server.url + 'x86_64/setup.ini'
+        builder.setup_exe_url = self.server.url + 'setup${_arch}.exe'
+        builder.SetTargetDir(os.path.join(self._tmpdir.name, 'tgt'))
+
+        pkgset = PackageSet()
+        pkgset.extend(self.mirror['packages'])
+        builder.BuildMirror(pkgset)
+
+        counts = builder._fetchStats.Counts()
+        self.assertEqual(counts['New'], len(self.mirror['files']))
+        self.assertLessEqual(self.server.connections, 3)
+        self.assertEqual(builder._fetchStats.InFlight(), [])
+        self.assertEqual(sorted(builder._fetchStats.Timings().keys()),
+                         sorted(os.path.normpath(relpath)
+                                for relpath in self.mirror['files']))
+
+    def testRunReport(self):
+        builder = PMbuilder(Viewer=SilentBuildViewer(),
+                            MirrorSite=self.server.url, CacheDirectory=None)
+        builder.setup_ini_url = self.server.url + 'x86_64/setup.ini'
+        builder.setup_exe_url = self.server.url + 'setup${_arch}.exe'
+        builder.SetTargetDir(os.path.join(self._tmpdir.name, 'tgt'))
+        pkgset = PackageSet()
+        pkgset.extend(self.mirror['packages'])
+        builder.BuildMirror(pkgset)
+
+        stem = os.path.join(self._tmpdir.name, 'reports', 'run')
+        builder.SetOption('RunReport', stem + '.json')
+        builder.WriteRunReport()
+        with open(stem + '.json') as fp:
+            report = json.load(fp)
+        self.assertTrue({ 'ini-fetch', 'parse', 'resolve', 'fetch-list',
+                          'download' } <= set(report['phases'].keys()))
+        self.assertEqual(report['packages']['new'], len(self.mirror['files']))
+        self.assertEqual(report['bytes']['new'],
+                         sum(len(content) for content
+                                in self.mirror['files'].values()))
+        self.assertEqual(report['retries']['total'], 0)
+        mirror = report['mirrors'][builder.mirror_url]
+        self.assertEqual(mirror['ok'], len(self.mirror['files']))
+        self.assertGreater(mirror['throughput'], 0)
+        self.assertEqual(len(report['slowest']),
+                         min(10, len(self.mirror['files'])))
+
+        with open(stem + '.prom') as fp:
+            prom = fp.read()
+        self.assertIn('pmcyg_packages{{outcome="new"}} {0:.1f}\n'.format(
+                            len(self.mirror['files'])), prom)
+        self.assertRegex(prom, r'pmcyg_phase_duration_seconds'
+                               r'\{phase="download"\} [0-9.e-]+\n')
+        self.assertFalse(os.path.exists(stem + '.prom.tmp'))
+
+    def testPreloadTimes(self):
+        builder = PMbuilder(Viewer=SilentBuildViewer(),
+                            MirrorSite=self.server.url, CacheDirectory=None)
+        builder.setup_ini_url = self.server.url + 'x86_64/setup.ini'
+        builder.setup_exe_url = self.server.url + 'setup${_arch}.exe'
+        builder.SetTargetDir(os.path.join(self._tmpdir.name, 'tgt'))
+
+        # Package lists read before building, e.g. by the GUI, still count:
+        masterList = builder._masterList
+        masterList.SetSourceURL(builder.setup_ini_url)
+        masterList.GetPackageDict()
+        pkgset = PackageSet()
+        pkgset.extend(self.mirror['packages'])
+        builder.BuildMirror(pkgset)
+        durations = builder.GetRunMetrics().Durations()
+        self.assertGreater(durations['ini-fetch'], 0)
+        self.assertGreater(durations['parse'], 0)
+
+        masterList.GetPackageDict()
+        masterList.SetSourceURL(builder.setup_ini_url, reload=True)
+        self.assertEqual(masterList.TakeLoadTimes(), {})
+
+    def testAsyncBuild(self):
+        tgtdir = os.path.join(self._tmpdir.name, 'tgt')
+        for expectNew in (True, False):
+            builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                CacheDirectory=None,
+                                MirrorSite=self.server.url, DownloadThreads=2,
+                                DownloadEngine='asyncio')
+            builder.setup_ini_url = self.server.url + 'x86_64/setup.ini'
+            builder.setup_exe_url = self.server.url + 'setup${_arch}.exe'
+            builder.SetTargetDir(tgtdir)
+
+            pkgset = PackageSet()
+            pkgset.extend(self.mirror['packages'])
+            builder.BuildMirror(pkgset)
+
+            counts = builder._fetchStats.Counts()
+            self.assertEqual(counts['Fail'], 0)
+            self.assertEqual(counts['New' if expectNew else 'Already'],
+                             len(self.mirror['files']))
+        for relpath, content in self.mirror['files'].items():
+            with open(os.path.join(tgtdir, relpath), 'rb') as fp:
+                self.assertEqual(fp.read(), content)
+
+        async def fetchAll(client):
+            for relpath, content in self.mirror['files'].items():
+                resp = await client.Open(self.server.url + relpath)
+                data = b''
+                while True:
+                    chunk = await resp.read(7)
+                    if not chunk:
+                        break
+                    data += chunk
+                self.assertEqual(data, content)
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                await client.Open(self.server.url + 'nowhere.txt')
+            self.assertEqual(ctx.exception.code, 404)
+            await client.Close()
+
+        connections = self.server.connections
+        asyncio.run(fetchAll(AsyncHTTPClient()))
+        self.assertEqual(self.server.connections, connections + 1)
+
+    def testHostThrottle(self):
+        async def exercise():
+            throttle = HostThrottle(initial=4, maximum=8)
+            await asyncio.gather(*(throttle.Acquire() for i in range(4)))
+            waiter = asyncio.ensure_future(throttle.Acquire())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+
+            throttle.Backoff()
+            self.assertEqual(throttle.limit, 2)
+            throttle.Backoff()
+            self.assertEqual(throttle.limit, 2)
+            for i in range(3):
+                throttle.Release()
+            await asyncio.sleep(0.01)
+            self.assertTrue(waiter.done())
+
+            throttle.Window = 0.0
+            throttle.RecordTransfer(1 << 20)
+            self.assertEqual(throttle.limit, 3)
+            throttle.RecordTransfer(0)
+            self.assertEqual(throttle.limit, 3)
+
+        asyncio.run(exercise())
+
+    def testResume(self):
+        builder = PMbuilder(Viewer=SilentBuildViewer(), CacheDirectory=None)
+        tgtpath = os.path.join(self._tmpdir.name, 'pkg.tar.xz')
+        partpath = tgtpath + PMbuilder.PartialSuffix
+        (relpath, content) = max(self.mirror['files'].items(),
+                                 key=lambda item: len(item[1]))
+        pkghash = hashlib.sha512(content).hexdigest()
+        half = len(content) // 2
+
+        for prefix, expected in [ (content[:half], PMbuilder.DL_Success),
+                                  (bytes(half), PMbuilder.DL_HashError) ]:
+            with open(partpath, 'wb') as fp:
+                fp.write(prefix)
+            (outcome, errmsg) = builder._downloadSingle(self.server.url + relpath,
+                                                        len(content), pkghash,
+                                                        tgtpath)
+            self.assertEqual(outcome, expected)
+            self.assertFalse(os.path.exists(partpath))
+            if os.path.exists(tgtpath):
+                with open(tgtpath, 'rb') as fp:
+                    self.assertEqual(fp.read(), content)
+                os.remove(tgtpath)
+        self.assertEqual(self.server.ranges, [ half, half ])
+
+    def testConditional(self):
+        pool = ConnectionPool()
+        (relpath, content) = next(iter(self.mirror['files'].items()))
+        tgtpath = os.path.join(self._tmpdir.name, 'copy', 'setup.xz')
+
+        self.assertFalse(ValidatedCopy(self.server.url + relpath,
+                                       tgtpath, pool).Refresh())
+        self.assertTrue(ValidatedCopy(self.server.url + relpath,
+                                      tgtpath, pool).Refresh())
+        with open(tgtpath, 'rb') as fp:
+            self.assertEqual(fp.read(), content)
+
+        with open(tgtpath, 'ab') as fp:
+            fp.write(b'tampered')
+        self.assertFalse(ValidatedCopy(self.server.url + relpath,
+                                       tgtpath, pool).Refresh())
+        with open(tgtpath, 'rb') as fp:
+            self.assertEqual(fp.read(), content)
+
+
+class LocalHTTPServer(http.server.ThreadingHTTPServer):
+    """Minimal web-server, running in a background thread,
+    supplying files from a local directory"""
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            with self.server.lock:
+                self.server.connections += 1
+
+        def send_head(self):
+            """Serve partial content in response to simple Range requests"""
+            with self.server.lock:
+                self.server.requests += 1
+            rng = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if not rng:
+                return super().send_head()
+            try:
+                fp = open(self.translate_path(self.path), 'rb')
+            except OSError:
+                self.send_error(404)
+                return None
+            size = os.fstat(fp.fileno()).st_size
+            start = int(rng.group(1))
+            if start >= size:
+                fp.close()
+                self.send_error(416)
+                return None
+            fp.seek(start)
+            self.send_response(206)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Range', 'bytes {0:d}-{1:d}/{2:d}' \
+                                                .format(start, size - 1, size))
+            self.send_header('Content-Length', str(size - start))
+            self.end_headers()
+            with self.server.lock:
+                self.server.ranges.append(start)
+            return fp
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self, topdir):
+        handler = functools.partial(self.Handler, directory=topdir)
+        super().__init__(('127.0.0.1', 0), handler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.ranges = []
+        self.url = 'http://127.0.0.1:{0:d}/'.format(self.server_address[1])
+        self.daemon_threads = True
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        super().shutdown()
+        self.server_close()
+
+
+
+class TricklingServer:
+    """Web-server that responds to each request with a large file,
+    sent at a trickle (or not at all), to simulate a stalled mirror"""
+    def __init__(self, interval=None, chunk=b'x' * 16):
+        self._sock = socket.create_server(('127.0.0.1', 0))
+        self._interval = interval
+        self._chunk = chunk
+        self._closing = threading.Event()
+        self.url = 'http://127.0.0.1:{0:d}/'.format(self._sock.getsockname()[1])
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while not self._closing.is_set():
+            try:
+                (conn, addr) = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._respond, args=(conn,),
+                             daemon=True).start()
+
+    def _respond(self, conn):
+        with conn:
+            try:
+                conn.recv(1 << 16)
+                if self._interval is None:
+                    self._closing.wait()
+                    return
+                conn.sendall(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Length: 1000000\r\n\r\n')
+                while not self._closing.wait(self._interval):
+                    conn.sendall(self._chunk)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._closing.set()
+        self._sock.close()
+
+
+
 class testHashChecker(unittest.TestCase):
     def testAlgMatch(self):
         HC = HashChecker()
@@ -177,6 +581,45 @@ class testMasterPackageList(unittest.TestCase):
         self.assertGreaterEqual(numldesc, 0.7 * numpkgs)
         self.assertGreater(totlines, 2 * numldesc)
 
+    def testAwkward(self):
+        pkglist = MasterPackageList(Viewer=SilentBuildViewer())
+        pkglist.SetSourceURL('file:' + os.path.join(TESTDIR,
+                                                    'setup-awkward.ini'))
+        (header, packages) = pkglist.GetHeaderAndPackages()
+
+        self.assertEqual(header['setup-version'], '3.14159')
+        self.assertFalse(packages['no_longdesc'].GetAny('requires'))
+        self.assertEqual(packages['utf-8'].GetAny('install', ['prev']),
+                         'release/harmonic.txt 6789 048c0')
+        self.assertEqual(packages['messaging'].GetAny('message_messaging'),
+                         'This package is not likely to be useful')
+        self.assertEqual(packages['base-files'].GetAny('ldesc'),
+                         'A set of important system {linebreak}\n'
+                         '\tconfiguration {linebreak}\n'
+                         '        and setup files')
+        self.assertTrue(packages['pygtk2'].GetAny('TEXT') \
+                            .startswith('@ pygtk2\nsdesc:'))
+
+    def testCompactStorage(self):
+        packages = self.pkglist.GetPackageDict()
+        textbufs = set(id(pkg._textbuf) for pkg in packages.values())
+        self.assertEqual(len(textbufs), 1)
+
+        summary = PackageSummary()
+        summary.SetText(PackageTextBuffer(), '@ dummy\nsdesc: "café"')
+        summary.Set('category', 'Devel Libs', 'curr')
+        summary.Set('install', 'x86_64/release/dummy-2.tar.xz', 'prev')
+        self.assertEqual(summary.GetAny('TEXT'), '@ dummy\nsdesc: "café"')
+        self.assertEqual(summary.GetAll('TEXT'),
+                         [ '@ dummy\nsdesc: "café"' ])
+        self.assertEqual(summary.GetAny('category'), 'Devel Libs')
+        self.assertIsNone(summary.GetAny('install'))
+        self.assertEqual(summary.GetAll('install'),
+                         [ 'x86_64/release/dummy-2.tar.xz' ])
+        self.assertTrue(summary.HasFileContent())
+        with self.assertRaises(AttributeError):
+            summary.extra = True
+
     def testCategories(self):
         packages = self.pkglist.GetPackageDict()
         categories = self.pkglist.GetCategories()
@@ -210,6 +653,71 @@ class testMasterPackageList(unittest.TestCase):
                               'zsh' } - packages, set())
 
 
+class testPackageListCache(unittest.TestCase):
+    """Tests of persistent caching of parsed setup.ini databases"""
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.mirror = makeLocalMirror(os.path.join(self._tmpdir.name, 'src'))
+        self.cachedir = os.path.join(self._tmpdir.name, 'cache')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def mkList(self, reparse=True):
+        pkglist = MasterPackageList(self.mirror['ini'],
+                                    Viewer=SilentBuildViewer())
+        pkglist.SetCacheDir(self.cachedir)
+        if not reparse:
+            def unexpected(*args):
+                raise AssertionError('setup.ini unexpectedly re-parsed')
+            pkglist._finalizePackage = unexpected
+        return pkglist
+
+    def testReuse(self):
+        packages = self.mkList().GetPackageDict()
+        self.assertEqual(len(packages), len(self.mirror['packages']))
+
+        cached = self.mkList(reparse=False).GetPackageDict()
+        self.assertEqual(set(cached.keys()), set(packages.keys()))
+        for pkg, pkginfo in packages.items():
+            self.assertEqual(cached[pkg].GetAny('TEXT'), pkginfo.GetAny('TEXT'))
+
+        inipath = urllib.parse.urlparse(self.mirror['ini']).path
+        stat = os.stat(inipath)
+        os.utime(inipath, (stat.st_atime, stat.st_mtime + 10))
+        self.mkList(reparse=False).GetPackageDict()
+
+        with open(inipath, 'r+t', encoding='utf-8') as fp:
+            content = fp.read().replace('setup-timestamp: 17',
+                                        'setup-timestamp: 18')
+            fp.seek(0)
+            fp.write(content)
+        self.assertEqual(len(self.mkList().GetPackageDict()), len(packages))
+        pkglist = self.mkList(reparse=False)
+        self.assertTrue(pkglist._parseSource())
+        self.assertTrue(pkglist.GetHeaderInfo()['setup-timestamp']
+                            .startswith('18'))
+
+    def testEviction(self):
+        cache = PackageListCache(self.cachedir)
+        cache.MaxEntries = 3
+        URLs = [ 'file:///nowhere/{0:d}/setup.ini'.format(i) for i in range(5) ]
+        recent = time.time() - 100
+        for idx, URL in enumerate(URLs):
+            cache.Store(URL, {}, { 'idx': idx }, {})
+            os.utime(cache._path(URL), (recent + idx, recent + idx))
+        self.assertEqual(len(os.listdir(self.cachedir)), 3)
+        self.assertIsNone(cache.Load(URLs[0]))
+        self.assertIsNotNone(cache.Load(URLs[2]))
+
+        for URL in URLs[3:]:
+            os.utime(cache._path(URL), (1e9, 1e9))
+        cache.Prune()
+        self.assertEqual(os.listdir(self.cachedir),
+                         [ os.path.basename(cache._path(URLs[2])) ])
+
+
+
 class testPkgSetProcessor(unittest.TestCase):
     def setUp(self):
         self.masterList = MasterPackageList(Viewer=SilentBuildViewer())
@@ -249,6 +757,120 @@ class testPkgSetProcessor(unittest.TestCase):
 
             self.assertEqual(set(full).difference(expanded), set())
             self.assertLess(len(expanded), len(full) * 1.2)
+            self.assertEqual(expanded, full)
+            self.assertLessEqual(len(contracted), len(selected))
+
+        cyclic = pkgProc.ExpandDependencies(['gcc-g++'])
+        self.assertIn('gcc-mingw-g++', cyclic)
+        self.assertEqual(pkgProc.ContractDependencies(cyclic), ['gcc-g++'])
+
+    def testGraph(self):
+        graph = self.masterList.GetDependencyGraph()
+        self.assertIs(graph, self.masterList.GetDependencyGraph())
+        self.assertIs(graph.GetTable(['curr']), graph.GetTable(['curr']))
+
+        table = graph.GetTable(['curr', 'prev'])
+        for pkg in ('bash', 'make', 'gcc-g++'):
+            node = graph.index[pkg]
+            for dep in table.Successors(node):
+                self.assertIn(node, table.Predecessors(dep))
+
+        pkgProc = PkgSetProcessor(self.masterList)
+        dependents = pkgProc.FindDependents(['libreadline7'])
+        self.checkSubset(dependents, ['libreadline7', 'bash', 'make', 'lua'])
+        for pkg in random.sample(dependents, min(len(dependents), 20)):
+            self.assertIn('libreadline7', pkgProc.ExpandDependencies([pkg]))
+
+    def testResolver(self):
+        """Check incremental closures against full expansion"""
+        pkgProc = PkgSetProcessor(self.masterList)
+        pkglist = sorted(self.masterList.GetPackageDict().keys())
+        resolver = pkgProc.MakeResolver(['bash'], ['curr', 'prev'])
+        selected = set([ 'bash' ])
+
+        for iteration in range(60):
+            if selected and random.random() < 0.4:
+                pkg = random.choice(sorted(selected))
+                preview = resolver.PreviewRemove(pkg)
+                self.assertEqual(resolver.Remove(pkg), preview)
+                selected.remove(pkg)
+            else:
+                pkg = random.choice(pkglist)
+                preview = resolver.PreviewAdd(pkg)
+                self.assertEqual(resolver.Add(pkg), preview)
+                selected.add(pkg)
+
+            full = pkgProc.ExpandDependencies(selected, ['curr', 'prev'])
+            self.assertEqual(resolver.GetPackages(), full)
+            self.assertEqual(resolver.GetTotals()[0], len(full))
+
+        resolver.Remove('gcc-g++')
+        resolver.Add('gcc-g++')
+        self.assertIn('gcc-mingw-g++', resolver)
+        self.assertEqual(resolver.PreviewAdd('gcc-mingw-g++'), (0, 0))
+        with self.assertRaises(PMCygException):
+            resolver.Add('no-such-package')
+
+    def testEpochs(self):
+        """Check that dependencies are followed separately for each epoch"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            inipath = os.path.join(tmpdir, 'setup.ini')
+            with open(inipath, 'wt') as fp:
+                fp.write('release: cygwin\narch: x86_64\n\n'
+                         '@ app\nsdesc: "Application"\nrequires: libnew\n'
+                         '[prev]\ndepends2: libold, common\n\n'
+                         '@ tool\nsdesc: "Tool"\ndepends2: common\n'
+                         '[prev]\nversion: 0.9\n\n'
+                         '@ libnew\nsdesc: "New library"\n\n'
+                         '@ libold\nsdesc: "Old library"\n\n'
+                         '@ common\nsdesc: "Common files"\n')
+            masterList = MasterPackageList('file:' + inipath,
+                                           Viewer=SilentBuildViewer())
+            pkgProc = PkgSetProcessor(masterList)
+
+            self.assertEqual(pkgProc.ExpandDependencies(['app']),
+                             [ 'app', 'libnew' ])
+            self.assertEqual(pkgProc.ExpandDependencies(['app'], ['prev']),
+                             [ 'app', 'common', 'libold' ])
+            self.assertEqual(pkgProc.ExpandDependencies(['app', 'tool'],
+                                                        ['curr', 'prev']),
+                             [ 'app', 'common', 'libnew', 'libold', 'tool' ])
+
+            tool = masterList.GetPackageDict()['tool']
+            self.assertEqual(tool.GetDependencies(['prev']), [ 'common' ])
+
+    def testClosureCosts(self):
+        """Check bulk closure costs against individual expansions"""
+        pkgProc = PkgSetProcessor(self.masterList)
+        pkgdict = self.masterList.GetPackageDict()
+        pkglist = sorted(pkgdict.keys())
+        selected = random.sample(pkglist, 20)
+        costs = pkgProc.ComputeClosureCosts(selected)
+        self.assertEqual(len(costs), len(pkgdict))
+
+        def sizes(packages):
+            files = {}
+            for pkg in packages:
+                files.update(pkgProc._downloadFiles(pkgdict[pkg], ['curr']))
+            return (len(files), sum(files.values()))
+
+        closure = set(pkgProc.ExpandDependencies(selected))
+        for pkg in random.sample(pkglist, 20) + selected[:5]:
+            expansion = set(pkgProc.ExpandDependencies([pkg]))
+            if pkg in selected:
+                others = [ p for p in selected if p != pkg ]
+                extra = closure - set(pkgProc.ExpandDependencies(others))
+            else:
+                extra = expansion - closure
+            self.assertEqual(costs[pkg],
+                             sizes(expansion) + sizes(extra)[1:])
+
+        stream = io.StringIO()
+        pkgProc.MakeCostReport(stream, selected)
+        rows = [ line.split('\t') for line in stream.getvalue().splitlines()
+                                    if not line.startswith('#') ]
+        self.assertEqual(len(rows), len(pkgdict))
+        self.assertEqual(set(row[0] for row in rows[:20]), set(selected))
 
     def checkSubset(self, entire, sub):
         missing = set(sub) - set(entire)
@@ -260,7 +882,8 @@ class testPkgSetProcessor(unittest.TestCase):
 class testBuilder(unittest.TestCase):
     def setUp(self):
         self._tmpdir = tempfile.TemporaryDirectory()
-        self.builder = PMbuilder(Viewer=SilentBuildViewer())
+        self.builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                 CacheDirectory=None)
         self.builder.setup_ini_url = getSetupURL()
         self.builder.SetTargetDir(self._tmpdir.name)
         self.makeTemplate = self.builder._pkgProc.MakeTemplate
@@ -301,7 +924,8 @@ class testBuilder(unittest.TestCase):
 
     def testDummyDownloads(self):
         for arch in [ 'x86_64' ]:
-            builder = PMbuilder(Viewer=SilentBuildViewer())
+            builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                CacheDirectory=None)
             builder.SetOption('DummyDownload', True)
             builder.SetArch(arch)
 
@@ -361,6 +985,471 @@ class testBuilder(unittest.TestCase):
 
 
 
+class testLocalMirror(unittest.TestCase):
+    """Tests of package downloading from a miniature mirror on local disk"""
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.mirror = makeLocalMirror(os.path.join(self._tmpdir.name, 'src'))
+        self.tgtdir = os.path.join(self._tmpdir.name, 'tgt')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def mkBuilder(self, **kwargs):
+        builder = PMbuilder(Viewer=SilentBuildViewer(), CacheDirectory=None,
+                            MirrorSite=self.mirror['url'],
+                            CygwinInstaller=self.mirror['exe'], **kwargs)
+        builder.setup_ini_url = self.mirror['ini']
+        builder.SetTargetDir(self.tgtdir)
+        return builder
+
+    def mkPkgSet(self):
+        pkgset = PackageSet()
+        pkgset.extend(self.mirror['packages'])
+        return pkgset
+
+    def testConcurrent(self):
+        for nthreads in (1, 4):
+            builder = self.mkBuilder(DownloadThreads=nthreads)
+            builder.BuildMirror(self.mkPkgSet())
+
+            counts = builder._fetchStats.Counts()
+            self.assertEqual(counts['Fail'], 0)
+            self.assertEqual(counts['Total'], len(self.mirror['files']))
+            self.assertEqual(counts['New'] + counts['Already'],
+                             counts['Total'])
+            self.checkFiles()
+
+        self.assertEqual(counts['Already'], counts['Total'])
+
+    def testScheduling(self):
+        downloads = [ ('src1', 30, ''), ('bin1', 10, ''), ('base1', 5, ''),
+                      ('src2', 50, ''), ('bin2', 40, '') ]
+        origins = { 'src1': ('pkg1', 'source'), 'bin1': ('pkg1', 'install'),
+                    'base1': ('base', 'install'), 'src2': ('base', 'source'),
+                    'bin2': ('pkg2', 'install') }
+        for policy, expected in [
+                ('fifo', [ 'src1', 'bin1', 'base1', 'src2', 'bin2' ]),
+                ('base-first', [ 'base1', 'src1', 'bin1', 'src2', 'bin2' ]),
+                ('binaries-first', [ 'bin1', 'base1', 'bin2', 'src1', 'src2' ]),
+                ('largest-first', [ 'src2', 'bin2', 'src1', 'bin1', 'base1' ]) ]:
+            scheduler = SCHEDULING_POLICIES[policy]()
+            ordered = scheduler.Order(downloads, origins, { 'base' })
+            self.assertEqual([ dl[0] for dl in ordered ], expected)
+
+        builder = self.mkBuilder(SchedulingPolicy='largest-first')
+        fetched = []
+        fetcher = builder._fetchPackage
+        def recordingFetcher(DLsummary, *args):
+            fetched.append(DLsummary[1])
+            return fetcher(DLsummary, *args)
+        builder._fetchPackage = recordingFetcher
+        builder.BuildMirror(self.mkPkgSet())
+        self.assertEqual(fetched, sorted(fetched, reverse=True))
+        self.checkFiles()
+
+        builder.SetOption('SchedulingPolicy', 'random')
+        self.assertRaises(PMCygException, builder.BuildMirror, self.mkPkgSet())
+
+    def testCancel(self):
+        builder = self.mkBuilder(DownloadThreads=3)
+        fetcher = builder._fetchPackage
+        def cancellingFetcher(*args):
+            builder.Cancel()
+            return fetcher(*args)
+        builder._fetchPackage = cancellingFetcher
+        builder.BuildMirror(self.mkPkgSet())
+
+        counts = builder._fetchStats.Counts()
+        self.assertEqual(counts['New'] + counts['Fail'], 0)
+
+    def testRetries(self):
+        policy = RetryPolicy(attempts=3, delay=1.0, maxDelay=5.0,
+                             rng=random.Random(17))
+        self.assertTrue(policy.Allows(3))
+        self.assertFalse(policy.Allows(4))
+        for attempt, maxdelay in [ (1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0) ]:
+            delay = policy.Delay(attempt)
+            self.assertGreaterEqual(delay, maxdelay / 2)
+            self.assertLessEqual(delay, maxdelay)
+
+        for attempts, expectFail in [ (3, 0), (2, 1) ]:
+            shutil.rmtree(self.tgtdir, ignore_errors=True)
+            builder = self.mkBuilder(DownloadThreads=3, RetryDelay=0.01,
+                                     RetryAttempts=attempts)
+            flaky = random.choice(list(self.mirror['files'].keys()))
+            calls = []
+            downloader = builder._downloadShared
+            def flakyDownloader(mirpath, *args):
+                if mirpath.endswith(flaky):
+                    calls.append(mirpath)
+                    if len(calls) < 3:
+                        return (PMbuilder.DL_Failure, 'simulated failure')
+                return downloader(mirpath, *args)
+            builder._downloadShared = flakyDownloader
+            builder.BuildMirror(self.mkPkgSet())
+
+            counts = builder._fetchStats.Counts()
+            self.assertEqual(counts['Fail'], expectFail)
+            self.assertEqual(counts['New'],
+                             len(self.mirror['files']) - expectFail)
+            self.assertEqual(len(calls), attempts)
+
+    def testHashing(self):
+        builder = self.mkBuilder()
+        os.makedirs(self.tgtdir)
+        (relpath, content) = random.choice(list(self.mirror['files'].items()))
+        pkghash = hashlib.sha512(content).hexdigest()
+        mirpath = urllib.parse.urljoin(self.mirror['url'], relpath)
+        tgtpath = os.path.join(self.tgtdir, 'pkg.tar.xz')
+
+        for expected in (PMbuilder.DL_Success, PMbuilder.DL_AlreadyPresent):
+            (outcome, errmsg) = builder._downloadSingle(mirpath, len(content),
+                                                        pkghash, tgtpath)
+            self.assertEqual(outcome, expected)
+
+        os.remove(tgtpath)
+        with open(urllib.parse.urlparse(mirpath).path, 'r+b') as fp:
+            fp.write(bytes([ content[0] ^ 0xff ]))
+        (outcome, errmsg) = builder._downloadSingle(mirpath, len(content),
+                                                    pkghash, tgtpath)
+        self.assertEqual(outcome, PMbuilder.DL_HashError)
+
+    def testVerifiedIndex(self):
+        class countingChecker(HashChecker):
+            def __call__(self, *args):
+                self.calls += 1
+                return HashChecker.__call__(self, *args)
+
+        nfiles = len(self.mirror['files'])
+        for force, expected in [ (False, 0), (False, 0),
+                                 (True, nfiles), (False, 0) ]:
+            builder = self.mkBuilder(ForceVerify=force)
+            builder._hashCheck = countingChecker()
+            builder._hashCheck.calls = 0
+            builder.BuildMirror(self.mkPkgSet())
+            self.assertEqual(builder._hashCheck.calls, expected)
+        self.assertEqual(len(builder._verified), nfiles)
+
+        relpath = random.choice(list(self.mirror['files'].keys()))
+        tgtpath = os.path.join(self.tgtdir, relpath)
+        os.utime(tgtpath, ns=(0, 0))
+        builder._hashCheck.calls = 0
+        builder.BuildMirror(self.mkPkgSet())
+        self.assertEqual(builder._hashCheck.calls, 1)
+
+        builder.BuildMirror(None)
+        garbage = builder.GetGarbage()
+        self.assertIn(tgtpath, garbage.GetFileList())
+        garbage.PurgeFiles()
+        index = VerifiedIndex(self.tgtdir)
+        index.Load()
+        self.assertLess(len(index), nfiles)
+        self.assertFalse(index.IsVerified(tgtpath, '0' * 128))
+
+    def testMultiArch(self):
+        # Derive a 32-bit mirror from the 64-bit one, sharing noarch packages:
+        srcdir = os.path.join(self._tmpdir.name, 'src')
+        for relpath, content in list(self.mirror['files'].items()):
+            if relpath.startswith('x86_64/'):
+                relpath = 'x86/' + relpath[len('x86_64/'):]
+                os.makedirs(os.path.join(srcdir, os.path.dirname(relpath)),
+                            exist_ok=True)
+                with open(os.path.join(srcdir, relpath), 'wb') as fp:
+                    fp.write(content)
+                self.mirror['files'][relpath] = content
+        with open(os.path.join(srcdir, 'x86_64', 'setup.ini'), 'rb') as fp:
+            initext = fp.read()
+        for arch in ('x86_64', 'x86'):
+            if arch == 'x86':
+                initext = initext.replace(b'x86_64', b'x86')
+            with lzma.open(os.path.join(srcdir, arch, 'setup.xz'), 'wb') as fp:
+                fp.write(initext)
+        shutil.copy(os.path.join(srcdir, 'setup-x86_64.exe'),
+                    os.path.join(srcdir, 'setup-x86.exe'))
+
+        builder = PMbuilder(Viewer=SilentBuildViewer(), CacheDirectory=None,
+                            BuildDirectory=self.tgtdir,
+                            MirrorSite=self.mirror['url'],
+                            CygwinInstaller=self.mirror['exe'],
+                            DownloadThreads=3)
+        fetched = []
+        downloader = builder._downloadSingle
+        def countingDownloader(mirpath, *args):
+            fetched.append(mirpath)
+            return downloader(mirpath, *args)
+        builder._downloadSingle = countingDownloader
+        builder.BuildMultiArch(self.mkPkgSet(), [ 'x86', 'x86_64' ])
+
+        nfiles = len(self.mirror['files'])
+        nshared = len([ f for f in self.mirror['files']
+                            if f.startswith('noarch/') ])
+        counts = builder._fetchStats.Counts()
+        self.assertEqual(counts['Fail'], 0)
+        self.assertEqual(counts['Total'], nfiles + nshared)
+        self.assertEqual(counts['New'], nfiles)
+        self.assertEqual(len(fetched), nfiles)
+        self.assertEqual(len(set(fetched)), nfiles)
+        self.checkFiles()
+        for arch in ('x86', 'x86_64'):
+            self.assertTrue(os.path.isfile(os.path.join(self.tgtdir,
+                                                        arch, 'setup.ini')))
+            self.assertTrue(os.path.isfile(os.path.join(self.tgtdir,
+                                            'setup-{0}.exe'.format(arch))))
+
+        self.assertEqual(builder.GetGarbage().GetFileList(), [])
+
+    def testPrefixedViewer(self):
+        lines = []
+        class RecordingViewer(BuildViewer):
+            def _output(self, text, severity):
+                lines.append(text)
+        viewer = PrefixedBuildViewer(RecordingViewer(), 'x86')
+        viewer.startOperation('Retrieving setup.ini')
+        viewer('Interjection')
+        viewer.endOperation('done')
+        viewer.startOperation('Scanning')
+        viewer.flushOperation()
+        self.assertEqual(lines, [ '[x86] Interjection\n',
+                                  '[x86] Retrieving setup.ini... done\n',
+                                  '[x86] Scanning...\n' ])
+
+    def testPackageStore(self):
+        storedir = os.path.join(self._tmpdir.name, 'store')
+        nfiles = len(self.mirror['files'])
+        builders = []
+        for tgtdir, expected in [ ('tgt', nfiles), ('tgt2', 0), ('tgt', 0) ]:
+            builder = self.mkBuilder(PackageStore=storedir)
+            builder.SetTargetDir(os.path.join(self._tmpdir.name, tgtdir))
+            fetched = []
+            downloader = builder._downloadFresh
+            def countingDownloader(mirpath, *args):
+                fetched.append(mirpath)
+                return downloader(mirpath, *args)
+            builder._downloadFresh = countingDownloader
+            builder.BuildMirror(self.mkPkgSet())
+            self.assertEqual(len(fetched), expected)
+            self.assertEqual(builder._fetchStats.Counts()['Fail'], 0)
+            builders.append(builder)
+        self.checkFiles()
+
+        store = PackageStore(storedir)
+        for relpath, content in self.mirror['files'].items():
+            pkghash = hashlib.sha512(content).hexdigest()
+            self.assertTrue(store.Contains(pkghash, len(content)))
+            tgtpath = os.path.join(self._tmpdir.name, 'tgt2', relpath)
+            self.assertTrue(os.path.samefile(tgtpath, store.GetPath(pkghash)))
+
+        for builder, remaining in [ (builders[0], nfiles), (builders[1], 0) ]:
+            builder.BuildMirror(None)
+            builder.GetGarbage().PurgeFiles()
+            self.assertEqual(len([ h for h in self.mirror['files'].values()
+                                    if store.Contains(
+                                            hashlib.sha512(h).hexdigest()) ]),
+                             remaining)
+
+    def testPackageStoreCopies(self):
+        store = PackageStore(os.path.join(self._tmpdir.name, 'store'))
+        def copier(srcpath, tgtpath):
+            shutil.copyfile(srcpath, tgtpath)
+            return False
+        store._clone = copier
+        content = b'pretend package'
+        pkghash = hashlib.sha512(content).hexdigest()
+        srcpath = os.path.join(self._tmpdir.name, 'pkg.tar.xz')
+        with open(srcpath, 'wb') as fp:
+            fp.write(content)
+        with store.Locked(pkghash):
+            self.assertTrue(store.Insert(srcpath, pkghash))
+        os.remove(srcpath)
+
+        # Entries shared by copying cannot be known to be unused:
+        self.assertEqual(store.Prune(), 0)
+        self.assertTrue(store.Contains(pkghash, len(content)))
+
+        store.Evict(pkghash)
+        with store.Locked(hashlib.sha512(b'other').hexdigest()):
+            pass
+        self.assertEqual(store.Prune(), 0)
+        self.assertEqual([ f for (_, _, files) in os.walk(store.GetTopDir())
+                                for f in files ], [])
+
+    def testForeignStoreFiles(self):
+        store = PackageStore(os.path.join(self._tmpdir.name, 'store'))
+        pkghash = hashlib.sha512(b'pretend package').hexdigest()
+        entrydir = os.path.dirname(store.GetPath(pkghash))
+        os.makedirs(entrydir)
+        foreign = [ os.path.join(store.GetTopDir(), 'README'),
+                    os.path.join(entrydir, 'README'),
+                    os.path.join(entrydir, pkghash[:127]),
+                    os.path.join(entrydir, '0' * 128) ]
+        for path in foreign:
+            with open(path, 'wb') as fp:
+                fp.write(b'not a package')
+        stale = store.GetPath(pkghash) + '.123-456.tmp'
+        with open(stale, 'wb') as fp:
+            fp.write(b'incomplete')
+        os.utime(stale, (1e9, 1e9))
+
+        self.assertEqual(store.Prune(), 0)
+        self.assertFalse(os.path.exists(stale))
+        for path in foreign:
+            self.assertTrue(os.path.isfile(path))
+
+    def testStoreLockScope(self):
+        holding = []
+        unlocked = PackageStore.Locked
+        @contextlib.contextmanager
+        def tracked(store, pkghash):
+            with unlocked(store, pkghash):
+                holding.append(pkghash)
+                try:
+                    yield
+                finally:
+                    holding.remove(pkghash)
+
+        builder = self.mkBuilder(DownloadThreads=1, PackageStore=
+                                 os.path.join(self._tmpdir.name, 'store'))
+        retrievals = []
+        retriever = builder._retrieve
+        def trackingRetriever(*args):
+            retrievals.append(list(holding))
+            return retriever(*args)
+        builder._retrieve = trackingRetriever
+        PackageStore.Locked = tracked
+        try:
+            builder.BuildMirror(self.mkPkgSet())
+        finally:
+            PackageStore.Locked = unlocked
+
+        # The store should not be locked while packages are downloaded:
+        self.assertEqual(len(retrievals), len(self.mirror['files']))
+        self.assertEqual([ r for r in retrievals if r ], [])
+        self.checkFiles()
+
+    def testCorruptStore(self):
+        storedir = os.path.join(self._tmpdir.name, 'store')
+        self.mkBuilder(PackageStore=storedir).BuildMirror(self.mkPkgSet())
+
+        store = PackageStore(storedir)
+        (relpath, content) = sorted(self.mirror['files'].items())[0]
+        path = store.GetPath(hashlib.sha512(content).hexdigest())
+        os.remove(path)
+        with open(path, 'wb') as fp:
+            fp.write(bytes(len(content)))
+
+        for engine in ('threads', 'asyncio'):
+            builder = self.mkBuilder(PackageStore=storedir,
+                                     DownloadEngine=engine)
+            builder.SetTargetDir(os.path.join(self._tmpdir.name, engine))
+            builder.BuildMirror(self.mkPkgSet())
+            self.assertEqual(builder._fetchStats.Counts()['Fail'], 0)
+            with open(os.path.join(self._tmpdir.name, engine, relpath),
+                      'rb') as fp:
+                self.assertEqual(fp.read(), content)
+            with open(path, 'rb') as fp:
+                self.assertEqual(fp.read(), content)
+
+    def testMirrorFailover(self):
+        srcdir = os.path.join(self._tmpdir.name, 'src')
+        urls = [ self.mirror['url'] ]
+        for label in ('current', 'stale'):
+            mirdir = os.path.join(self._tmpdir.name, label)
+            shutil.copytree(srcdir, mirdir)
+            urls.append(self.mirror['url'].replace('/src/', '/' + label + '/'))
+
+        # Each file is missing from at most one current mirror,
+        # except one only held by a stale mirror that does not list it:
+        (orphan, missing, other) = random.sample(
+                                    sorted(self.mirror['files'].keys()), 3)
+        for label, relpath in [ ('src', orphan), ('src', missing),
+                                ('current', orphan), ('current', other) ]:
+            os.remove(os.path.join(self._tmpdir.name, label, relpath))
+        inipath = os.path.join(self._tmpdir.name, 'stale', 'x86_64', 'setup.ini')
+        with open(inipath, 'rt', encoding='utf-8') as fp:
+            initext = fp.read()
+        initext = initext.replace('setup-timestamp: 1700000000',
+                                  'setup-timestamp: 1600000000')
+        initext = initext.replace(orphan, orphan + '.missing')
+        with open(inipath, 'wt', encoding='utf-8') as fp:
+            fp.write(initext)
+
+        builder = self.mkBuilder(DownloadThreads=3)
+        builder.mirror_urls = urls
+        fetched = []
+        downloader = builder._downloadShared
+        def countingDownloader(mirpath, *args):
+            fetched.append(mirpath)
+            return downloader(mirpath, *args)
+        builder._downloadShared = countingDownloader
+        builder.BuildMirror(self.mkPkgSet())
+
+        self.assertEqual(builder._mirrorSet.GetCurrent(), urls[:2])
+        self.assertEqual(builder._mirrorSet.GetStale(), urls[2:])
+        counts = builder._fetchStats.Counts()
+        self.assertEqual(counts['Fail'], 1)
+        self.assertEqual(counts['New'], len(self.mirror['files']) - 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tgtdir, orphan)))
+        for url in urls[:2]:
+            self.assertTrue(any(f.startswith(url) for f in fetched))
+        self.assertFalse(any(f.startswith(urls[2]) for f in fetched
+                                if f.endswith(orphan)))
+        self.assertEqual(len([ f for f in fetched if f.endswith(orphan) ]), 2)
+
+    def checkFiles(self):
+        for relpath, content in self.mirror['files'].items():
+            with open(os.path.join(self.tgtdir, relpath), 'rb') as fp:
+                self.assertEqual(fp.read(), content, msg=relpath)
+
+
+
+def makeLocalMirror(topdir, npkgs=12, arch='x86_64'):
+    """Create miniature Cygwin mirror beneath a local directory"""
+
+    files = {}
+    inilines = [ 'release: cygwin', 'arch: ' + arch,
+                 'setup-timestamp: 1700000000', 'setup-version: 2.926', '' ]
+    packages = [ 'pkg{0:02d}'.format(n) for n in range(npkgs) ]
+
+    for n, pkg in enumerate(packages):
+        relpath = '{0}/release/{1}/{1}-1.0-1.tar.xz'.format(
+                        ('noarch' if n % 3 == 0 else arch), pkg)
+        content = bytes(random.getrandbits(8)
+                        for i in range(random.randint(1, 1 << 14)))
+        files[relpath] = content
+        inilines.extend([
+            '@ ' + pkg,
+            'sdesc: "Test package {0:d}"'.format(n),
+            'category: Test',
+            'version: 1.0-1',
+            'install: {0} {1:d} {2}'.format(relpath, len(content),
+                                            hashlib.sha512(content).hexdigest()) ])
+        if n > 0:
+            inilines.append('depends2: ' + packages[n // 2])
+        inilines.append('')
+
+    for relpath, content in files.items():
+        fullpath = os.path.join(topdir, relpath)
+        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+        with open(fullpath, 'wb') as fp:
+            fp.write(content)
+
+    inipath = os.path.join(topdir, arch, 'setup.ini')
+    with open(inipath, 'wt', encoding='utf-8') as fp:
+        fp.write('\n'.join(inilines))
+    exepath = os.path.join(topdir, 'setup-' + arch + '.exe')
+    with open(exepath, 'wb') as fp:
+        fp.write(b'MZ' + bytes(1 << 10))
+
+    urlprefix = 'file://' + topdir.replace('\\', '/') + '/'
+    return { 'url': urlprefix,
+             'ini': urllib.parse.urljoin(urlprefix, arch + '/setup.ini'),
+             'exe': urllib.parse.urljoin(urlprefix, 'setup${_arch}.exe'),
+             'files': files,
+             'packages': packages }
+
+
+
 class testPackageSets(unittest.TestCase):
     def setUp(self):
         pass
@@ -494,7 +1583,8 @@ class testPackageLists(unittest.TestCase):
             url = urllib.parse.urljoin(self._urlprefix, cfg)
 
             with tempfile.TemporaryDirectory() as tmpdir:
-                builder = PMbuilder(Viewer=SilentBuildViewer())
+                builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                    CacheDirectory=None)
                 builder.setup_ini_url = url
                 builder.SetTargetDir(tmpdir)
 
@@ -552,6 +1642,78 @@ class testMirrorLists(unittest.TestCase):
                 self.fail('Mirror %s does not appear in official list'
                           % url)
 
+    def testCachedList(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            srcdir = os.path.join(tmpdir, 'src')
+            os.makedirs(srcdir)
+            with open(os.path.join(srcdir, 'mirrors.lst'), 'wb') as fp:
+                fp.write(PMbuilder._makeFallbackMirrorList().read())
+            server = LocalHTTPServer(srcdir)
+            try:
+                for reload, ttl, expected in [ (False, 3600, 1),
+                                               (False, 3600, 1),
+                                               (True, 3600, 2),
+                                               (False, 0, 3) ]:
+                    builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                        CacheDirectory=tmpdir,
+                                        MirrorListTTL=ttl)
+                    builder._mirrorListURL = server.url + 'mirrors.lst'
+                    builder._pool = ConnectionPool(maxIdle=0)
+                    mirrors = builder.ReadMirrorList(reload=reload)
+                    self.assertTrue(('Japan' in mirrors['Asia']))
+                    self.assertEqual(server.requests, expected)
+            finally:
+                server.shutdown()
+
+    def testProbing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for label in ('fast', 'broken'):
+                os.makedirs(os.path.join(tmpdir, label, 'x86_64'))
+            with open(os.path.join(tmpdir, 'fast', 'x86_64', 'setup.xz'),
+                      'wb') as fp:
+                fp.write(bytes(1 << 18))
+            server = LocalHTTPServer(tmpdir)
+            urls = [ server.url + label + '/' for label in ('broken', 'fast') ]
+            try:
+                builder = PMbuilder(Viewer=SilentBuildViewer(),
+                                    CacheDirectory=tmpdir)
+                self.assertEqual(builder.ProbeMirrors(urls), urls[1:])
+                history = builder.GetMirrorHistory()
+                self.assertGreater(history.Get(urls[1])['throughput'], 0)
+                self.assertEqual(history.Get(urls[0])['fail'], 1)
+
+                # Recently probed mirrors should not be probed again:
+                nrequests = server.requests
+                builder._mirrordict = { 'Local': { 'Here': [
+                                            ('fast', urls[1]),
+                                            ('broken', urls[0]) ] } }
+                self.assertEqual(builder.AutoSelectMirrors([ 'auto' ]),
+                                 urls[1:])
+                self.assertEqual(server.requests, nrequests)
+
+                score = history.Score(urls[1])
+                history.RecordBuild(urls[1], 0, 10, 0, 0.0)
+                self.assertGreater(history.Score(urls[1]), score)
+            finally:
+                server.shutdown()
+
+    def testHistoryExpiry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'mirror-history.json')
+            history = MirrorHistory(path)
+            history.MaxEntries = 3
+            URLs = [ 'http://mirror{0:d}.example/'.format(i)
+                        for i in range(5) ]
+            for idx, URL in enumerate(URLs):
+                history.RecordBuild(URL, 1, 0, 1 << 20, 1.0)
+                history.Get(URL)['seen'] -= 10 * (len(URLs) - idx)
+            history.Get(URLs[4])['seen'] -= 2 * history.MaxAge
+            history.Save()
+
+            history = MirrorHistory(path)
+            history.Load()
+            self.assertEqual(history.Rank(URLs), URLs[1:4])
+
     def mkSets(self, fp):
         regionDict = {}
         urlDict = {}
@@ -569,6 +1731,58 @@ class testMirrorLists(unittest.TestCase):
 
 
 
+class testFetchStats(unittest.TestCase):
+    def testProgress(self):
+        downloads = [ ('a.tar.xz', 1000, None), ('b.tar.xz', 3000, None) ]
+        stats = FetchStats(downloads)
+        self.assertIsNone(stats.ETA())
+
+        stats.StartTransfer('a.tar.xz', 1000)
+        stats.StartTransfer('b.tar.xz', 3000, offset=500)
+        time.sleep(0.02)
+        stats.AddProgress('a.tar.xz', 400)
+        stats.AddProgress('b.tar.xz', 100, 600)
+        time.sleep(0.02)
+        stats.AddProgress('a.tar.xz', 600)
+        self.assertEqual(sorted(stats.InFlight()),
+                         [ ('a.tar.xz', 1000, 1000), ('b.tar.xz', 600, 3000) ])
+        self.assertEqual(stats.Sizes()['InFlight'], 1600)
+        self.assertGreater(stats.Throughput(), 0)
+        self.assertGreater(stats.ETA(), 0)
+
+        stats.EndTransfer('a.tar.xz')
+        stats.AddNew('a.tar.xz', 1000)
+        stats.EndTransfer('b.tar.xz', succeeded=False)
+        self.assertEqual(stats.InFlight(), [])
+        self.assertEqual(list(stats.Timings().keys()), [ 'a.tar.xz' ])
+        (latency, duration) = stats.Timings()['a.tar.xz']
+        self.assertGreaterEqual(latency, 0.02)
+        self.assertGreater(duration, 0)
+        self.assertIn('ETA', stats.Describe())
+
+    def testAggregate(self):
+        stats = [ FetchStats([ ('a.tar.xz', 1000, None) ]),
+                  FetchStats([ ('b.tar.xz', 3000, None) ]) ]
+        stats[0].StartTransfer('a.tar.xz', 1000)
+        stats[1].StartTransfer('b.tar.xz', 3000)
+        time.sleep(0.02)
+        stats[0].AddProgress('a.tar.xz', 400)
+        stats[1].AddProgress('b.tar.xz', 600)
+        time.sleep(0.02)
+        stats[1].AddProgress('b.tar.xz', 100)
+
+        combined = AggregateFetchStats(stats)
+        self.assertEqual(combined.TotalSize(), 4000)
+        self.assertEqual(combined.Sizes()['InFlight'], 1100)
+        self.assertEqual(sorted(combined.InFlight()),
+                         [ ('a.tar.xz', 400, 1000), ('b.tar.xz', 700, 3000) ])
+        self.assertGreater(combined.Throughput(), stats[0].Throughput())
+        stats[0].EndTransfer('a.tar.xz')
+        stats[0].AddNew('a.tar.xz', 1000)
+        self.assertEqual(combined.Counts()['New'], 1)
+        self.assertIn('1 active', combined.Describe())
+
+
 class testGarbageCollector(unittest.TestCase):
     def testAbsentTopdir(self):
         with tempfile.TemporaryDirectory() as topdir:
@@ -707,7 +1921,6 @@ class testGarbageConfirmer(unittest.TestCase):
             self.assertEqual(doDelete, 'no')
             self.assertFalse(confirmer.UserAsked)
 
-
     def testYes(self):
         for susp in [False, True] * 2:
             for resp in ['no', 'yes']: